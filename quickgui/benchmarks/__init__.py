@@ -0,0 +1,14 @@
+'''
+Benchmarks for queues, launchers and transports.
+
+Run with:
+
+    python -m quickgui.benchmarks [--quick] [--output FILE] [--baseline FILE]
+
+See quickgui.benchmarks.run for details.
+
+The load generator simulates a fleet of clients connected
+to a task server, see quickgui.benchmarks.loadgen:
+
+    python -m quickgui.benchmarks.loadgen [--clients 10 100 1000]
+'''
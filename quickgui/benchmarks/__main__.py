@@ -0,0 +1,3 @@
+from quickgui.benchmarks.run import main
+
+main()
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+'''
+Launcher benchmarks: round trips between a GUI and an echo task,
+connected by launcher.start() or launcher_exchange.start(),
+with or without an additional socket server.
+'''
+
+import time
+import queue
+import functools
+
+from quickgui.framework import launcher, launcher_exchange
+from quickgui.framework.quick_base import handler, handled_commands
+from quickgui.framework.quick_base import set_time_to_die
+from quickgui.framework.quick_task import QuickTask
+from quickgui.framework.socket_server import get_server
+from quickgui.benchmarks.common import CMD, make_line, line_index, summarize
+from quickgui.benchmarks.common import free_port
+
+LAUNCHERS = {
+    'launcher': launcher.start,
+    'exchange': launcher_exchange.start,
+}
+
+
+class EchoTask(QuickTask):
+    '''Sends back every benchmark line'''
+
+    @handler(CMD)
+    def echo(self, value):
+        self.send('%s %s' % (CMD, value))
+
+
+def echo_task(qin, qout):
+    EchoTask(qin, qout).run()
+
+
+echo_task.subscriptions = handled_commands(EchoTask)
+
+
+class _Gui():
+    '''Sends all lines, then waits for the echoes'''
+
+    def __init__(self, lines, timeout):
+        self.lines = lines
+        self.timeout = timeout
+        self.send_times = [0.0] * len(lines)
+        self.recv_times = []
+
+    def __call__(self, qin, qout):
+        for i, line in enumerate(self.lines):
+            self.send_times[i] = time.perf_counter()
+            qout.put(line)
+
+        deadline = time.monotonic() + self.timeout
+        while len(self.recv_times) < len(self.lines):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items = qin.get_many(timeout=remaining)
+            except queue.Empty:
+                continue
+            now = time.perf_counter()
+            for item in items:
+                if isinstance(item, str):
+                    index = line_index(item)
+                    if index is not None:
+                        self.recv_times.append((index, now))
+
+
+def bench_launcher(name, with_server, n, size, timeout=30):
+    '''Round-trip throughput and latency through the launcher `name`'''
+    gui = _Gui([make_line(i, size) for i in range(n)], timeout)
+    servers = [get_server('localhost', free_port())] if with_server else []
+
+    try:
+        LAUNCHERS[name](task=echo_task, gui=gui, task_servers=servers)
+    finally:
+        set_time_to_die(False)
+
+    params = {'size': size, 'server': with_server}
+    return summarize(_name(name, with_server, size), params,
+                     gui.send_times, gui.recv_times)
+
+
+def _name(name, with_server, size):
+    topology = name + ('+server' if with_server else '')
+    return 'launcher/%s/size=%d' % (topology, size)
+
+
+def cases(n, sizes):
+    '''(name, callable) for each benchmark'''
+    for name in LAUNCHERS:
+        for with_server in (False, True):
+            for size in sizes:
+                yield (_name(name, with_server, size),
+                       functools.partial(bench_launcher, name, with_server,
+                                         n, size))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+'''
+Queue benchmarks: one producer thread putting lines into a queue,
+and one consumer thread for each output queue.
+'''
+
+import time
+import functools
+import threading
+
+from quickgui.framework.queues import PollableQueue, NewLineQueue, MultiQueue
+from quickgui.benchmarks.common import make_line, summarize, consume
+
+MULTIQUEUE_OUTPUTS = 4
+
+QUEUES = {
+    'PollableQueue': lambda: [PollableQueue()] * 2,
+    'NewLineQueue': lambda: [NewLineQueue()] * 2,
+    'MultiQueue': lambda: _multiqueue(MULTIQUEUE_OUTPUTS),
+}
+
+
+def _multiqueue(n):
+    q = MultiQueue(n, NewLineQueue)
+    return [q] + q.qlist
+
+
+def bench_queue(name, n, size, timeout=30):
+    '''Throughput and latency of the queue type `name`'''
+    producer_q, *consumer_qs = QUEUES[name]()
+    lines = [make_line(i, size) for i in range(n)]
+    send_times = [0.0] * n
+    recv_times = []
+
+    threads = [threading.Thread(target=consume,
+                                args=(q, n, recv_times, timeout))
+               for q in consumer_qs]
+    for t in threads:
+        t.start()
+
+    for i, line in enumerate(lines):
+        send_times[i] = time.perf_counter()
+        producer_q.put(line)
+
+    for t in threads:
+        t.join()
+
+    params = {'size': size, 'outputs': len(consumer_qs)}
+    return summarize(_name(name, size), params,
+                     send_times, recv_times, expected=n * len(consumer_qs))
+
+
+def _name(name, size):
+    return 'queue/%s/size=%d' % (name, size)
+
+
+def cases(n, sizes):
+    '''(name, callable) for each benchmark'''
+    for name in QUEUES:
+        for size in sizes:
+            yield _name(name, size), functools.partial(bench_queue, name, n, size)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+'''
+Socket transport benchmarks: lines put into the task output queue
+of a server, and received by one or more clients.
+'''
+
+import time
+import queue
+import functools
+import threading
+
+from quickgui.framework import socket_server, socket_server_threaded
+from quickgui.framework import socket_server_async, socket_server_selectors
+from quickgui.framework import socket_client, socket_client_threaded
+from quickgui.framework import socket_client_async
+from quickgui.framework.queues import NewLineQueue
+from quickgui.benchmarks.common import make_line, summarize, consume
+from quickgui.benchmarks.common import Threads, free_port, wait_for_server
+
+SERVERS = {
+    'socket_server': socket_server.get_server,
+    'socket_server_threaded': socket_server_threaded.get_server,
+    'socket_server_async': socket_server_async.get_server,
+    'socket_server_selectors': socket_server_selectors.get_server,
+}
+
+CLIENTS = {
+    'socket_client': socket_client.get_client,
+    'socket_client_threaded': socket_client_threaded.get_client,
+    'socket_client_async': socket_client_async.get_client,
+}
+
+
+def _wait_ready(qin, n_clients, timeout):
+    '''Wait for the READY line sent by each client after connecting'''
+    ready = set()
+    deadline = time.monotonic() + timeout
+    while len(ready) < n_clients and time.monotonic() < deadline:
+        try:
+            items = qin.get_many(timeout=0.1)
+        except queue.Empty:
+            continue
+        ready.update(item for item in items if item.startswith('READY'))
+    return len(ready) == n_clients
+
+
+def bench_socket(server, client, n_clients, n, size, timeout=30):
+    '''Throughput and latency from a server to `n_clients` clients'''
+    port = free_port()
+    qin = NewLineQueue()
+    qout = NewLineQueue()
+    lines = [make_line(i, size) for i in range(n)]
+    send_times = [0.0] * n
+    recv_times = []
+
+    with Threads() as threads:
+        threads.start(SERVERS[server]('localhost', port), qin, qout)
+        wait_for_server(port)
+
+        consumers = []
+        for c in range(n_clients):
+            client_qin = NewLineQueue()
+            client_qout = NewLineQueue()
+            threads.start(CLIENTS[client]('localhost', port),
+                          client_qin, client_qout)
+            client_qout.put('READY %d\n' % c)
+            consumers.append(threading.Thread(
+                target=consume, args=(client_qin, n, recv_times, timeout)))
+
+        if not _wait_ready(qin, n_clients, timeout):
+            print('%s: not all clients connected' % server)
+        for t in consumers:
+            t.start()
+
+        for i, line in enumerate(lines):
+            send_times[i] = time.perf_counter()
+            qout.put(line)
+
+        for t in consumers:
+            t.join()
+
+    params = {'size': size, 'clients': n_clients}
+    return summarize(_name(server, client, n_clients, size), params,
+                     send_times, recv_times, expected=n * n_clients)
+
+
+def _name(server, client, n_clients, size):
+    return 'socket/%s/%s/clients=%d/size=%d' % (server, client, n_clients, size)
+
+
+def cases(n, sizes, client_counts):
+    '''(name, callable) for each benchmark'''
+    for server in SERVERS:
+        for client in CLIENTS:
+            for n_clients in client_counts:
+                for size in sizes:
+                    yield (_name(server, client, n_clients, size),
+                           functools.partial(bench_socket, server, client,
+                                             n_clients, n, size))
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+'''
+Helpers shared by the benchmarks.
+
+Benchmark messages are text lines like 'BENCH <index> <padding>',
+so that the receiver can match each one with its send time,
+and the same messages can travel through every queue and transport.
+'''
+
+import time
+import queue
+import select
+import socket
+import threading
+
+from quickgui.framework.quick_base import set_time_to_die
+
+CMD = 'BENCH'
+
+
+def make_line(index, size):
+    '''Benchmark line with `index`, padded to `size` bytes'''
+    line = '%s %d ' % (CMD, index)
+    return line + 'x' * max(size - len(line) - 1, 0) + '\n'
+
+
+def line_index(line):
+    '''Index of a benchmark line, or None for other messages'''
+    parts = line.split(maxsplit=2)
+    if len(parts) < 2 or parts[0] != CMD:
+        return None
+    return int(parts[1])
+
+
+def percentile(sorted_values, p):
+    '''The `p` percentile (0-100) of an already sorted list'''
+    if not sorted_values:
+        return None
+    idx = min(int(len(sorted_values) * p / 100.0), len(sorted_values) - 1)
+    return sorted_values[idx]
+
+
+def summarize(name, params, send_times, recv_times, expected=None):
+    '''
+    Build a benchmark result.
+
+    `send_times` is a list of send timestamps indexed by message,
+    and `recv_times` a list of (index, receive timestamp) pairs,
+    possibly from more than one receiver. `expected` is the number
+    of receptions in a lossless run (default: len(send_times)).
+    '''
+    if expected is None:
+        expected = len(send_times)
+    latencies = sorted(t - send_times[i] for i, t in recv_times)
+    if recv_times:
+        elapsed = max(t for _, t in recv_times) - send_times[0]
+    else:
+        elapsed = 0
+    return {'name': name,
+            'params': params,
+            'messages': len(recv_times),
+            'delivered': len(recv_times) / expected if expected else 1.0,
+            'throughput': len(recv_times) / elapsed if elapsed > 0 else 0.0,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99)}
+
+
+def consume(q, n, recv_times, timeout):
+    '''
+    Get `n` benchmark lines from `q`, appending (index, receive time)
+    pairs to `recv_times`. Other messages are ignored.
+    '''
+    deadline = time.monotonic() + timeout
+    received = 0
+    while received < n:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        r, _, _ = select.select([q], [], [], remaining)
+        if not r:
+            continue
+        try:
+            items = q.get_many(block=False)
+        except queue.Empty:
+            continue
+        now = time.perf_counter()
+        for item in items:
+            index = line_index(item) if isinstance(item, str) else None
+            if index is not None:
+                recv_times.append((index, now))
+                received += 1
+
+
+def free_port():
+    '''A TCP port that is currently free on localhost'''
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('localhost', 0))
+        return sock.getsockname()[1]
+
+
+class Threads():
+    '''
+    Threads running framework callables, like servers and clients.
+
+    On exit, sets the shutdown flag, waits for all threads and
+    clears the flag again, so that the next benchmark can run.
+    '''
+
+    def __init__(self):
+        self.threads = []
+
+    def start(self, target, *args):
+        t = threading.Thread(target=target, args=args)
+        t.start()
+        self.threads.append(t)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        set_time_to_die(True)
+        for t in self.threads:
+            t.join()
+        set_time_to_die(False)
+
+
+def wait_for_server(port, timeout=5):
+    '''Wait until a server accepts connections on `port`'''
+    def accepting():
+        try:
+            socket.create_connection(('localhost', port)).close()
+            return True
+        except OSError:
+            return False
+    return wait_until(accepting, timeout)
+
+
+def wait_until(condition, timeout):
+    '''Wait until condition() is true. Returns False on timeout.'''
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
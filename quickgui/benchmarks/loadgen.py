@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+'''
+Load generator for task servers.
+
+Starts the motor example task behind a socket server, in a separate
+process, and connects a fleet of simulated clients to it. All clients
+are multiplexed in a single thread of this process, so that thousands
+of them can be simulated without thousands of threads.
+
+Each client sends commands at `--rate` commands per second, picked at
+random from a weighted mix like 'MOVE=9,SIMUL=1'. Command values are
+generated for the motor commands (see COMMANDS), and other commands
+are sent without a value.
+
+Besides the usual motor status, the task process puts PROBE lines into
+the task output queue at `--probe-rate` lines per second. Each probe
+carries a sequence number and its creation time, so that each client
+can measure the lag between the task and itself, and count the probes
+that never reached it (gaps in the sequence numbers).
+
+For each server and number of clients, the report gives the time taken
+to connect all clients, the aggregate and per-client receive rates,
+the probe lag percentiles, the number of dropped probes and the number
+of commands handled by the task. Per-client details are included
+in the JSON output.
+
+Examples:
+
+    python -m quickgui.benchmarks.loadgen
+    python -m quickgui.benchmarks.loadgen --clients 10 100 1000 --duration 20
+    python -m quickgui.benchmarks.loadgen --servers socket_server_threaded \\
+           --mix MOVE=1 --rate 10 --output fleet.json
+'''
+
+import os
+import sys
+import json
+import time
+import queue
+import random
+import socket
+import argparse
+import platform
+import selectors
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:   # Not available on Windows
+    resource = None
+
+from quickgui.framework.framing import StreamDecoder
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.quick_base import set_time_to_die, shutdown
+from quickgui.examples.motor.motor_task import MotorTask, RealMotor, SimulatedMotor
+from quickgui.benchmarks.bench_sockets import SERVERS
+from quickgui.benchmarks.common import percentile, free_port, wait_for_server
+
+PROBE = 'PROBE'
+
+# Value generators for the motor commands
+COMMANDS = {
+    'MOVE': lambda: '%.3f' % random.uniform(-100, 100),
+    'SIMUL': lambda: '1',
+}
+
+DEFAULT_SERVERS = ['socket_server', 'socket_server_threaded']
+DEFAULT_CLIENTS = [10, 100, 1000]
+DEFAULT_MIX = 'MOVE=9,SIMUL=1'
+
+DEFAULT_CONNECT_RATE = 200
+
+RECV_SIZE = 65536
+CONNECT_TIMEOUT = 10
+
+
+def parse_mix(mix):
+    '''
+    Parse a command mix like 'MOVE=9,SIMUL=1'.
+
+    Returns a list of (command, weight) tuples. Weights default to 1.
+    '''
+    result = []
+    for item in mix.split(','):
+        cmd, _, weight = item.strip().partition('=')
+        if not cmd:
+            raise ValueError('Empty command in mix: %s' % mix)
+        result.append((cmd, float(weight) if weight else 1.0))
+    return result
+
+
+def make_command(cmd):
+    value = COMMANDS.get(cmd)
+    return '%s %s\n' % (cmd, value()) if value else cmd + '\n'
+
+
+def _probe(qout, rate, sent):
+    '''Put PROBE lines into qout until shutdown'''
+    seq = 0
+    while not shutdown.wait(1.0 / rate):
+        qout.put('%s %d %.6f\n' % (PROBE, seq, time.monotonic()))
+        seq += 1
+        sent[0] = seq
+
+
+def _task_process(server, port, period, probe_rate, stop, results, verbose):
+    '''
+    Entry point of the task process.
+
+    Runs the motor task, its server and the probe thread until `stop`
+    is set, and then puts the task statistics into `results`.
+    '''
+    if not verbose:
+        sys.stdout = open(os.devnull, 'w')
+
+    qin = NewLineQueue()
+    qout = NewLineQueue()
+    task = MotorTask(qin, qout, RealMotor, SimulatedMotor)
+    task.period = period
+    sent = [0]
+
+    def watch_stop():
+        stop.wait()
+        results.put({'task': task.stats(), 'probes': sent[0]})
+        set_time_to_die(True)
+
+    threads = [threading.Thread(target=SERVERS[server]('localhost', port),
+                                args=(qin, qout)),
+               threading.Thread(target=_probe, args=(qout, probe_rate, sent))]
+    for t in threads:
+        t.start()
+    threading.Thread(target=watch_stop, daemon=True).start()
+    task.run()
+    for t in threads:
+        t.join()
+
+
+class _Client():
+    '''A simulated client with its receive statistics'''
+
+    def __init__(self, index, sock):
+        self.index = index
+        self.sock = sock
+        self.decoder = StreamDecoder()
+        self.outbuf = bytearray()
+        self.connected = True
+        self.commands = 0
+        self.received = 0
+        self.lags = []
+        self.probes = []    # (sequence number, creation time)
+
+    def receive(self, now):
+        items = self.decoder.recv(self.sock, RECV_SIZE)
+        if items is None:
+            raise OSError('Disconnected')
+        for line in items:
+            self.received += 1
+            if line.startswith(PROBE):
+                _, seq, t = line.split()
+                self.probes.append((int(seq), float(t)))
+                self.lags.append(now - float(t))
+
+    def send(self, line):
+        self.outbuf += line.encode()
+        try:
+            n = self.sock.send(self.outbuf)
+            del self.outbuf[:n]
+        except BlockingIOError:
+            pass
+        self.commands += 1
+
+    def reset(self):
+        '''Forget what was received before the measurement started'''
+        self.received = 0
+        self.lags = []
+        self.probes = []
+
+
+class Fleet():
+    '''
+    A fleet of simulated text clients, served by a single thread.
+    '''
+
+    def __init__(self, port, n, connect_rate=DEFAULT_CONNECT_RATE):
+        self.port = port
+        self.n = n
+        self.connect_rate = connect_rate
+        self.clients = []
+        self.failed = 0
+        self.connect_time = None
+
+    def connect(self):
+        '''
+        Connect all clients, at most `connect_rate` per second (0 = no limit).
+
+        Servers with a short listen backlog drop connection requests
+        arriving faster than they can accept them, and each dropped
+        request costs about one second to the client.
+        '''
+        t0 = time.monotonic()
+        for index in range(self.n):
+            if self.connect_rate > 0:
+                delay = t0 + index / self.connect_rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            try:
+                sock = socket.create_connection(('localhost', self.port),
+                                                timeout=CONNECT_TIMEOUT)
+            except OSError as e:
+                print('Client %d failed to connect: %s' % (index, e))
+                self.failed += 1
+                continue
+            sock.setblocking(False)
+            self.clients.append(_Client(index, sock))
+        self.connect_time = time.monotonic() - t0
+
+    def close(self):
+        for client in self.clients:
+            client.sock.close()
+
+    def run(self, duration, rate, mix, warmup=1.0, drain=1.0):
+        '''
+        Send commands for `duration` seconds, after `warmup` seconds,
+        and keep receiving for `drain` more seconds.
+        '''
+        selector = selectors.DefaultSelector()
+        for client in self.clients:
+            selector.register(client.sock, selectors.EVENT_READ, client)
+
+        cmds = [cmd for cmd, _ in mix]
+        weights = [weight for _, weight in mix]
+        interval = 1.0 / rate if rate > 0 else None
+
+        now = time.monotonic()
+        start = now + warmup
+        stop = start + duration
+        end = stop + drain
+        next_send = {client: now + random.uniform(0, interval or 0)
+                     for client in self.clients}
+        measuring = False
+
+        while now < end:
+            if not measuring and now >= start:
+                for client in self.clients:
+                    client.reset()
+                measuring = True
+
+            if interval and now < stop:
+                for client, t in next_send.items():
+                    if t <= now and client.connected:
+                        client.send(make_command(
+                                random.choices(cmds, weights)[0]))
+                        next_send[client] = t + interval
+                timeout = min(min(next_send.values(), default=end), end) - now
+            else:
+                timeout = end - now
+
+            for key, _ in selector.select(max(timeout, 0)):
+                client = key.data
+                try:
+                    client.receive(time.monotonic())
+                except BlockingIOError:
+                    pass
+                except OSError:
+                    client.connected = False
+                    selector.unregister(client.sock)
+            now = time.monotonic()
+
+        selector.close()
+        self.duration = duration + drain
+        self.stop_time = stop
+
+    def report(self):
+        '''
+        Per-client statistics, after run()
+
+        Dropped probes are the gaps in the sequence numbers of each client,
+        up to the last probe received by any client. Probes created after
+        the end of the load are ignored, because they may still be on
+        their way to some clients.
+        '''
+        seqs = [[seq for seq, t in client.probes if t <= self.stop_time]
+                for client in self.clients]
+        last = max((max(s) for s in seqs if s), default=None)
+        first = min((min(s) for s in seqs if s), default=None)
+        result = []
+        for client, s in zip(self.clients, seqs):
+            lags = sorted(client.lags)
+            if last is None:
+                dropped = 0
+            elif not s:
+                dropped = last - first + 1
+            else:
+                dropped = last - min(s) + 1 - len(s)
+            result.append({'client': client.index,
+                           'connected': client.connected,
+                           'commands': client.commands,
+                           'received': client.received,
+                           'rate': client.received / self.duration,
+                           'probes': len(lags),
+                           'dropped': dropped,
+                           'lag_p50': percentile(lags, 50),
+                           'lag_p99': percentile(lags, 99),
+                           'lag_max': lags[-1] if lags else None})
+        return result
+
+
+def _raise_fd_limit(n):
+    '''Raise the open files limit, if needed, to host `n` clients'''
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = n + 256
+    if soft != resource.RLIM_INFINITY and soft < wanted:
+        if hard != resource.RLIM_INFINITY:
+            wanted = min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+
+
+def run_load(server, n_clients, duration=10, rate=1.0, mix=DEFAULT_MIX,
+             probe_rate=10.0, period=0.5, connect_rate=DEFAULT_CONNECT_RATE,
+             verbose=False):
+    '''
+    Run the task behind `server` with `n_clients` simulated clients.
+
+    Returns a dictionary with the summary and the per-client statistics.
+    '''
+    _raise_fd_limit(n_clients)
+    port = free_port()
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(
+                target=_task_process,
+                args=(server, port, period, probe_rate, stop, results, verbose))
+    process.start()
+
+    fleet = Fleet(port, n_clients, connect_rate)
+    try:
+        if not wait_for_server(port):
+            raise RuntimeError('%s did not start' % server)
+        fleet.connect()
+        fleet.run(duration, rate, parse_mix(mix))
+    finally:
+        stop.set()
+        try:
+            task_results = results.get(timeout=10)
+        except queue.Empty:
+            task_results = None
+        process.join(10)
+        if process.is_alive():
+            process.terminate()
+        fleet.close()
+
+    clients = fleet.report()
+    return {'server': server,
+            'clients': n_clients,
+            'params': {'duration': duration, 'rate': rate, 'mix': mix,
+                       'probe_rate': probe_rate, 'period': period,
+                       'connect_rate': connect_rate},
+            'summary': summarize(fleet, clients, task_results),
+            'per_client': clients,
+            'task': task_results['task'] if task_results else None}
+
+
+def summarize(fleet, clients, task_results):
+    '''Summary of the per-client statistics of a run'''
+    rates = sorted(c['rate'] for c in clients)
+    lags = sorted(lag for client in fleet.clients for lag in client.lags)
+    summary = {'connected': sum(c['connected'] for c in clients),
+               'failed': fleet.failed,
+               'connect_time': fleet.connect_time,
+               'commands_sent': sum(c['commands'] for c in clients),
+               'received': sum(c['received'] for c in clients),
+               'rate': sum(rates),
+               'client_rate_min': rates[0] if rates else 0.0,
+               'client_rate_p50': percentile(rates, 50) or 0.0,
+               'lag_p50': percentile(lags, 50),
+               'lag_p99': percentile(lags, 99),
+               'lag_max': lags[-1] if lags else None,
+               'dropped': sum(c['dropped'] for c in clients),
+               'clients_dropping': sum(c['dropped'] > 0 for c in clients),
+               'commands_handled': None}
+    if task_results:
+        dispatch = task_results['task']['dispatch']
+        summary['commands_handled'] = sum(s['count'] for s in dispatch.values())
+        summary['probes_sent'] = task_results['probes']
+    return summary
+
+
+def _ms(seconds):
+    return '%8.2f' % (seconds * 1e3) if seconds is not None else '     n/a'
+
+
+HEADER = ('%-24s %7s %9s %8s %11s %11s %11s %11s %8s %9s' %
+          ('server', 'clients', 'connected', 'conn s', 'msg/s',
+           'min cl/s', 'lag p50 ms', 'lag p99 ms', 'dropped', 'handled'))
+
+
+def format_row(result):
+    s = result['summary']
+    handled = s['commands_handled']
+    return '%-24s %7d %9d %8.2f %11.0f %11.2f    %s    %s %8d %9s' % (
+        result['server'], result['clients'], s['connected'],
+        s['connect_time'], s['rate'], s['client_rate_min'],
+        _ms(s['lag_p50']), _ms(s['lag_p99']), s['dropped'],
+        handled if handled is not None else 'n/a')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+                prog='python -m quickgui.benchmarks.loadgen',
+                description='Simulated client fleet against the motor task')
+    parser.add_argument('--servers', nargs='+', default=DEFAULT_SERVERS,
+                        choices=sorted(SERVERS),
+                        help='servers to test (default: %(default)s)')
+    parser.add_argument('--clients', type=int, nargs='+',
+                        default=DEFAULT_CLIENTS,
+                        help='numbers of clients (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='seconds of load for each run '
+                             '(default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=1,
+                        help='commands per second sent by each client '
+                             '(default: %(default)s)')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='weighted command mix (default: %(default)s)')
+    parser.add_argument('--probe-rate', type=float, default=10,
+                        help='PROBE lines per second sent by the task '
+                             '(default: %(default)s)')
+    parser.add_argument('--period', type=float, default=0.5,
+                        help='period of the motor status updates '
+                             '(default: %(default)s)')
+    parser.add_argument('--connect-rate', type=float,
+                        default=DEFAULT_CONNECT_RATE,
+                        help='new connections per second, 0 for no limit '
+                             '(default: %(default)s)')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--verbose', action='store_true',
+                        help='show the output of the task and its server')
+    args = parser.parse_args(argv)
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = []
+    print(HEADER)
+    for server in args.servers:
+        for n_clients in args.clients:
+            result = run_load(server, n_clients, args.duration, args.rate,
+                              args.mix, args.probe_rate, args.period,
+                              args.connect_rate, args.verbose)
+            print(format_row(result), flush=True)
+            results.append(result)
+
+    if args.output:
+        report = {'meta': {'python': platform.python_version(),
+                           'platform': platform.platform(),
+                           'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+                  'results': results}
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmark runner.
+
+Runs the queue, launcher and socket benchmarks, sweeping over message
+size and client count, and writes the results as JSON. Each result
+has a unique name, the throughput in messages per second, the
+p50 and p99 latencies in seconds, and the fraction of messages
+that were delivered.
+
+With --baseline, results are compared with a previously saved JSON
+file, and the exit status is 1 if any benchmark has regressed by more
+than --tolerance (relative) in throughput or p50 latency, or if it
+delivered fewer messages. Latency percentiles of single runs are
+noisy, so p99 is reported but not checked.
+
+Examples:
+
+    python -m quickgui.benchmarks --output baseline.json
+    python -m quickgui.benchmarks --baseline baseline.json
+    python -m quickgui.benchmarks --quick --only socket_server_threaded
+'''
+
+import sys
+import json
+import time
+import argparse
+import platform
+
+from quickgui.benchmarks import bench_queues, bench_launchers, bench_sockets
+
+SUITES = ('queues', 'launchers', 'sockets')
+
+DEFAULT_TOLERANCE = 0.2
+
+
+def run_suites(suites, quick=False, sizes=None, client_counts=None, only=None):
+    '''Run the selected suites and return the list of results'''
+    scale = 10 if quick else 1
+    sizes = sizes or [16, 1024]
+    client_counts = client_counts or [1, 8]
+
+    cases = {
+        'queues': lambda: bench_queues.cases(100000 // scale, sizes),
+        'launchers': lambda: bench_launchers.cases(20000 // scale, sizes),
+        'sockets': lambda: bench_sockets.cases(20000 // scale, sizes,
+                                               client_counts),
+    }
+
+    results = []
+    for suite in suites:
+        for name, bench in cases[suite]():
+            if only and only not in name:
+                continue
+            result = bench()
+            print(format_result(result), flush=True)
+            results.append(result)
+    return results
+
+
+def _ms(seconds):
+    return '%9.3f' % (seconds * 1e3) if seconds is not None else '      n/a'
+
+
+def format_result(result):
+    return '%-70s %10.0f msg/s  p50 %s ms  p99 %s ms  delivered %5.1f%%' % (
+        result['name'], result['throughput'], _ms(result['p50']),
+        _ms(result['p99']), result['delivered'] * 100)
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''
+    Compare results with a baseline.
+
+    Returns a list of (name, description) tuples for each regression.
+    Benchmarks missing from either side are ignored.
+    '''
+    base = {r['name']: r for r in baseline}
+    regressions = []
+    for result in results:
+        old = base.get(result['name'])
+        if old is None:
+            continue
+        name = result['name']
+        if result['throughput'] < old['throughput'] * (1 - tolerance):
+            regressions.append((name, 'throughput %.0f -> %.0f msg/s' %
+                                (old['throughput'], result['throughput'])))
+        if old['p50'] is not None and result['p50'] is not None and \
+                result['p50'] > old['p50'] * (1 + tolerance):
+            regressions.append((name, 'p50 %s -> %s ms' %
+                                (_ms(old['p50']).strip(),
+                                 _ms(result['p50']).strip())))
+        if result['delivered'] < old['delivered']:
+            regressions.append((name, 'delivered %.1f%% -> %.1f%%' %
+                                (old['delivered'] * 100,
+                                 result['delivered'] * 100)))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+                prog='python -m quickgui.benchmarks',
+                description='Benchmarks for queues, launchers and transports')
+    parser.add_argument('suites', nargs='*',
+                        help='suites to run, among %s (default: all)' %
+                             ', '.join(SUITES))
+    parser.add_argument('--quick', action='store_true',
+                        help='run with 10 times fewer messages')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        help='message sizes in bytes (default: 16 1024)')
+    parser.add_argument('--clients', type=int, nargs='+',
+                        help='client counts for sockets (default: 1 8)')
+    parser.add_argument('--only', help='only run benchmarks whose name '
+                                       'contains this string')
+    parser.add_argument('--output', help='save the results to this JSON file')
+    parser.add_argument('--baseline', help='compare with this JSON file')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='relative tolerance for regressions '
+                             '(default: %(default)s)')
+    args = parser.parse_args(argv)
+    for suite in args.suites:
+        if suite not in SUITES:
+            parser.error('unknown suite: %s' % suite)
+
+    results = run_suites(args.suites or SUITES, args.quick, args.sizes,
+                         args.clients, args.only)
+
+    report = {'meta': {'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'quick': args.quick},
+              'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for name, description in regressions:
+            print('REGRESSION %s: %s' % (name, description))
+        if regressions:
+            sys.exit(1)
+        print('No regressions')
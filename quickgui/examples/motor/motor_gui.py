@@ -13,7 +13,7 @@ from PyQt5.QtWidgets import QApplication, QLabel, QWidget
 from PyQt5.QtWidgets import QPushButton
 from PyQt5.QtWidgets import QLineEdit, QHBoxLayout, QVBoxLayout
 
-from quickgui.framework import QuickQtGui, handler
+from quickgui.framework import QuickQtGui, handler, handler_float
 
 
 class MotorGui(QuickQtGui):
@@ -81,9 +81,9 @@ class MotorGui(QuickQtGui):
         moving = 'MOVING' if int(data) else 'IDLE'
         self.curstatus.setText(moving)
 
-    @handler('POS')
-    def refresh_pos(self, data):
-        self.curpos.setText(data)
+    @handler_float('POS')
+    def refresh_pos(self, pos):
+        self.curpos.setText('%f' % pos)
 
     @handler('SIMULATED')
     def refresh_simul(self, data):
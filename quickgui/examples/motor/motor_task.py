@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import random
+import threading
 
 from quickgui.framework import QuickTask, periodic, \
                                handler_int, handler_float
+from quickgui.framework.quick_base import handled_commands
 
 
 class MotorTask(QuickTask):
@@ -14,21 +16,31 @@ class MotorTask(QuickTask):
         self.motor_class = motor_class
         self.simul_class = simul_class
         self.period = 0.5
+        self.keepalive = 5
         self.motor = simul_class()
+        # MOVE runs in a separate thread: it takes the current motor
+        # under this lock, and moves it without holding the lock,
+        # so that SIMUL never waits for a move to complete.
+        self.motor_lock = threading.Lock()
 
     def is_simulated(self):
         return self.motor.__class__ == self.simul_class
 
     @handler_int('SIMUL')
     def simul(self, enable):
-        if enable != 0 and not self.is_simulated():
-            self.motor = self.simul_class()
-        elif enable == 0 and self.is_simulated():
-            self.motor = self.motor_class()
-
-    @handler_float('MOVE')
+        with self.motor_lock:
+            if enable != 0 and not self.is_simulated():
+                self.motor = self.simul_class()
+            elif enable == 0 and self.is_simulated():
+                self.motor = self.motor_class()
+
+    # Real motors may take a while to accept a command: run in a
+    # separate thread, so that the status keeps being refreshed.
+    @handler_float('MOVE', concurrent=True)
     def move(self, pos):
-        self.motor.moveto(pos)
+        with self.motor_lock:
+            motor = self.motor
+        motor.moveto(pos)
 
     @periodic
     def refresh_status(self):
@@ -36,9 +48,9 @@ class MotorTask(QuickTask):
         moving, pos = self.motor.query()
         simulated = (self.motor.__class__ == self.simul_class)
 
-        self.send('MOVING %s' % int(moving))
-        self.send('POS %f' % pos)
-        self.send('SIMULATED %d' % int(simulated))
+        self.send_cached('MOVING', value=int(moving))
+        self.send_cached('POS', value=pos)
+        self.send_cached('SIMULATED', value=int(simulated))
 
 
 class SimulatedMotor():
@@ -101,4 +113,8 @@ def task(qin, qout):
     motor = MotorTask(qin, qout, RealMotor, SimulatedMotor)
     motor.run()
 
+
+# Commands to be routed to the task by launcher_exchange
+task.subscriptions = handled_commands(MotorTask)
+
 # ___oOo___
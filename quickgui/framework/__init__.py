@@ -1,6 +1,7 @@
 
 
 from .quick_task import QuickTask, periodic
+from .async_quick_task import AsyncQuickTask
 from .quick_base import handler, handler_int, handler_float, handler_str
 from .quick_qt_gui import QuickQtGui
 from .launcher import start, self_contained_app
@@ -8,6 +9,6 @@ from .socket_client import get_client
 from .socket_server import get_server
 
 
-__all__ = ['QuickTask', 'QuickQtGui', 'periodic', 'handler',
+__all__ = ['QuickTask', 'AsyncQuickTask', 'QuickQtGui', 'periodic', 'handler',
            'handler_int', 'handler_float', 'handler_str', 'start',
            'self_contained_app', 'get_client', 'get_server']
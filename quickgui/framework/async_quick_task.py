@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import time
+import queue
+import asyncio
+import inspect
+
+from quickgui.framework.quick_base import DispatchError, shutdown
+from quickgui.framework.quick_task import QuickTask
+
+
+class AsyncQuickTask(QuickTask):
+    '''
+    A task running its handlers in an asyncio event loop
+
+    Handlers and periodic handlers are declared as in QuickTask,
+    with @handler and @periodic, but they can also be coroutines
+    (async def). The event loop waits on the file descriptor of
+    `qin`, so no thread is needed to receive commands, and many
+    asyncio device drivers can be driven by a single task.
+
+    Coroutine handlers are started as soon as their command is
+    received, and run concurrently with all other handlers. Calls of
+    the same handler are run one at a time and in order, or one at a
+    time for each key if the handler has a `key` function (see handler()).
+    Up to `max_in_flight` coroutine handlers can be waiting or running:
+    further commands are refused with a DispatchError.
+
+    Each periodic handler runs in its own asyncio task, so a slow
+    coroutine only delays its own next tick.
+
+    Plain handlers are called directly by the event loop, and must
+    not block. Handlers declared with concurrent=True run in a thread
+    pool, as in QuickTask.
+
+    At shutdown, coroutine handlers still running are cancelled.
+    '''
+
+    def __init__(self, qin, qout):
+        super().__init__(qin, qout)
+        self._tasks = set()
+        self._last = {}       # key -> last task started for the key
+        self._rejected = 0
+
+    def dispatch(self, msg):
+        '''
+        Call the handler for `msg`, or start it if it is a coroutine.
+
+        Coroutine handlers can only be started from the event loop
+        running in run().
+        '''
+        cmd, handler, arg = self._prepare(msg)
+        if inspect.iscoroutinefunction(handler.func):
+            self._start(msg, cmd, handler, arg)
+        elif handler.concurrent:
+            self._submit(msg, cmd, handler, arg)
+        else:
+            self._call(msg, cmd, handler, arg)
+
+    def _start(self, msg, cmd, handler, arg):
+        '''Start a coroutine handler after the previous one with its key'''
+        key = self._key(cmd, handler, arg)
+        if len(self._tasks) >= self.max_in_flight:
+            self._rejected += 1
+            self._refuse(cmd)
+
+        previous = self._last.get(key)
+        task = asyncio.ensure_future(
+                    self._call_async(previous, msg, cmd, handler, arg))
+        self._tasks.add(task)
+        self._last[key] = task
+
+        def done(task):
+            self._tasks.discard(task)
+            if self._last.get(key) is task:
+                del self._last[key]
+        task.add_done_callback(done)
+
+    async def _call_async(self, previous, msg, cmd, handler, arg):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            with self._handling(msg, cmd):
+                await handler.func(*arg)
+        except DispatchError as e:
+            print(e)
+
+    async def _run_timer(self, timer):
+        '''Periodic handler loop, with the same policies as QuickTask'''
+        while True:
+            await asyncio.sleep(max(timer.deadline - time.monotonic(), 0))
+            timer._begin(time.monotonic())
+            try:
+                result = timer.func()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                timer._error(e)
+            timer._advance()
+
+    def _read(self):
+        try:
+            msgs = self.qin.get_many(block=False)
+        except queue.Empty:
+            return
+
+        for msg in msgs:
+            try:
+                self.dispatch(msg)
+            except DispatchError as e:
+                print(e)
+
+    def stats(self):
+        stats = super().stats()
+        stats['coroutines'] = {'in_flight': len(self._tasks),
+                               'max_in_flight': self.max_in_flight,
+                               'rejected': self._rejected}
+        return stats
+
+    async def _main(self):
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+
+        def stop_loop():
+            loop.remove_reader(shutdown)
+            stop.set_result(None)
+
+        self._start_timers()
+        timers = [asyncio.ensure_future(self._run_timer(timer))
+                  for timer in self._timers]
+        loop.add_reader(self.qin, self._read)
+        loop.add_reader(shutdown, stop_loop)
+        try:
+            await stop
+        finally:
+            loop.remove_reader(self.qin)
+            tasks = timers + list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self):
+        '''
+        Main task loop
+
+        Runs the event loop until the shutdown flag is set.
+        '''
+        asyncio.run(self._main())
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+# ___oOo___
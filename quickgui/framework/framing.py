@@ -0,0 +1,490 @@
+# -*- coding: utf-8 -*-
+'''
+Wire formats for socket connections.
+
+By default, connections use the newline-terminated UTF-8 text protocol.
+A peer can switch its own sending direction to length-prefixed binary
+frames by sending HELLO. Since HELLO starts with a NUL byte, which never
+appears in the text protocol, it can be detected at any point of a text
+stream. Servers reply to a client HELLO with their own HELLO, after which
+both directions are binary. Legacy text clients never send HELLO and
+keep receiving text.
+
+Each binary frame is made of:
+
+- payload length (4 bytes, unsigned, network order)
+- value type (1 byte, see the TYPE_* constants)
+- command length (1 byte) and command (UTF-8)
+- value, whose encoding depends on its type
+
+Numeric values are sent as IEEE doubles or 64-bit integers, so that
+they round-trip exactly. Plain text lines are sent as TYPE_TEXT frames.
+
+Traced messages (see the tracing module) are sent as TYPE_TRACED frames,
+with an empty command and a value made of:
+
+- trace length (4 bytes, unsigned, network order)
+- trace as UTF-8 JSON
+- the payload of the message frame
+
+NumPy arrays are sent as TYPE_ARRAY frames, whose value is made of:
+
+- dtype length (1 byte) and dtype string (ASCII, like '<f8')
+- number of dimensions (1 byte)
+- shape (8 bytes, unsigned, network order, for each dimension)
+- the raw array data in C order
+
+Arrays are sent without intermediate copies using scatter-gather
+I/O (see encode_buffers() and send_buffers()), and received directly
+into their own preallocated buffer with recv_into().
+'''
+
+import json
+import socket
+import struct
+import codecs
+
+from quickgui.framework.messages import Message, to_text, is_array, np
+from quickgui.framework.queues import LineSplitter
+from quickgui.framework.tracing import tracer, TracedMessage, Trace
+
+HELLO = b'\x00QGB1\n'
+
+TYPE_NONE = b'N'
+TYPE_TEXT = b't'
+TYPE_STR = b's'
+TYPE_BOOL = b'?'
+TYPE_INT = b'q'
+TYPE_FLOAT = b'd'
+TYPE_ARRAY = b'a'
+TYPE_TRACED = b'T'
+
+_length = struct.Struct('!I')
+_header = struct.Struct('!IcB')
+_int = struct.Struct('!q')
+_float = struct.Struct('!d')
+_dim = struct.Struct('!Q')
+
+INT_MIN = -2**63
+INT_MAX = 2**63 - 1
+
+# Maximum number of buffers in a single sendmsg() call
+IOV_MAX = 1024
+
+# Buffers smaller than this are joined together by coalesce()
+COALESCE_SIZE = 4096
+
+
+class FramingError(Exception):
+    '''Malformed binary frame'''
+
+    pass
+
+
+def _array_header(arr):
+    dtype = arr.dtype.str.encode('ascii')
+    return bytes([len(dtype)]) + dtype + bytes([arr.ndim]) + \
+        b''.join(_dim.pack(n) for n in arr.shape)
+
+
+def _parse_array_header(buf, pos):
+    '''
+    Parse an array header starting at `pos`.
+
+    Returns (dtype, shape, end position), or None if `buf`
+    does not contain the whole header yet.
+    '''
+    if len(buf) < pos + 1:
+        return None
+    dtype_end = pos + 1 + buf[pos]
+    if len(buf) < dtype_end + 1:
+        return None
+    ndim = buf[dtype_end]
+    end = dtype_end + 1 + ndim * _dim.size
+    if len(buf) < end:
+        return None
+    if np is None:
+        raise FramingError('Received an array, but NumPy is not available')
+    dtype = np.dtype(bytes(buf[pos + 1:dtype_end]).decode('ascii'))
+    if dtype.hasobject:
+        raise FramingError('Object arrays are not supported')
+    shape = tuple(_dim.unpack_from(buf, dtype_end + 1 + i * _dim.size)[0]
+                  for i in range(ndim))
+    return dtype, shape, end
+
+
+def _empty_array(dtype, shape, size):
+    '''
+    Allocate an array for a frame with `size` bytes of array data.
+
+    The size declared by the header is checked before allocating,
+    so that a malformed frame cannot allocate arbitrary amounts
+    of memory. Python integers do not overflow.
+    '''
+    nbytes = dtype.itemsize
+    for n in shape:
+        nbytes *= n
+    if nbytes != size:
+        raise FramingError('Wrong array size')
+    return np.empty(shape, dtype)
+
+
+def _byte_view(arr):
+    return memoryview(arr).cast('B')
+
+
+def encode_buffers(items):
+    '''
+    Encode a list of queue items as binary frames.
+
+    Returns a list of bytes-like objects to be sent in order.
+    Consecutive small frames are joined together, while array
+    data is referenced with a memoryview and never copied.
+    '''
+    buffers = []
+    small = []
+    for item in items:
+        if isinstance(item, Message) and is_array(item.value):
+            arr = item.value
+            if arr.dtype.hasobject:
+                raise FramingError('Object arrays are not supported')
+            arr = np.ascontiguousarray(arr)
+            cmd = item.cmd.encode('utf-8')
+            if len(cmd) > 255:
+                raise FramingError('Command too long: %s' % item.cmd)
+            header = _array_header(arr)
+            length = 2 + len(cmd) + len(header) + arr.nbytes
+            small.append(_header.pack(length, TYPE_ARRAY, len(cmd)) + cmd + header)
+            buffers.append(b''.join(small))
+            buffers.append(_byte_view(arr))
+            small = []
+        else:
+            small.append(encode_frame(item))
+    if small:
+        buffers.append(b''.join(small))
+    return buffers
+
+
+def encode_frame(item):
+    '''Encode a queue item (either a Message or a text line) as a frame'''
+    if not isinstance(item, Message):
+        cmd = b''
+        vtype = TYPE_TEXT
+        value = item.encode('utf-8')
+    elif is_array(item.value):
+        return b''.join(encode_buffers([item]))
+    elif isinstance(item, TracedMessage):
+        tracer.hop([item], 'socket_send')
+        trace = json.dumps(item.trace.to_dict()).encode('utf-8')
+        inner = encode_frame(Message(item.cmd, item.value))[_length.size:]
+        cmd = b''
+        vtype = TYPE_TRACED
+        value = _length.pack(len(trace)) + trace + inner
+    else:
+        cmd = item.cmd.encode('utf-8')
+        v = item.value
+        if np is not None and isinstance(v, np.generic):
+            v = v.item()   # NumPy scalar
+        if v is None:
+            vtype, value = TYPE_NONE, b''
+        elif isinstance(v, bool):
+            vtype, value = TYPE_BOOL, b'\x01' if v else b'\x00'
+        elif isinstance(v, int) and INT_MIN <= v <= INT_MAX:
+            vtype, value = TYPE_INT, _int.pack(v)
+        elif isinstance(v, float):
+            vtype, value = TYPE_FLOAT, _float.pack(v)
+        else:
+            vtype, value = TYPE_STR, str(v).encode('utf-8')
+
+    if len(cmd) > 255:
+        raise FramingError('Command too long: %s' % item.cmd)
+
+    length = 2 + len(cmd) + len(value)
+    return _header.pack(length, vtype, len(cmd)) + cmd + value
+
+
+def encode_frames(items):
+    '''Encode a list of queue items as binary frames'''
+    return b''.join(map(encode_frame, items))
+
+
+def encode_text(items):
+    '''
+    Encode a list of queue items with the text protocol.
+
+    Traces of traced messages are complete after this step.
+    '''
+    if tracer.enabled:
+        for item in items:
+            if isinstance(item, TracedMessage):
+                tracer.hop([item], 'socket_send')
+                tracer.finish(item)
+    return ''.join(map(to_text, items)).encode('utf-8')
+
+
+def nbytes(buffers):
+    '''Total size in bytes of a list of buffers'''
+    return sum(memoryview(buf).nbytes for buf in buffers)
+
+
+def coalesce(buffers, small=COALESCE_SIZE):
+    '''
+    Join consecutive buffers smaller than `small` bytes.
+
+    Copying a few small buffers together costs less than sending
+    each of them as a separate part of a gathered write.
+    Large buffers, like array data, are never copied.
+    '''
+    result = []
+    pending = []
+    for buf in buffers:
+        size = len(buf) if isinstance(buf, bytes) else memoryview(buf).nbytes
+        if size < small:
+            pending.append(buf)
+            continue
+        if pending:
+            result.append(b''.join(pending))
+            pending = []
+        result.append(buf)
+    if pending:
+        result.append(b''.join(pending))
+    return result
+
+
+def send_buffers(sock, buffers):
+    '''
+    Send all `buffers` on `sock`, in order.
+
+    Uses scatter-gather sendmsg() where available, so that
+    buffers are never joined together.
+    '''
+    if not hasattr(sock, 'sendmsg'):
+        for buf in buffers:
+            sock.sendall(buf)
+        return
+
+    views = [memoryview(buf).cast('B') for buf in buffers]
+    i = 0
+    while i < len(views):
+        n = sock.sendmsg(views[i:i + IOV_MAX])
+        while n > 0:
+            if n >= len(views[i]):
+                n -= len(views[i])
+                i += 1
+            else:
+                views[i] = views[i][n:]
+                n = 0
+        while i < len(views) and len(views[i]) == 0:
+            i += 1
+
+
+def decode_payload(payload):
+    '''Decode the payload of a single frame'''
+    if len(payload) < 2:
+        raise FramingError('Frame too short')
+
+    vtype = payload[0:1]
+    cmdlen = payload[1]
+    cmd = bytes(payload[2:2 + cmdlen]).decode('utf-8')
+    value = payload[2 + cmdlen:]
+
+    if vtype == TYPE_TEXT:
+        return bytes(value).decode('utf-8')
+    elif vtype == TYPE_NONE:
+        return Message(cmd)
+    elif vtype == TYPE_BOOL:
+        return Message(cmd, value != b'\x00')
+    elif vtype == TYPE_INT:
+        return Message(cmd, _int.unpack(value)[0])
+    elif vtype == TYPE_FLOAT:
+        return Message(cmd, _float.unpack(value)[0])
+    elif vtype == TYPE_STR:
+        return Message(cmd, bytes(value).decode('utf-8'))
+    elif vtype == TYPE_TRACED:
+        n, = _length.unpack_from(value)
+        trace = json.loads(bytes(value[_length.size:_length.size + n]))
+        msg = decode_payload(value[_length.size + n:])
+        if not tracer.enabled:
+            return msg
+        hops = [tuple(hop) for hop in trace['hops']]
+        msg = TracedMessage(msg.cmd, msg.value, Trace(trace['id'], hops))
+        tracer.hop([msg], 'socket_recv')
+        return msg
+    elif vtype == TYPE_ARRAY:
+        header = _parse_array_header(value, 0)
+        if header is None:
+            raise FramingError('Truncated array header')
+        dtype, shape, end = header
+        arr = _empty_array(dtype, shape, len(value) - end)
+        _byte_view(arr)[:] = value[end:]
+        return Message(cmd, arr)
+    else:
+        raise FramingError('Unknown frame type %r' % vtype)
+
+
+def _read_exact(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError
+    return data
+
+
+def read_frame(f):
+    '''
+    Read and decode a single frame from the binary file object `f`.
+
+    Array data is read directly into the array buffer.
+    Returns None at end of file.
+    '''
+    try:
+        length, = _length.unpack(_read_exact(f, _length.size))
+        start = _read_exact(f, 2)
+        if start[0:1] != TYPE_ARRAY:
+            return decode_payload(start + _read_exact(f, length - 2))
+
+        cmd = _read_exact(f, start[1])
+        header = _read_exact(f, 1)
+        header += _read_exact(f, header[0] + 1)
+        header += _read_exact(f, header[-1] * _dim.size)
+        dtype, shape, _ = _parse_array_header(header, 0)
+        arr = _empty_array(dtype, shape, length - 2 - len(cmd) - len(header))
+        data = _byte_view(arr)
+        if len(data) > 0 and f.readinto(data) < len(data):
+            raise EOFError
+        return Message(cmd.decode('utf-8'), arr)
+
+    except EOFError:
+        return None
+
+
+class StreamDecoder():
+    '''
+    Incremental decoder for the data received on a connection.
+
+    Decodes text until the peer sends HELLO, and binary frames
+    afterwards. feed() returns a list of decoded items, complete
+    text lines or Messages, ready to be put into a NewLineQueue.
+    Partial lines are kept in the decoder until they are completed,
+    so that lines from different connections never get mixed
+    in a shared queue.
+    `binary` tells whether the peer has switched to binary frames.
+
+    recv() reads from a socket and decodes in one step. As soon as
+    the header of an array frame has been decoded, the array is
+    allocated and its data is received directly into it.
+    The total number of bytes read by recv() is kept in `bytes_received`.
+    '''
+
+    def __init__(self):
+        self.binary = False
+        self.bytes_received = 0
+        self._buf = bytearray()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._lines = LineSplitter()
+        self._array = None   # Tuple (cmd, array, byte view, filled bytes)
+
+    def recv(self, sock, bufsize=65536):
+        '''
+        Receive data from `sock` and decode it.
+
+        Returns the list of decoded items, or None if the
+        connection has been closed.
+        '''
+        if self._array is not None:
+            cmd, arr, data, filled = self._array
+            n = sock.recv_into(data[filled:])
+            if n == 0:
+                return None
+            self.bytes_received += n
+            return self._fill_array(n)
+
+        data = sock.recv(bufsize)
+        if not data:
+            return None
+        self.bytes_received += len(data)
+        return self.feed(data)
+
+    def _fill_array(self, n):
+        cmd, arr, data, filled = self._array
+        filled += n
+        if filled < len(data):
+            self._array = (cmd, arr, data, filled)
+            return []
+        self._array = None
+        return [Message(cmd, arr)]
+
+    def feed(self, data):
+        if self._array is not None:
+            _, _, view, filled = self._array
+            n = min(len(data), len(view) - filled)
+            view[filled:filled + n] = data[:n]
+            items = self._fill_array(n)
+            if not items:
+                return items
+            return items + self.feed(data[n:])
+
+        if self.binary:
+            self._buf += data
+            return self._decode_frames()
+
+        data = bytes(self._buf) + data
+        self._buf.clear()
+
+        idx = data.find(b'\x00')
+        if idx < 0:
+            return self._lines.split([self._text.decode(data)])
+
+        items = self._lines.split([self._text.decode(data[:idx])])
+
+        rest = data[idx:]
+        if rest.startswith(HELLO):
+            self.binary = True
+            self._buf += rest[len(HELLO):]
+            items += self._decode_frames()
+        elif HELLO.startswith(rest):
+            self._buf += rest   # Partial HELLO, wait for more
+        else:
+            raise FramingError('Unexpected NUL byte in text stream')
+        return items
+
+    def _decode_frames(self):
+        items = []
+        buf = self._buf
+        pos = 0
+        with memoryview(buf) as view:
+            while len(buf) - pos >= _length.size:
+                length, = _length.unpack_from(buf, pos)
+                end = pos + _length.size + length
+                if end > len(buf):
+                    if self._start_array(view, pos, end):
+                        pos = len(buf)
+                    break
+                items.append(decode_payload(view[pos + _length.size:end]))
+                pos = end
+        del buf[:pos]
+        return items
+
+    def _start_array(self, view, pos, end):
+        '''
+        Start receiving an incomplete array frame directly into the array.
+
+        Returns True if the array has been allocated, after copying
+        into it all the data already available in `view`.
+        '''
+        start = pos + _length.size
+        if len(view) < start + 2 or view[start:start + 1] != TYPE_ARRAY:
+            return False
+        cmd_end = start + 2 + view[start + 1]
+        header = _parse_array_header(view, cmd_end)
+        if header is None:
+            return False
+
+        dtype, shape, data_start = header
+        arr = _empty_array(dtype, shape, end - data_start)
+        data = _byte_view(arr)
+
+        cmd = bytes(view[start + 2:cmd_end]).decode('utf-8')
+        available = view[data_start:]
+        data[:len(available)] = available
+        self._array = (cmd, arr, data, len(available))
+        return True
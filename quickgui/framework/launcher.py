@@ -7,14 +7,37 @@ communication queues.
 
 '''
 
-import queue
 import threading
+import functools
+import multiprocessing
 from collections.abc import Iterable
 
-from quickgui.framework.queues import MultiQueue, NewLineQueue
+from quickgui.framework.queues import MultiQueue, NewLineQueue, PollableQueue
+from quickgui.framework.queues import ProcessQueue, BLOCK
 from quickgui.framework.quick_base import set_time_to_die
 
-def start(task=None, gui=None, task_servers=None, gui_client=None):
+# Launch modes
+THREAD = 'thread'
+PROCESS = 'process'
+
+
+def _watch_stop(stop):
+    stop.wait()
+    set_time_to_die(True)
+
+
+def _run_process(target, stop, qin, qout):
+    '''
+    Entry point for task and server processes.
+
+    Propagates the `stop` event to the shutdown flag of the process.
+    '''
+    threading.Thread(target=_watch_stop, args=(stop,), daemon=True).start()
+    target(qin, qout)
+
+
+def start(task=None, gui=None, task_servers=None, gui_client=None,
+          maxsize=0, overflow=BLOCK, queue_class=NewLineQueue, mode=THREAD):
     '''
     App launcher
 
@@ -22,6 +45,15 @@ def start(task=None, gui=None, task_servers=None, gui_client=None):
     gui: GUI running in foreground
     task_servers: optional server(s) for task, for remote connections
     gui_client: optional client for GUI, for remote connections
+    maxsize: maximum size of all queues (0 = unbounded)
+    overflow: overflow policy for full queues (see PollableQueue)
+    queue_class: class used for all queues, like NewLineQueue
+                 or partial(ConflatingQueue, keys=[...])
+    mode: THREAD to run everything in threads of this process,
+          or PROCESS to run the task and each server in a separate
+          process, connected with ProcessQueues. In this case
+          `queue_class` cannot be changed, and the task, servers
+          and all the messages must be picklable.
     '''
 
     if task_servers is None:
@@ -34,29 +66,43 @@ def start(task=None, gui=None, task_servers=None, gui_client=None):
     if gui_client and task:
         raise Exception('GUI client can be started with GUIs only')
 
+    if mode == PROCESS:
+        if queue_class is not NewLineQueue:
+            raise Exception('queue_class cannot be changed in process mode')
+        queue_class = ProcessQueue
+    elif mode != THREAD:
+        raise ValueError('Unknown launch mode: %s' % mode)
+
     joinables = []
+    new_queue = functools.partial(queue_class, maxsize, overflow)
+    stop = multiprocessing.Event() if mode == PROCESS else None
+
+    def spawn(target, qin, qout):
+        if mode == PROCESS:
+            t = multiprocessing.Process(target=_run_process,
+                                        args=(target, stop, qin, qout))
+        else:
+            t = threading.Thread(target=target, args=(qin, qout))
+        t.start()
+        joinables.append(t)
 
     if task:
         n_out_queues = len(task_servers)
         if gui:
             n_out_queues += 1
 
-        qin = NewLineQueue()
-        qout = MultiQueue(n_out_queues, NewLineQueue)
+        qin = new_queue()
+        qout = MultiQueue(n_out_queues, new_queue)
         qout_gui = qout[-1]
 
         for i, server in enumerate(task_servers):
-            t = threading.Thread(target=server, args=(qin, qout[i]))
-            t.start()
-            joinables.append(t)
+            spawn(server, qin, qout[i])
 
-        t = threading.Thread(target=task, args=(qin, qout))
-        t.start()
-        joinables.append(t)
+        spawn(task, qin, qout)
 
     if gui_client:
-        qin = NewLineQueue()
-        qout_gui = NewLineQueue()
+        qin = new_queue()
+        qout_gui = new_queue()
         t = threading.Thread(target=gui_client, args=(qout_gui, qin))
         t.start()
         joinables.append(t)
@@ -66,6 +112,8 @@ def start(task=None, gui=None, task_servers=None, gui_client=None):
     if gui:
         gui(qout_gui, qin)
         set_time_to_die(True)
+        if stop is not None:
+            stop.set()
 
     for joinable in joinables:
         joinable.join()
@@ -73,8 +121,8 @@ def start(task=None, gui=None, task_servers=None, gui_client=None):
 
 def self_contained_app(task, gui):
 
-    q1 = queue.Queue()
-    q2 = queue.Queue()
+    q1 = PollableQueue()
+    q2 = PollableQueue()
 
     # Spawn task
 
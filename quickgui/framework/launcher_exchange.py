@@ -9,48 +9,170 @@ communication queues.
 
 import queue
 import select
+import fnmatch
 import threading
+from collections import defaultdict, OrderedDict
 from collections.abc import Iterable
 
+from quickgui.framework import stats
+from quickgui.framework.messages import command
 from quickgui.framework.queues import NewLineQueue
-from quickgui.framework.quick_base import time_to_die, set_time_to_die
+from quickgui.framework.queues import BLOCK, DROP_NEWEST, DROP_OLDEST
+from quickgui.framework.quick_base import QuickBase, handled_commands
+from quickgui.framework.quick_base import shutdown, set_time_to_die
+from quickgui.framework.tracing import tracer
+
+# Maximum number of (category, command) routes kept in the route cache
+MAX_ROUTES = 1024
+
+
+def subscriptions(target):
+    '''
+    Commands consumed by `target`, a task or GUI callable.
+
+    Uses the `subscriptions` attribute of `target` if present,
+    otherwise the @handler registry if `target` is a QuickBase class.
+    Returns None, meaning all commands, if neither one is available.
+    '''
+    subs = getattr(target, 'subscriptions', None)
+    if subs is not None:
+        return subs
+    if isinstance(target, type) and issubclass(target, QuickBase):
+        return handled_commands(target)
+    return None
 
 
 class Exchange():
     '''
     Central exchange for queues.
 
-    Incoming messages from any queue are replicated to all output queues,
-    except for the ones in the same category.
+    Incoming messages from any queue are forwarded to the output queues
+    subscribed to their command, except for the ones in the same category.
+
+    Subscriptions are command names or shell-style wildcards like 'POS*'
+    (see fnmatch), case-insensitive. Queues without subscriptions
+    receive all commands. Routes are computed from an index the first
+    time a command is seen, and cached afterwards, so that the cost
+    of each message only depends on the number of subscribers.
+    Commands come from remote clients too, so the cache only keeps
+    the MAX_ROUTES most recently used routes.
+
+    All queues are instances of `queue_class`, built with the `maxsize`
+    and `overflow` settings (see PollableQueue), and the overflow policy
+    also applies to the exchange: with BLOCK, it waits for space in
+    a full output queue (until shutdown), and with RAISE the messages
+    that do not fit are discarded. Messages discarded by the exchange
+    are counted for each destination category, and reported by stats().
     '''
 
-    def __init__(self):
+    def __init__(self, maxsize=0, overflow=BLOCK, queue_class=NewLineQueue):
         self.qins = []
         self.qouts = []
-
-    def get(self, category=''):
-        qin = NewLineQueue()
-        qout = NewLineQueue()
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.queue_class = queue_class
+        self._exact = defaultdict(list)   # command -> qins
+        self._wildcards = []              # (pattern, qin)
+        self._routes = OrderedDict()      # (category, command) -> qins
+        self.dropped = defaultdict(int)   # category -> discarded messages
+
+    def get(self, category='', subscriptions=None):
+        '''
+        Get a new (qin, qout) pair of queues.
+
+        `subscriptions` is a list of the commands to be received in qin,
+        or None to receive all of them.
+        '''
+        qin = self.queue_class(self.maxsize, self.overflow)
+        qout = self.queue_class(self.maxsize, self.overflow)
         qin.category = category
         qout.category = category
         self.qins.append(qin)
         self.qouts.append(qout)
+
+        if subscriptions is None:
+            subscriptions = ['*']
+        for sub in subscriptions:
+            sub = sub.lower()
+            if any(c in sub for c in '*?['):
+                self._wildcards.append((sub, qin))
+            else:
+                self._exact[sub].append(qin)
+        self._routes.clear()
         return qin, qout
 
+    def route(self, category, cmd):
+        '''Output queues for a command coming from `category`'''
+        key = (category, cmd)
+        try:
+            self._routes.move_to_end(key)
+            return self._routes[key]
+        except KeyError:
+            pass
+
+        qins = dict.fromkeys(self._exact.get(cmd, []))
+        if cmd is not None:
+            for pattern, qin in self._wildcards:
+                if fnmatch.fnmatchcase(cmd, pattern):
+                    qins[qin] = None
+        route = [qin for qin in qins if qin.category != category]
+        self._routes[key] = route
+        if len(self._routes) > MAX_ROUTES:
+            self._routes.popitem(last=False)
+        return route
+
+    def stats(self):
+        '''Messages discarded by the exchange, per destination category'''
+        return {'dropped': dict(self.dropped)}
+
+    def _deliver(self, qin, msgs):
+        '''Put `msgs` into `qin`, applying the overflow policy'''
+        if self.maxsize <= 0 or self.overflow in (DROP_NEWEST, DROP_OLDEST):
+            qin.put_many(msgs)   # Never full, or counting its own drops
+            return
+
+        for n, msg in enumerate(msgs):
+            while True:
+                try:
+                    qin.put(msg, timeout=0.1)
+                    break
+                except queue.Full:
+                    if self.overflow != BLOCK or shutdown.is_set():
+                        self.dropped[qin.category] += len(msgs) - n
+                        return
+
     def run(self):
-        while not time_to_die():
-            r, _, _ = select.select(self.qouts, [], [])
+        stats.register('exchange', self.stats)
+        try:
+            self._run()
+        finally:
+            stats.unregister('exchange')
+
+    def _run(self):
+        while not shutdown.is_set():
+            r, _, _ = select.select(self.qouts + [shutdown], [], [])
             for qout in r:
-                data = qout.get(block=False)
-                for qin in self.qins:
-                    if qin.category != qout.category:
-                        try:
-                            qin.put(data, block=False)
-                        except queue.Full:
-                            pass
-
-
-def start(task=None, gui=None, task_servers=None, gui_client=None):
+                if qout is shutdown:
+                    continue
+                try:
+                    data = qout.get_many(block=False)
+                except queue.Empty:
+                    continue
+                batches = defaultdict(list)
+                for msg in data:
+                    for qin in self.route(qout.category, command(msg)):
+                        batches[qin].append(msg)
+
+                if tracer.enabled and len(batches) > 1:
+                    for qin in list(batches)[1:]:
+                        batches[qin] = tracer.fork(batches[qin])
+
+                for qin, msgs in batches.items():
+                    self._deliver(qin, msgs)
+
+
+def start(task=None, gui=None, task_servers=None, gui_client=None,
+          maxsize=0, overflow=BLOCK, queue_class=NewLineQueue):
     '''
     App launcher
 
@@ -58,11 +180,17 @@ def start(task=None, gui=None, task_servers=None, gui_client=None):
     gui: GUI running in foreground
     task_servers: optional server(s) for task, for remote connections
     gui_client: optional client for GUI, for remote connections
+    maxsize: maximum size of all queues (0 = unbounded)
+    overflow: overflow policy for full queues (see PollableQueue)
+    queue_class: class used for all queues, like NewLineQueue
+                 or partial(ConflatingQueue, keys=[...])
 
     This launcher uses the class Exchange above to simplify
-    the queue plumbing.
-    However the exchange causes rapid message inflation for anything but
-    the simplest topologies.
+    the queue plumbing. The task and GUI only receive the commands
+    they subscribe to (see subscriptions()), while servers and
+    clients receive everything. As with the launcher module,
+    STATS requests are answered by the task only, so that each
+    request gets a single reply.
     '''
 
     if task_servers is None:
@@ -76,7 +204,7 @@ def start(task=None, gui=None, task_servers=None, gui_client=None):
         raise Exception('GUI client can be started with GUIs only')
 
     joinables = []
-    exchange = Exchange()
+    exchange = Exchange(maxsize, overflow, queue_class)
 
     for i, server in enumerate(task_servers):
         qin, qout = exchange.get('task_server')
@@ -85,7 +213,7 @@ def start(task=None, gui=None, task_servers=None, gui_client=None):
         joinables.append(t)
 
     if task:
-        qin, qout = exchange.get('task')
+        qin, qout = exchange.get('task', subscriptions(task))
         t = threading.Thread(target=task, args=(qin, qout))
         t.start()
         joinables.append(t)
@@ -99,7 +227,10 @@ def start(task=None, gui=None, task_servers=None, gui_client=None):
     # Start GUI in foreground
     # This call will block until the gui quits.
     if gui:
-        qin, qout = exchange.get('gui')
+        subs = subscriptions(gui)
+        if subs is not None:
+            subs = [sub for sub in subs if sub.lower() != 'stats']
+        qin, qout = exchange.get('gui', subs)
 
     threading.Thread(target=exchange.run).start()
 
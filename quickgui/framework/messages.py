@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def is_array(value):
+    '''True if `value` is a NumPy array'''
+    return np is not None and isinstance(value, np.ndarray)
+
+
+def same_value(a, b):
+    '''True if two message values are equal, comparing arrays by content'''
+    if is_array(a) or is_array(b):
+        return (is_array(a) and is_array(b) and a.dtype == b.dtype and
+                np.array_equal(a, b))
+    return a == b
+
+
+def format_value(value):
+    '''Text representation of a message value'''
+    if isinstance(value, bool):
+        value = int(value)
+    return str(value)
+
+
+class Message(namedtuple('Message', 'cmd value')):
+    '''
+    In-process message: a command with an optional typed value.
+
+    Messages travel as they are through the queues between tasks and
+    GUIs in the same process, so that no formatting and parsing
+    is needed. They are converted to the newline-terminated text
+    protocol only at socket boundaries, using to_text().
+
+    Values can also be NumPy arrays, which are passed by reference
+    in-process and sent as binary frames over sockets. Arrays have no
+    text representation, and are not sent to text protocol clients.
+    '''
+
+    __slots__ = ()
+
+    def __new__(cls, cmd, value=None):
+        return super().__new__(cls, cmd, value)
+
+    def to_text(self):
+        if self.value is None:
+            return self.cmd + '\n'
+        elif is_array(self.value):
+            return ''
+        else:
+            return '%s %s\n' % (self.cmd, format_value(self.value))
+
+
+def command(item):
+    '''
+    Lowercase command of a queue item (either a Message or a text line).
+
+    Returns None for empty lines.
+    '''
+    if isinstance(item, Message):
+        return item.cmd.lower()
+    try:
+        return item.split(maxsplit=1)[0].lower()
+    except IndexError:
+        return None
+
+
+class LastValueCache():
+    '''
+    The last queue item of each command.
+
+    Only commands in `keys` are kept (case-insensitive, all commands
+    if `keys` is None). At most `maxsize` commands are kept: when
+    a new command does not fit, the one seen first is forgotten.
+    snapshot() returns the items in the order their commands were
+    first seen. Servers use it to send the current state to new clients.
+    '''
+
+    def __init__(self, keys=None, maxsize=256):
+        if keys is not None:
+            keys = frozenset(key.lower() for key in keys)
+        self.keys = keys
+        self.maxsize = maxsize
+        self._items = {}
+
+    def __len__(self):
+        return len(self._items)
+
+    def update(self, items):
+        for item in items:
+            key = command(item)
+            if key is None or (self.keys is not None and key not in self.keys):
+                continue
+            if isinstance(item, Message) and type(item) is not Message:
+                item = Message(item.cmd, item.value)   # Drop any trace
+            if key not in self._items and len(self._items) >= self.maxsize:
+                del self._items[next(iter(self._items))]
+            self._items[key] = item
+
+    def snapshot(self):
+        return list(self._items.values())
+
+
+def to_text(msg):
+    '''Convert a queue item (either a Message or a text line) to text'''
+    if isinstance(msg, Message):
+        return msg.to_text()
+    else:
+        return msg
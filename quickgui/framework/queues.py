@@ -1,33 +1,56 @@
 # -*- coding: utf-8 -*-
 
 import os
+import time
 import queue
 import socket
+import multiprocessing
 
+from quickgui.framework.messages import Message, command
+from quickgui.framework.tracing import tracer
 
-class PollableQueue(queue.Queue):
-    '''Pollable queue from Python Cookbook, 3rd Edition
+# Overflow policies for bounded queues
+BLOCK = 'block'
+DROP_NEWEST = 'drop_newest'
+DROP_OLDEST = 'drop_oldest'
+RAISE = 'raise'
 
-    Python Cookbook, 3rd Edition
-    Recipes for Mastering Python 3
-    By Brian Jones, David Beazley
+OVERFLOW_POLICIES = (BLOCK, DROP_NEWEST, DROP_OLDEST, RAISE)
 
-    "writing a program that uses several chunks of code from this
-    book does not require permission."
 
-    This queue can be used in the first argument (readable sockets)
-    of a select() call. When something is in the queue, select() returns
-    that the queue is readable.
+class _EventFdNotifier():
+    '''Wakeup fd based on a Linux eventfd'''
 
-    The trick is a small loopback socket that keeps in sync with the
-    queue's contents.
+    def __init__(self):
+        self._fd = os.eventfd(0, os.EFD_NONBLOCK | os.EFD_CLOEXEC)
+        self.is_set = False
 
-    apuglisi 2020-04-30  modified get() and put() methods
-                         to accept the same parameter as queue.Queue.
-    '''
+    def fileno(self):
+        return self._fd
+
+    def set(self):
+        if not self.is_set:
+            os.eventfd_write(self._fd, 1)
+            self.is_set = True
+
+    def clear(self):
+        if self.is_set:
+            os.eventfd_read(self._fd)
+            self.is_set = False
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        self.close()
+
+
+class _SocketPairNotifier():
+    '''Wakeup fd based on a pair of connected sockets'''
 
     def __init__(self):
-        super().__init__()
         # Create a pair of connected sockets
         if os.name == 'posix':
             self._putsocket, self._getsocket = socket.socketpair()
@@ -40,42 +63,422 @@ class PollableQueue(queue.Queue):
             self._putsocket.connect(server.getsockname())
             self._getsocket, _ = server.accept()
             server.close()
+        self._putsocket.setblocking(False)
+        self._getsocket.setblocking(False)
+        self.is_set = False
 
     def fileno(self):
         return self._getsocket.fileno()
 
+    def set(self):
+        if not self.is_set:
+            self._putsocket.send(b'x')
+            self.is_set = True
+
+    def clear(self):
+        if self.is_set:
+            self._getsocket.recv(1)
+            self.is_set = False
+
+    def close(self):
+        self._putsocket.close()
+        self._getsocket.close()
+
+
+def make_notifier():
+    '''
+    Build a level-triggered wakeup fd.
+
+    The returned object has set(), clear(), close() and fileno()
+    methods. Its fd is readable after set() and until clear().
+    Both set() and clear() are idempotent, and only the first call
+    after a change of state performs a syscall.
+    Uses an eventfd where available, and a socketpair otherwise.
+    '''
+    if hasattr(os, 'eventfd'):
+        return _EventFdNotifier()
+    else:
+        return _SocketPairNotifier()
+
+
+class PollableQueue(queue.Queue):
+    '''Pollable queue from Python Cookbook, 3rd Edition
+
+    Python Cookbook, 3rd Edition
+    Recipes for Mastering Python 3
+    By Brian Jones, David Beazley
+
+    "writing a program that uses several chunks of code from this
+    book does not require permission."
+
+    This queue can be used in the first argument (readable sockets)
+    of a select() call. When something is in the queue, select() returns
+    that the queue is readable.
+
+    The trick is a small wakeup fd (see make_notifier()) that keeps
+    in sync with the queue's contents.
+
+    apuglisi 2020-04-30  modified get() and put() methods
+                         to accept the same parameter as queue.Queue.
+
+    The wakeup fd is only signalled when the queue goes from empty to
+    non-empty, and cleared when it becomes empty again, so that a burst
+    of put() calls costs a single syscall and producers never block
+    on kernel buffer space.
+    put_many() and get_many() move a whole batch of items at once.
+
+    If `maxsize` is greater than zero, the queue is bounded and
+    `overflow` selects what happens when putting into a full queue:
+
+    - BLOCK: wait for a free slot, like queue.Queue (the default)
+    - DROP_NEWEST: discard the item being put
+    - DROP_OLDEST: discard the oldest item in the queue
+    - RAISE: raise queue.Full immediately
+
+    The number of discarded items is available as `dropped`,
+    and the maximum number of queued items as `high_water`
+    (see also stats()).
+    '''
+
+    def __init__(self, maxsize=0, overflow=BLOCK):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: %s' % overflow)
+        super().__init__(maxsize)
+        self.overflow = overflow
+        self.dropped = 0
+        self.high_water = 0
+        self._notifier = make_notifier()
+        # Items can be moved in bulk, unless a subclass needs to see each one
+        self._bulk = (type(self)._put is PollableQueue._put and
+                      type(self)._get is PollableQueue._get)
+
+    def fileno(self):
+        return self._notifier.fileno()
+
+    # _put() and _get() are called by queue.Queue with the mutex held,
+    # so the notifier state can never get out of sync with the queue.
+
+    def _put(self, item):
+        '''Put `item` in the queue, returning True if the queue grew'''
+        super()._put(item)
+        self._notifier.set()
+        return True
+
+    def _get(self):
+        item = super()._get()
+        if self._qsize() == 0:
+            self._notifier.clear()
+        return item
+
+    def _full(self):
+        return 0 < self.maxsize <= self._qsize()
+
+    def _replaces(self, item):
+        '''True if putting `item` does not make the queue grow'''
+        return False
+
+    def _wait_not_full(self, block, endtime):
+        if not block:
+            raise queue.Full
+        elif endtime is None:
+            while self._full():
+                self.not_full.wait()
+        else:
+            while self._full():
+                remaining = endtime - time.monotonic()
+                if remaining <= 0.0:
+                    raise queue.Full
+                self.not_full.wait(remaining)
+
     def put(self, item, block=True, timeout=None):
-        super().put(item, block, timeout)
-        self._putsocket.send(b'x')
+        self.put_many([item], block, timeout)
+
+    def put_many(self, items, block=True, timeout=None):
+        '''
+        Put all items in the queue, applying the overflow policy.
+
+        With the BLOCK policy, `timeout` applies to the whole batch.
+        If queue.Full is raised, the items before the failing one
+        have already been put in the queue.
+        '''
+        if timeout is not None and timeout < 0:
+            raise ValueError("'timeout' must be a non-negative number")
+        endtime = None if timeout is None else time.monotonic() + timeout
+        if tracer.enabled:
+            items = list(items)
+            tracer.hop(items, 'queue_put')
+
+        with self.not_full:
+            if self._bulk and self.maxsize <= 0:
+                n = len(self.queue)
+                self.queue.extend(items)
+                added = len(self.queue) - n
+                if added:
+                    self._notifier.set()
+                    self.unfinished_tasks += added
+                    self.not_empty.notify(added)
+                self.high_water = max(self.high_water, self._qsize())
+                return
+
+            for item in items:
+                if self._full() and not self._replaces(item):
+                    if self.overflow == DROP_NEWEST:
+                        self.dropped += 1
+                        continue
+                    elif self.overflow == DROP_OLDEST:
+                        self._get()
+                        self.unfinished_tasks -= 1
+                        self.dropped += 1
+                    elif self.overflow == RAISE:
+                        raise queue.Full
+                    else:
+                        self._wait_not_full(block, endtime)
+                if self._put(item):
+                    self.unfinished_tasks += 1
+                    self.not_empty.notify()
+
+            self.high_water = max(self.high_water, self._qsize())
+
+    def stats(self):
+        '''Current depth, high-water mark and number of dropped items'''
+        return {'depth': self.qsize(),
+                'high_water': self.high_water,
+                'dropped': self.dropped}
+
+    def get_many(self, max_items=None, block=True, timeout=None):
+        '''
+        Get all items ready in the queue, up to `max_items`.
+
+        Blocks (according to `block` and `timeout`) only until
+        the first item is available, like get(). Returns a list
+        with at least one item, or raises queue.Empty.
+        '''
+        items = [queue.Queue.get(self, block, timeout)]
+
+        with self.not_full:
+            if self._bulk and max_items is None:
+                items.extend(self.queue)
+                self.queue.clear()
+                self._notifier.clear()
+            while self._qsize() > 0:
+                if max_items is not None and len(items) >= max_items:
+                    break
+                items.append(self._get())
+            self.not_full.notify(len(items) - 1)
+
+        if tracer.enabled:
+            tracer.hop(items, 'queue_get')
+        return items
 
     def get(self, block=True, timeout=None):
         item = super().get(block, timeout)
-        # perform recv() only if get() is successful
-        self._getsocket.recv(1)
+        if tracer.enabled:
+            tracer.hop([item], 'queue_get')
         return item
 
 
-class NewLineQueue(PollableQueue):
-    '''Queue that forces messages to be terminated with newlines'''
+class LineSplitter():
+    '''
+    Splits strings into newline-terminated lines.
+
+    The last partial line of each string is kept until the
+    following strings complete it. Message objects are passed as they are.
+    '''
 
     def __init__(self):
-        super().__init__()
         self._outbuf = ''
 
-    def put(self, s, block=True, timeout=None):
-        if not isinstance(s, str):
-            raise TypeError('A NewLineQueue only accepts strings')
+    def _split(self, s):
+        '''Split `s` into complete lines, keeping the last partial one'''
+        text = self._outbuf + s
+        if not text:
+            return []
 
-        *lines, last_line = (self._outbuf + s).splitlines(keepends=True)
-
-        for line in lines:
-            super().put(line, block, timeout)
+        *lines, last_line = text.splitlines(keepends=True)
 
         if last_line.endswith('\n'):
-            super().put(last_line, block, timeout)
+            lines.append(last_line)
             self._outbuf = ''
         else:
             self._outbuf = last_line
+        return lines
+
+    def split(self, items):
+        items = list(items)
+        for item in items:
+            if not isinstance(item, (str, Message)):
+                raise TypeError('A NewLineQueue only accepts strings and Messages')
+
+        lines = []
+        text = ''
+        for item in items:
+            if isinstance(item, str):
+                text += item
+            else:
+                lines += self._split(text)
+                lines.append(item)
+                text = ''
+        lines += self._split(text)
+        return lines
+
+
+class NewLineQueue(PollableQueue):
+    '''Queue that forces messages to be terminated with newlines
+
+    Message objects are also accepted, and are queued as they are.
+    '''
+
+    def __init__(self, maxsize=0, overflow=BLOCK):
+        super().__init__(maxsize, overflow)
+        self._splitter = LineSplitter()
+
+    def put_many(self, items, block=True, timeout=None):
+        super().put_many(self._splitter.split(items), block, timeout)
+
+
+class ProcessQueue():
+    '''
+    Pollable queue that can be shared between processes.
+
+    Has the same interface as NewLineQueue, including the
+    bounded size with the BLOCK, DROP_NEWEST and RAISE overflow policies,
+    but it is built on top of a multiprocessing.Queue. Items
+    must be picklable. Lines are split in the producer process,
+    so each process keeps its own partial line.
+    The `dropped` and `high_water` counters are also local
+    to each producer process.
+    '''
+
+    def __init__(self, maxsize=0, overflow=BLOCK):
+        if overflow not in (BLOCK, DROP_NEWEST, RAISE):
+            raise ValueError('Unsupported overflow policy: %s' % overflow)
+        self._queue = multiprocessing.Queue(maxsize)
+        self._splitter = LineSplitter()
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.dropped = 0
+        self.high_water = 0
+
+    def fileno(self):
+        return self._queue._reader.fileno()
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def _depth(self):
+        try:
+            return self._queue.qsize()
+        except NotImplementedError:   # Not available on macOS
+            return 0
+
+    def stats(self):
+        '''Same as PollableQueue.stats()'''
+        return {'depth': self._depth(),
+                'high_water': self.high_water,
+                'dropped': self.dropped}
+
+    def put(self, item, block=True, timeout=None):
+        self.put_many([item], block, timeout)
+
+    def put_many(self, items, block=True, timeout=None):
+        if self.overflow != BLOCK:
+            block = False
+        items = self._splitter.split(items)
+        if tracer.enabled:
+            tracer.hop(items, 'queue_put')
+        for line in items:
+            try:
+                self._queue.put(line, block, timeout)
+            except queue.Full:
+                if self.overflow != DROP_NEWEST:
+                    raise
+                self.dropped += 1
+        self.high_water = max(self.high_water, self._depth())
+
+    def get(self, block=True, timeout=None):
+        item = self._queue.get(block, timeout)
+        if tracer.enabled:
+            tracer.hop([item], 'queue_get')
+        return item
+
+    def get_many(self, max_items=None, block=True, timeout=None):
+        '''
+        Get all items ready in the queue, up to `max_items`.
+
+        Same as PollableQueue.get_many().
+        '''
+        items = [self._queue.get(block, timeout)]
+        while max_items is None or len(items) < max_items:
+            try:
+                items.append(self._queue.get(block=False))
+            except queue.Empty:
+                break
+        if tracer.enabled:
+            tracer.hop(items, 'queue_get')
+        return items
+
+
+class ConflatingQueue(NewLineQueue):
+    '''
+    Latest-value queue keyed by command name.
+
+    Keeps at most one pending message for each command in `keys`
+    (case-insensitive): a new message replaces the pending one in place,
+    keeping its position in the queue. All other messages are queued
+    in FIFO order as usual, so with no keys nothing is conflated.
+
+    Launchers build their queues as queue_class(maxsize, overflow),
+    so keys are given to them with functools.partial:
+
+        start(..., queue_class=partial(ConflatingQueue, keys=['POS']))
+
+    The number of replaced messages is available as `conflated`,
+    and is also reported by stats().
+    '''
+
+    def __init__(self, maxsize=0, overflow=BLOCK, keys=()):
+        super().__init__(maxsize, overflow)
+        self.keys = frozenset(key.lower() for key in keys)
+        self.conflated = 0
+
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        self._pending = {}
+
+    def stats(self):
+        stats = super().stats()
+        stats['conflated'] = self.conflated
+        return stats
+
+    def _key(self, item):
+        key = command(item)
+        if key in self.keys:
+            return key
+        return None
+
+    def _replaces(self, item):
+        return self._key(item) in self._pending
+
+    # The underlying deque holds (key, item) tuples, where the item
+    # of conflated messages is kept in self._pending instead.
+
+    def _put(self, item):
+        key = self._key(item)
+        if key is None:
+            return super()._put((None, item))
+        elif key in self._pending:
+            self._pending[key] = item
+            self.conflated += 1
+            return False
+        else:
+            self._pending[key] = item
+            return super()._put((key, None))
+
+    def _get(self):
+        key, item = super()._get()
+        if key is not None:
+            item = self._pending.pop(key)
+        return item
 
 
 class MultiQueue():
@@ -95,6 +498,20 @@ class MultiQueue():
     def __getitem__(self, idx):
         return self.qlist[idx]
 
-    def put(self, *args, **kwargs):
-        for q in self.qlist:
-            q.put(*args, **kwargs)
+    def _copies(self, items):
+        '''One list of items for each queue, with separate traces'''
+        if tracer.enabled:
+            return [items] + [tracer.fork(items) for q in self.qlist[1:]]
+        return [items] * len(self.qlist)
+
+    def put(self, item, *args, **kwargs):
+        for q, (item,) in zip(self.qlist, self._copies([item])):
+            q.put(item, *args, **kwargs)
+
+    def put_many(self, items, *args, **kwargs):
+        for q, items in zip(self.qlist, self._copies(list(items))):
+            q.put_many(items, *args, **kwargs)
+
+    def stats(self):
+        '''Statistics of each sub-queue'''
+        return [q.stats() for q in self.qlist]
@@ -1,17 +1,35 @@
 # -*- coding: utf-8 -*-
 
-from collections import namedtuple
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from collections import namedtuple, defaultdict
+
+from quickgui.framework.queues import make_notifier
+from quickgui.framework.messages import Message, format_value, command
+from quickgui.framework.messages import is_array, same_value
+from quickgui.framework.stats import Histogram, queue_stats, collect
+from quickgui.framework.tracing import tracer, TracedMessage
 
 HIDDEN_ATTR = '__handle_func'
 
-Info = namedtuple('Info', 'cmd validator')
-Handler = namedtuple('Handler', 'func validator')
+Info = namedtuple('Info', 'cmd validator concurrent key')
+Handler = namedtuple('Handler', 'func validator concurrent key')
+
 
+def handler(cmd, validator=None, concurrent=False, key=None):
+    '''Decorator for command handlers
 
-def handler(cmd, validator=None):
-    '''Decorator for command handlers'''
+    Handlers declared with `concurrent=True` are run by QuickTask
+    in a thread pool, instead of in the task thread. Calls with the
+    same key are run one at a time, in the order they were received.
+    The key is the command itself, unless `key` is a function, that is
+    called with the (validated) handler argument to get the key.
+    '''
     def decorator(f):
-        setattr(f, HIDDEN_ATTR, Info(cmd, validator))
+        setattr(f, HIDDEN_ATTR, Info(cmd, validator, concurrent, key))
         return f
     return decorator
 
@@ -20,36 +38,135 @@ class DispatchError(Exception):
     pass
 
 
-def handler_int(cmd):
-    return handler(cmd, validator=int)
+def handled_commands(klass):
+    '''List of the commands with a @handler in `klass`, in lowercase'''
+    cmds = []
+    for name in dir(klass):
+        info = getattr(getattr(klass, name), HIDDEN_ATTR, None)
+        if info is not None:
+            cmds.append(info.cmd.lower())
+    return cmds
+
+
+def handler_int(cmd, **kwargs):
+    return handler(cmd, validator=int, **kwargs)
+
+
+def handler_float(cmd, **kwargs):
+    return handler(cmd, validator=float, **kwargs)
+
+
+def handler_str(cmd, **kwargs):
+    return handler(cmd, validator=str, **kwargs)
+
+
+class Shutdown():
+    '''
+    Process-wide shutdown flag.
+
+    Besides being checked with is_set(), this object can be used
+    in the first argument (readable sockets) of a select() call,
+    in order to interrupt blocking loops as soon as it is set.
+    '''
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._notifier = make_notifier()
+        self._lock = threading.Lock()
 
+    def fileno(self):
+        return self._notifier.fileno()
 
-def handler_float(cmd):
-    return handler(cmd, validator=float)
+    def is_set(self):
+        return self._event.is_set()
 
+    def set(self):
+        with self._lock:
+            self._event.set()
+            self._notifier.set()
 
-def handler_str(cmd):
-    return handler(cmd, validator=str)
+    def clear(self):
+        with self._lock:
+            self._event.clear()
+            self._notifier.clear()
 
+    def wait(self, timeout=None):
+        return self._event.wait(timeout)
 
-its_time_to_die = False
+    def _after_fork(self):
+        '''
+        Give a forked child process its own wakeup fd, so that setting
+        the flag in the child does not wake up the parent, and vice versa.
+        '''
+        self._lock = threading.Lock()
+        self._notifier.close()
+        self._notifier = make_notifier()
+        if self._event.is_set():
+            self._notifier.set()
+
+
+shutdown = Shutdown()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=shutdown._after_fork)
 
 
 def time_to_die():
-    return its_time_to_die
+    return shutdown.is_set()
 
 
 def set_time_to_die(value):
-    global its_time_to_die
-    its_time_to_die = value
+    if value:
+        shutdown.set()
+    else:
+        shutdown.clear()
+
+
+class CommandStats():
+    '''Dispatch statistics for a single command'''
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.latency = Histogram()
+        self._lock = threading.Lock()   # Concurrent handlers record from pool threads
+
+    def record(self, seconds=None, error=False):
+        '''Record a handler call lasting `seconds`, or an error'''
+        with self._lock:
+            if error:
+                self.errors += 1
+            if seconds is not None:
+                self.latency.record(seconds)
+
+    def to_dict(self):
+        return {'count': self.count,
+                'errors': self.errors,
+                'latency': self.latency.to_dict()}
 
 
 class QuickBase():
+    '''
+    Base class for tasks and GUIs.
+
+    Keeps runtime statistics about dispatched and sent commands, that
+    can be read with stats(). The reserved STATS command, without
+    arguments, is answered with a STATS message whose value is a JSON
+    dictionary with the same statistics, together with the ones
+    of all sources registered in the stats module.
+    '''
 
     def __init__(self, qin, qout):
         self.qin = qin
         self.qout = qout
+        self.keepalive = None   # Default keepalive for send_cached()
         self._handlers = {}
+        self._send_cache = {}
+        self._started = time.monotonic()
+        self._dispatch_stats = {}
+        self._dispatch_errors = 0   # Malformed or unknown commands
+        self._sent = defaultdict(int)
+        self._send_errors = 0
 
         for name in dir(self):
             method = getattr(self, name)
@@ -57,36 +174,198 @@ class QuickBase():
             if info is not None:
                 print('Handler for %s is %s' % (info.cmd, str(method)))
                 self._handlers[info.cmd.lower()] = Handler(method,
-                                                           info.validator)
+                                                           info.validator,
+                                                           info.concurrent,
+                                                           info.key)
+                self._dispatch_stats[info.cmd.lower()] = CommandStats()
 
     def dispatch(self, msg):
-        try:
-            cmd, *arg = msg.split(maxsplit=1)
-        except ValueError:  # if the split does not work
-            raise DispatchError('Malformed message')
+        '''
+        Call the handler for `msg`, either a text line or a Message.
+
+        Message values are passed to the handler without any parsing,
+        unless the handler validator requires a conversion. Handlers
+        without a validator receive numeric values as text, just like
+        when the message comes from a socket, and arrays as they are.
+        '''
+        self._call(msg, *self._prepare(msg))
+
+    def _prepare(self, msg):
+        '''
+        Find the handler for `msg` and validate its argument.
+
+        Returns a tuple (cmd, handler, argument list).
+        '''
+        if isinstance(msg, Message):
+            cmd = msg.cmd
+            arg = [] if msg.value is None else [msg.value]
+        else:
+            try:
+                cmd, *arg = msg.split(maxsplit=1)
+            except ValueError:  # if the split does not work
+                self._dispatch_errors += 1
+                raise DispatchError('Malformed message')
 
         cmd = cmd.lower()
         if cmd not in self._handlers:
+            self._dispatch_errors += 1
             raise DispatchError('No handler for command ' + cmd)
 
         handler = self._handlers[cmd]
-        if len(arg) > 0 and handler.validator is not None:
-            try:
-                arg = [handler.validator(arg[0])]
-            except Exception:
-                raise DispatchError('Invalid argument for command %s' % cmd)
+        stats = self._dispatch_stats[cmd]
+        stats.count += 1
+        if len(arg) > 0:
+            value = arg[0]
+            validator = handler.validator
+            if validator is None:
+                if isinstance(value, (int, float)):
+                    arg = [format_value(value)]
+            elif not (isinstance(validator, type) and
+                      isinstance(value, validator)):
+                try:
+                    arg = [validator(value)]
+                except Exception:
+                    stats.record(error=True)
+                    raise DispatchError('Invalid argument for command %s' % cmd)
+        return cmd, handler, arg
 
-        try:
+    def _call(self, msg, cmd, handler, arg):
+        '''Call a handler prepared by _prepare()'''
+        with self._handling(msg, cmd):
             handler.func(*arg)
+
+    @contextmanager
+    def _handling(self, msg, cmd):
+        '''
+        Context of a handler call for `msg`.
+
+        Keeps the statistics and the trace of `cmd`, and turns
+        exceptions into DispatchErrors.
+        '''
+        stats = self._dispatch_stats[cmd]
+        traced = tracer.enabled and isinstance(msg, TracedMessage)
+        if traced:
+            tracer.hop([msg], 'dispatch')
+
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
         except Exception as e:
+            error = True
             raise DispatchError('Exception handling command %s: %s' % (cmd, str(e)))
+        finally:
+            stats.record(time.perf_counter() - start, error)
+            if traced:
+                tracer.hop([msg], 'done')
+                tracer.finish(msg)
 
-    def send(self, cmd):
-        if cmd[-1] != '\n':
-            cmd += '\n'
-        self.qout.put(cmd)
+    def _put(self, item):
+        '''Put `item` into the output queue, keeping send statistics'''
+        self._sent[command(item)] += 1
+        if tracer.enabled and isinstance(item, Message):
+            item = tracer.sample(item)
+        try:
+            self.qout.put(item)
+        except Exception:
+            self._send_errors += 1
+            raise
+
+    def stats(self):
+        '''
+        Runtime statistics of this object.
 
-    def send_to_myself(self, cmd):
-        if cmd[-1] != '\n':
+        Returns a dictionary with the dispatch count, errors and latency
+        histogram of each command, the number of sent messages for each
+        command and their overall rate, and the statistics of the
+        input and output queues.
+        '''
+        uptime = time.monotonic() - self._started
+        return {'name': type(self).__name__,
+                'uptime': uptime,
+                'dispatch': {cmd: stats.to_dict()
+                             for cmd, stats in self._dispatch_stats.items()
+                             if stats.count > 0},
+                'dispatch_errors': self._dispatch_errors,
+                'sent': dict(self._sent),
+                'send_rate': sum(self._sent.values()) / uptime,
+                'send_errors': self._send_errors,
+                'qin': queue_stats(self.qin),
+                'qout': queue_stats(self.qout)}
+
+    @handler('STATS')
+    def _reply_stats(self, *args):
+        '''Answer STATS requests. Replies carry a value and are ignored.'''
+        if not args:
+            stats = self.stats()
+            stats['sources'] = collect()
+            self.send('STATS', json.dumps(stats))
+
+    @staticmethod
+    def _make_item(cmd, value):
+        '''Build a queue item from a text command or a command and value'''
+        if value is not None:
+            return Message(cmd, value)
+        elif isinstance(cmd, Message):
+            return cmd
+        elif cmd[-1] != '\n':
             cmd += '\n'
-        self.qin.put(cmd)
+        return cmd
+
+    def send(self, cmd, value=None):
+        '''
+        Send a command to the output queue.
+
+        `cmd` can be either a text command like 'POS 1.0', a Message,
+        or a command name together with its typed `value`, like
+        send('POS', 1.0). The latter two are passed by reference
+        to in-process receivers, and formatted only when they
+        need to go through a socket.
+        '''
+        self._put(self._make_item(cmd, value))
+
+    def send_cached(self, cmd, keepalive=None, *, value=None):
+        '''
+        Send a command only if different from the last one with the same name.
+
+        `cmd` and `value` are the same as in send(), but `value` must
+        be given by keyword, like send_cached('POS', value=1.0).
+        Unchanged values are sent again anyway if more than `keepalive`
+        seconds (default: self.keepalive) have passed since the last time,
+        so that receivers can tell the sender is still alive.
+        If the keepalive is None, unchanged values are never re-sent.
+        '''
+        item = self._make_item(cmd, value)
+        if isinstance(item, Message):
+            key = item.cmd.lower()
+        else:
+            key = item.split(maxsplit=1)[0].lower()
+        if keepalive is None:
+            keepalive = self.keepalive
+
+        now = time.monotonic()
+        if key in self._send_cache:
+            last_item, last_time = self._send_cache[key]
+            if self._same_item(last_item, item):
+                if keepalive is None or now - last_time < keepalive:
+                    return
+
+        # Arrays are often refilled in place, so the cache keeps a copy
+        if isinstance(item, Message) and is_array(item.value):
+            self._send_cache[key] = (Message(item.cmd, item.value.copy()), now)
+        else:
+            self._send_cache[key] = (item, now)
+        self._put(item)
+
+    @staticmethod
+    def _same_item(a, b):
+        if isinstance(a, Message) and isinstance(b, Message):
+            return a.cmd == b.cmd and same_value(a.value, b.value)
+        return a == b
+
+    def clear_send_cache(self):
+        '''Force the next send_cached() calls to send their values'''
+        self._send_cache.clear()
+
+    def send_to_myself(self, cmd, value=None):
+        self.qin.put(self._make_item(cmd, value))
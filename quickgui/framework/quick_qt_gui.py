@@ -2,9 +2,17 @@
 Arte GUI framework
 '''
 
+import time
+import queue
+import select
+import threading
+
 from PyQt5.QtCore import pyqtSignal, QThread
 
-from quickgui.framework.quick_base import QuickBase, DispatchError
+from quickgui.framework.messages import command
+from quickgui.framework.quick_base import QuickBase, DispatchError, shutdown
+
+DEFAULT_MAX_RATE = 30
 
 
 class QuickQtGui(QuickBase):
@@ -17,30 +25,80 @@ class QuickQtGui(QuickBase):
 
     Also the derived class must provide the event loop using
     QApplication.exec_().
+
+    Incoming messages are delivered to the GUI thread in batches,
+    at most `max_rate` times per second, and never before the previous
+    batch has been dispatched. Within a batch, only the latest message
+    for each command is kept. The number of messages discarded this way
+    is reported by batch_stats().
     '''
 
-    def __init__(self, qin, qout):
+    def __init__(self, qin, qout, max_rate=DEFAULT_MAX_RATE):
         super().__init__(qin, qout)
 
-        self._qlistener = self._QueueListener(qin)
+        self._qlistener = self._QueueListener(qin, max_rate)
         self._qlistener.signal.connect(self._received)
         self._qlistener.start()
 
-    def _received(self, msg):
-        try:
-            self.dispatch(msg)
-        except DispatchError as e:
-            print(e)
+    def batch_stats(self):
+        '''Number of delivered batches and of collapsed messages'''
+        return {'batches': self._qlistener.batches,
+                'collapsed': self._qlistener.collapsed}
+
+    def stats(self):
+        stats = super().stats()
+        stats.update(self.batch_stats())
+        return stats
+
+    def _received(self, msgs):
+        for msg in msgs:
+            try:
+                self.dispatch(msg)
+            except DispatchError as e:
+                print(e)
+        self._qlistener.idle.set()
 
     class _QueueListener(QThread):
 
-        signal = pyqtSignal(str)
+        signal = pyqtSignal(object)
 
-        def __init__(self, qin):
+        def __init__(self, qin, max_rate):
             super().__init__()
             self.qin = qin
+            self.interval = 1.0 / max_rate
+            self.idle = threading.Event()   # Previous batch dispatched
+            self.idle.set()
+            self.batches = 0
+            self.collapsed = 0
 
         def run(self):
-            while 1:
-                msg = self.qin.get()
-                self.signal.emit(msg)
+            pending = {}   # command -> latest message
+            next_batch = 0
+
+            while not shutdown.is_set():
+                timeout = None
+                if pending:
+                    timeout = max(next_batch - time.monotonic(), 0)
+                    if not self.idle.is_set():
+                        timeout = max(timeout, self.interval)
+
+                r, _, _ = select.select([self.qin, shutdown], [], [], timeout)
+                if self.qin in r:
+                    try:
+                        msgs = self.qin.get_many(block=False)
+                    except queue.Empty:
+                        msgs = []
+                    for msg in msgs:
+                        key = command(msg)
+                        if key in pending:
+                            self.collapsed += 1
+                            del pending[key]   # Keep arrival order
+                        pending[key] = msg
+
+                now = time.monotonic()
+                if pending and now >= next_batch and self.idle.is_set():
+                    self.idle.clear()
+                    self.batches += 1
+                    self.signal.emit(list(pending.values()))
+                    pending = {}
+                    next_batch = now + self.interval
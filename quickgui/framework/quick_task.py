@@ -3,25 +3,171 @@
 TODO: handlers with type checking:
 @handler_int('CMD')
 ...
-
-a caching "send" method that only calls qout.put when the value
-is different from the last one, to reduce traffic.
-
-a keepalive mechanism so that every X seconds a value is sent out
-even if the task does not do anything.
 '''
 
+import math
 import time
+import heapq
 import queue
+import select
 import threading
+import functools
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from quickgui.framework.quick_base import QuickBase, DispatchError
+from quickgui.framework.quick_base import shutdown
+
+PERIODIC_ATTR = '__periodic_info'
+
+PeriodicInfo = namedtuple('PeriodicInfo', 'period policy')
+
+# Policies for missed periodic ticks
+SKIP = 'skip'
+CATCH_UP = 'catch_up'
+
+
+def periodic(period=None, policy=SKIP):
+    '''Decorator for periodic handlers
+
+    Can be used either as @periodic, in which case the handler
+    is called every `self.period` seconds, or as @periodic(seconds).
+
+    `policy` selects what happens when one or more ticks are missed
+    because the task was busy: SKIP drops them and realigns to the
+    next deadline, while CATCH_UP runs all of them as soon as possible.
+    '''
+    if callable(period):
+        setattr(period, PERIODIC_ATTR, PeriodicInfo(None, policy))
+        return period
+
+    def decorator(f):
+        setattr(f, PERIODIC_ATTR, PeriodicInfo(period, policy))
+        return f
+    return decorator
+
+
+class PeriodicTimer():
+    '''
+    A periodic handler with its own monotonic deadline.
+
+    Keeps track of the per-tick jitter, that is the delay between
+    the deadline and the actual handler call.
+    '''
+
+    def __init__(self, func, period, policy):
+        self.func = func
+        self.period = period
+        self.policy = policy
+        self.deadline = time.monotonic() + period
+        self.ticks = 0
+        self.missed = 0
+        self.max_jitter = 0.0
+        self.total_jitter = 0.0
+
+    def __lt__(self, other):
+        return self.deadline < other.deadline
+
+    def run(self, now):
+        '''Call the handler and advance the deadline'''
+        self._begin(now)
+        try:
+            self.func()
+        except Exception as e:
+            self._error(e)
+        self._advance()
+
+    def _begin(self, now):
+        jitter = now - self.deadline
+        self.ticks += 1
+        self.total_jitter += jitter
+        self.max_jitter = max(self.max_jitter, jitter)
+
+    def _error(self, e):
+        print('Exception in periodic handler %s: %s' %
+              (self.func.__name__, str(e)))
+
+    def _advance(self):
+        self.deadline += self.period
+        if self.policy == SKIP:
+            now = time.monotonic()
+            if self.deadline <= now:
+                n = math.floor((now - self.deadline) / self.period) + 1
+                self.deadline += n * self.period
+                self.missed += n
+
+    def stats(self):
+        mean_jitter = self.total_jitter / self.ticks if self.ticks else 0.0
+        return {'period': self.period,
+                'ticks': self.ticks,
+                'missed': self.missed,
+                'max_jitter': self.max_jitter,
+                'mean_jitter': mean_jitter}
+
+
+class KeyedExecutor():
+    '''
+    Thread pool running calls in order for each key.
+
+    Calls with the same key run one at a time, in the order they were
+    submitted. Calls with different keys run in parallel, on up to
+    `max_workers` threads. At most `max_in_flight` calls can be
+    waiting or running at the same time: submit() refuses new calls
+    above this limit, instead of blocking the caller.
+    '''
+
+    def __init__(self, max_workers, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.rejected = 0
+        self._pool = ThreadPoolExecutor(max_workers,
+                                        thread_name_prefix='handler')
+        self._waiting = {}    # key -> deque of calls behind the running one
+        self._lock = threading.Lock()
 
-from quickgui.framework.quick_base import QuickBase, handler, DispatchError
-from quickgui.framework.quick_base import time_to_die
+    def submit(self, key, call):
+        '''Schedule call() after all previous calls with `key`.
 
+        Returns False if the call was refused.
+        '''
+        with self._lock:
+            if self.in_flight >= self.max_in_flight:
+                self.rejected += 1
+                return False
+            self.in_flight += 1
+            if key in self._waiting:
+                self._waiting[key].append(call)
+                return True
+            self._waiting[key] = deque()
+        self._pool.submit(self._run, key, call)
+        return True
+
+    def _run(self, key, call):
+        '''Run `call` and then all calls queued behind it with the same key'''
+        while call is not None:
+            try:
+                call()
+            except Exception as e:
+                print(e)
+            with self._lock:
+                self.in_flight -= 1
+                waiting = self._waiting[key]
+                if waiting:
+                    call = waiting.popleft()
+                else:
+                    del self._waiting[key]
+                    call = None
 
-def periodic(f):
-    '''Decorator for periodic handler'''
-    return handler('periodic')(f)
+    def shutdown(self):
+        '''Wait for all calls to complete and stop the threads'''
+        self._pool.shutdown(wait=True)
+
+    def stats(self):
+        with self._lock:
+            return {'in_flight': self.in_flight,
+                    'max_in_flight': self.max_in_flight,
+                    'keys': len(self._waiting),
+                    'rejected': self.rejected}
 
 
 class QuickTask(QuickBase):
@@ -30,40 +176,135 @@ class QuickTask(QuickBase):
 
     When the command 'CMD' is received, the method decorated with
     @handler('CMD') is called, together with an optional argument.
-    In addition, a 'PERIODIC' command is inserted
-    at regular intervals in the queue.
+    In addition, methods decorated with @periodic are called at
+    regular intervals, each one with its own period.
 
-    Even if this class uses threads internally, handlers are not
-    multi-threaded. All handlers run sequentially in the same thread.
+    Handlers run sequentially in the task thread, including the
+    periodic ones, unless they are declared with
+    @handler('CMD', concurrent=True). Concurrent handlers run in a pool
+    of `max_workers` threads, so that slow ones, like those waiting for
+    hardware, do not delay all other commands and the periodic handlers.
+    Calls of the same concurrent handler are still run one at a time and
+    in order, or one at a time for each key if the handler has a `key`
+    function (see handler()). Up to `max_in_flight` concurrent calls
+    can be waiting or running: further commands are refused with
+    a DispatchError. Concurrent handlers must protect any state
+    they share with the rest of the task.
     '''
 
     def __init__(self, qin, qout):
         super().__init__(qin, qout)
         self.period = 1
+        self.max_workers = 4
+        self.max_in_flight = 64
+        self._timers = []
+        self._executor = None
+
+    def _start_timers(self):
+        self._timers = []
+        for name in dir(self):
+            method = getattr(self, name)
+            info = getattr(method, PERIODIC_ATTR, None)
+            if info is not None:
+                period = info.period or self.period
+                print('Periodic handler every %gs is %s' % (period, str(method)))
+                self._timers.append(PeriodicTimer(method, period, info.policy))
+        heapq.heapify(self._timers)
+
+    def _run_timers(self):
+        '''
+        Run all expired timers once, and return the time until the next one.
+
+        Returns None if there are no timers.
+        '''
+        now = time.monotonic()
+        while self._timers and self._timers[0].deadline <= now:
+            timer = self._timers[0]
+            timer.run(now)
+            heapq.heapreplace(self._timers, timer)
+            if timer.deadline <= now:
+                # Catching up: give queued commands a chance to run
+                return 0
+
+        if self._timers:
+            return max(self._timers[0].deadline - time.monotonic(), 0)
+        else:
+            return None
+
+    def dispatch(self, msg):
+        '''
+        Call the handler for `msg`, or schedule it for a concurrent handler.
+
+        See QuickBase.dispatch() for the argument handling.
+        '''
+        cmd, handler, arg = self._prepare(msg)
+        if handler.concurrent:
+            self._submit(msg, cmd, handler, arg)
+        else:
+            self._call(msg, cmd, handler, arg)
+
+    def _key(self, cmd, handler, arg):
+        '''Ordering key of a concurrent handler call'''
+        try:
+            return (cmd, handler.key(*arg) if handler.key else None)
+        except Exception:
+            self._dispatch_stats[cmd].record(error=True)
+            raise DispatchError('Invalid key for command %s' % cmd)
+
+    def _refuse(self, cmd):
+        self._dispatch_stats[cmd].record(error=True)
+        raise DispatchError('Too many concurrent commands, %s refused' % cmd)
+
+    def _submit(self, msg, cmd, handler, arg):
+        '''Run a concurrent handler in the thread pool'''
+        if self._executor is None:
+            self._executor = KeyedExecutor(self.max_workers, self.max_in_flight)
+        key = self._key(cmd, handler, arg)
+        call = functools.partial(self._call, msg, cmd, handler, arg)
+        if not self._executor.submit(key, call):
+            self._refuse(cmd)
+
+    def periodic_stats(self):
+        '''Tick and jitter statistics for each periodic handler'''
+        return {timer.func.__name__: timer.stats() for timer in self._timers}
+
+    def stats(self):
+        stats = super().stats()
+        stats['periodic'] = self.periodic_stats()
+        if self._executor is not None:
+            stats['concurrent'] = self._executor.stats()
+        return stats
 
     def run(self):
-        threading.Thread(target=self._periodic_loop).start()
+        '''
+        Main task loop
 
-        while not time_to_die():
+        Waits for commands until the next periodic deadline,
+        and exits as soon as the shutdown flag is set.
+        '''
+        self._start_timers()
 
-            # Execute the while loop every now and then
-            try:
-                msg = self.qin.get(timeout=1)
-            except queue.Empty:
+        while not shutdown.is_set():
+
+            timeout = self._run_timers()
+
+            r, _, _ = select.select([self.qin, shutdown], [], [], timeout)
+            if self.qin not in r:
                 continue
 
             try:
-                self.dispatch(msg)
-            except DispatchError as e:
-                print(e)
+                msgs = self.qin.get_many(block=False)
+            except queue.Empty:
+                continue
 
-    @handler('periodic')
-    def _periodic(self):
-        pass
+            for msg in msgs:
+                try:
+                    self.dispatch(msg)
+                except DispatchError as e:
+                    print(e)
 
-    def _periodic_loop(self):
-        while not time_to_die():
-            time.sleep(self.period)
-            self.send_to_myself('periodic')
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
 
 # ___oOo___
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+'''
+Shared-memory transport between processes on the same host.
+
+Each direction of a connection is a single-producer, single-consumer
+ring buffer in a multiprocessing.shared_memory block. Records are
+binary frames (see the framing module), so Messages, text lines and
+NumPy arrays are all supported, and data is copied only once into
+and once out of the shared memory.
+
+The ring buffer is lock-free: the producer only ever writes the
+write position, and the consumer the read position. Positions are
+published after the data they refer to, relying on the total store
+ordering of x86 CPUs for visibility across processes. Python has
+no memory barriers, so rings refuse to run on weakly ordered CPUs
+like ARM or POWER, where another process could see a new position
+before the data.
+
+Each ring has a wakeup fd (a named pipe), so that the consumer can
+wait for data using select(). The producer writes a wakeup byte
+after publishing new data, and the consumer drains the pipe before
+looking at the ring, so that no wakeup can be lost. A full pipe
+means that a wakeup is already pending, so the producer never blocks.
+In the other direction, the consumer writes to a second pipe after
+freeing space, so that a producer with a full ring can also wait
+using select(), with the same protocol.
+The pipes are created with owner-only permissions in a private directory
+from tempfile.mkdtemp(), whose path is stored in the ring header
+for the other process to find.
+
+POSIX only, since it relies on named pipes.
+'''
+
+import os
+import errno
+import struct
+import platform
+import select
+import tempfile
+import functools
+from multiprocessing import shared_memory, resource_tracker
+
+from quickgui.framework.framing import encode_buffers, decode_payload
+from quickgui.framework.framing import FramingError
+from quickgui.framework.quick_base import shutdown
+from quickgui.framework import stats
+
+_pos = struct.Struct('Q')
+_length = struct.Struct('!I')
+_dir_length = struct.Struct('H')
+
+# Header layout, with the two positions in separate cache lines,
+# and the directory of the named pipes as a length-prefixed path
+_WRITE_POS = 0
+_READ_POS = 64
+_CAPACITY = 128
+_FIFO_DIR = 256
+_DATA = 4096
+
+DEFAULT_SIZE = 8 * 1024 * 1024
+
+# CPUs with total store ordering, as platform.machine() reports them
+_TSO_MACHINES = ('x86_64', 'amd64', 'i386', 'i486', 'i586', 'i686', 'x86')
+
+# Rings created by this process, that are tracked for cleanup
+_created = set()
+
+# Named pipes of each ring: data available, and space available
+_FIFOS = ('wakeup', 'space')
+
+
+def _wake(fd):
+    '''Write a wakeup byte into a pipe, unless one is already pending'''
+    try:
+        os.write(fd, b'x')
+    except BlockingIOError:
+        pass   # A wakeup is already pending
+
+
+def _drain(fd):
+    '''Consume all pending wakeups from a pipe'''
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+
+class RingBuffer():
+    '''
+    Single-producer, single-consumer ring buffer in shared memory.
+
+    One process creates the ring (`create` = True) with a data area
+    of `size` bytes, and another one attaches to it by name.
+    Either side can be the producer (put_many()) or the consumer
+    (get_many(), fileno()), but each ring must have exactly one of each.
+    A producer that finds the ring full can wait for space_fileno().
+
+    Raises RuntimeError on CPUs without total store ordering.
+    '''
+
+    def __init__(self, name, size=DEFAULT_SIZE, create=False):
+        machine = platform.machine()
+        if machine.lower() not in _TSO_MACHINES:
+            raise RuntimeError('Shared memory rings need an x86 CPU, not %s'
+                               % machine)
+        self.name = name
+        self.created = create
+
+        if create:
+            self._shm = shared_memory.SharedMemory(name, create=True,
+                                                   size=_DATA + size)
+            self._dir = tempfile.mkdtemp(prefix='quickgui_')
+            for fifo in _FIFOS:
+                os.mkfifo(os.path.join(self._dir, fifo), 0o600)
+            _pos.pack_into(self._shm.buf, _CAPACITY, size)
+            # The directory goes last, since it marks the header as ready
+            path = os.fsencode(self._dir)
+            self._shm.buf[_FIFO_DIR + _dir_length.size:
+                          _FIFO_DIR + _dir_length.size + len(path)] = path
+            _dir_length.pack_into(self._shm.buf, _FIFO_DIR, len(path))
+            _created.add(name)
+        else:
+            self._shm = shared_memory.SharedMemory(name)
+            # Only the creator is responsible for unlinking
+            if name not in _created:
+                resource_tracker.unregister(self._shm._name, 'shared_memory')
+            length, = _dir_length.unpack_from(self._shm.buf, _FIFO_DIR)
+            if length == 0:
+                self._shm.close()
+                raise FileNotFoundError(errno.ENOENT,
+                                        'Ring %s is not ready yet' % name)
+            start = _FIFO_DIR + _dir_length.size
+            self._dir = os.fsdecode(bytes(self._shm.buf[start:start + length]))
+
+        self._buf = self._shm.buf
+        self.capacity = _pos.unpack_from(self._buf, _CAPACITY)[0]
+        self._data = self._buf[_DATA:_DATA + self.capacity]
+
+        # O_RDWR keeps the pipes open even without a peer
+        self._fifo, self._space = [os.open(os.path.join(self._dir, fifo),
+                                           os.O_RDWR | os.O_NONBLOCK)
+                                   for fifo in _FIFOS]
+
+    def fileno(self):
+        return self._fifo
+
+    def space_fileno(self):
+        '''A fd that becomes readable when the consumer frees space'''
+        return self._space
+
+    def _get_pos(self, offset):
+        return _pos.unpack_from(self._buf, offset)[0]
+
+    def _copy_in(self, pos, data):
+        data = memoryview(data).cast('B')
+        idx = pos % self.capacity
+        first = min(len(data), self.capacity - idx)
+        self._data[idx:idx + first] = data[:first]
+        if first < len(data):
+            self._data[:len(data) - first] = data[first:]
+
+    def _copy_out(self, pos, n):
+        idx = pos % self.capacity
+        if idx + n <= self.capacity:
+            return self._data[idx:idx + n]
+        first = self.capacity - idx
+        return bytes(self._data[idx:]) + bytes(self._data[:n - first])
+
+    def encode(self, item):
+        '''
+        Encode `item` as a frame for put_frames().
+
+        Returns a (buffers, size) tuple. Raises FramingError
+        if the frame is larger than the whole ring.
+        '''
+        buffers = encode_buffers([item])
+        size = sum(memoryview(buf).nbytes for buf in buffers)
+        if size > self.capacity:
+            raise FramingError('Message of %d bytes larger than the ring buffer'
+                               % size)
+        return buffers, size
+
+    def put_many(self, items):
+        '''
+        Write as many items as possible into the ring.
+
+        Returns the number of items written, which is less than
+        len(items) if the ring is full. Raises FramingError, without
+        writing anything, if any item is larger than the whole ring.
+        '''
+        return self.put_frames([self.encode(item) for item in items])
+
+    def put_frames(self, frames):
+        '''
+        Write as many encoded frames (see encode()) as possible into the ring.
+
+        Returns the number of frames written, which is less than
+        len(frames) if the ring is full.
+        '''
+        _drain(self._space)
+
+        write_pos = self._get_pos(_WRITE_POS)
+        free = self.capacity - (write_pos - self._get_pos(_READ_POS))
+
+        n = 0
+        for buffers, size in frames:
+            if size > free:
+                break
+            for buf in buffers:
+                self._copy_in(write_pos, buf)
+                write_pos += memoryview(buf).nbytes
+            free -= size
+            n += 1
+
+        if n > 0:
+            _pos.pack_into(self._buf, _WRITE_POS, write_pos)
+            _wake(self._fifo)
+        return n
+
+    def get_many(self):
+        '''Read all the items available in the ring'''
+        _drain(self._fifo)
+
+        read_pos = self._get_pos(_READ_POS)
+        write_pos = self._get_pos(_WRITE_POS)
+
+        items = []
+        while read_pos < write_pos:
+            length, = _length.unpack(self._copy_out(read_pos, _length.size))
+            payload = self._copy_out(read_pos + _length.size, length)
+            items.append(decode_payload(payload))
+            read_pos += _length.size + length
+
+        if items:
+            _pos.pack_into(self._buf, _READ_POS, read_pos)
+            _wake(self._space)
+        return items
+
+    def close(self):
+        self._data.release()
+        self._buf = None
+        self._shm.close()
+        os.close(self._fifo)
+        os.close(self._space)
+        if self.created:
+            self._shm.unlink()
+            _created.discard(self.name)
+            try:
+                for fifo in _FIFOS:
+                    os.unlink(os.path.join(self._dir, fifo))
+                os.rmdir(self._dir)
+            except OSError:
+                pass
+
+
+def _bridge(qin, qout, ring_in, ring_out, name):
+    '''
+    Move data from qout to ring_out, and from ring_in to qin,
+    until the shutdown flag is set.
+
+    Items are encoded once when they leave qout. While ring_out is full,
+    qout is not read, so that its own bound and overflow policy apply,
+    and the bridge waits for the consumer to free space in the ring.
+    Items larger than the whole ring are dropped.
+    '''
+    pending = []   # Encoded frames waiting for space in ring_out
+    dropped = [0]
+
+    def bridge_stats():
+        return {'pending': len(pending), 'dropped': dropped[0]}
+
+    stats.register(name, bridge_stats)
+    try:
+        while not shutdown.is_set():
+            if pending:
+                # Ring full, wait for space
+                r, _, _ = select.select([ring_out.space_fileno(), ring_in,
+                                         shutdown], [], [])
+            else:
+                r, _, _ = select.select([qout, ring_in, shutdown], [], [])
+
+            if qout in r:
+                for item in qout.get_many(block=False):
+                    try:
+                        pending.append(ring_out.encode(item))
+                    except FramingError as e:
+                        print('Dropping message: %s' % e)
+                        dropped[0] += 1
+            if pending:
+                n = ring_out.put_frames(pending)
+                del pending[:n]
+            if ring_in in r:
+                items = ring_in.get_many()
+                if items:
+                    qin.put_many(items)
+    finally:
+        stats.unregister(name)
+
+
+def shm_server(name, size, qin, qout):
+    '''
+    Shared memory server for task queues.
+
+    Creates the two ring buffers for the connection, and forwards
+    data between them and the task queues until shutdown.
+
+    qin and qout are seen from the task's perspective, so qin is data
+    going to the task, and qout is data going to the client.
+    '''
+    ring_up = RingBuffer(name + '_up', size, create=True)
+    ring_down = RingBuffer(name + '_down', size, create=True)
+    print('started shared memory server %s' % name)
+    try:
+        _bridge(qin, qout, ring_up, ring_down, 'shm_server:%s' % name)
+    finally:
+        ring_up.close()
+        ring_down.close()
+
+
+def shm_client(name, qin, qout):
+    '''
+    Shared memory client for queue-based communication.
+
+    Waits for the server to create the ring buffers, then forwards data
+    between them and the client queues until shutdown.
+
+    qin and qout are seen from the perspective of the client, so qin is data
+    going to the client, and qout is data going to the task.
+    '''
+    while not shutdown.is_set():
+        try:
+            ring_up = RingBuffer(name + '_up')
+            ring_down = RingBuffer(name + '_down')
+            break
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            print('waiting for shared memory server %s' % name)
+            shutdown.wait(1)
+    else:
+        return
+
+    try:
+        _bridge(qin, qout, ring_down, ring_up, 'shm_client:%s' % name)
+    finally:
+        ring_up.close()
+        ring_down.close()
+
+
+def get_shm_server(name, size=DEFAULT_SIZE):
+    '''Get a shared memory server adapter
+
+    Returns a callable that, when called, produces a server with
+    shared memory ring buffers called `name`, each one with `size`
+    bytes of data, and can be used to connect the task input/output
+    queues to a client on the same host.
+
+    The callable will have two arguments: `qin` and `qout`, that must be
+    the same queues used in the task's instantiation.
+    Only one client at a time can be connected.
+    '''
+    return functools.partial(shm_server, name, size)
+
+
+def get_shm_client(name):
+    '''Get a shared memory client adapter
+
+    Returns a callable that, when called, produces a client that will
+    connect to the shared memory server called `name`, and can be used
+    to connect a GUI's or another client's input/output queues to it.
+
+    The callable will have two arguments: `qin` and `qout`, that must be
+    the same queues used in the GUI instantiation.
+    '''
+    return functools.partial(shm_client, name)
@@ -1,14 +1,15 @@
 # -*- coding: utf-8 -*-
 
-import time
 import queue
 import socket
 import select
 import functools
 
-from quickgui.framework.quick_base import time_to_die
+from quickgui.framework.framing import StreamDecoder, FramingError, HELLO
+from quickgui.framework.framing import encode_buffers, encode_text, send_buffers
+from quickgui.framework.quick_base import shutdown
 
-def socket_client(host, port, qin, qout):
+def socket_client(host, port, binary, qin, qout):
     '''
     TCP client for queue-based communication.
 
@@ -21,36 +22,45 @@ def socket_client(host, port, qin, qout):
 
     If the server connection is lost, this client will automatically try
     to reconnect in an infinite loop instead of shutting down.
+
+    If `binary` is True, the client asks the server to switch
+    the connection to binary frames (see the framing module).
     '''
-    while not time_to_die():
+    while not shutdown.is_set():
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
             try:
                 print('connecting to ', host, port)
                 sock.connect((host, port))
+                decoder = StreamDecoder()
+                if binary:
+                    sock.sendall(HELLO)
 
-                while not time_to_die():
-                    r, _, _ = select.select([sock, qout], [], [])
+                while not shutdown.is_set():
+                    r, _, _ = select.select([sock, qout, shutdown], [], [])
 
                     if qout in r:
-                        msg = qout.get()
-                        sock.sendall(msg.encode('utf-8'))
+                        msgs = qout.get_many()
+                        if binary:
+                            send_buffers(sock, encode_buffers(msgs))
+                        else:
+                            sock.sendall(encode_text(msgs))
 
                     if sock in r:
-                        msg = sock.recv(128)   # NewLineQueue will take care
-                        if msg:                # of message boundaries.
+                        msgs = decoder.recv(sock)
+                        if msgs is not None:
                             try:
-                                qin.put(msg.decode('utf-8'), block=False)
+                                qin.put_many(msgs, block=False)
                             except queue.Full:
                                 pass
                         else:
                             raise OSError('client disconnected')
 
-            except OSError as e:
+            except (OSError, FramingError) as e:
                 print(e)
-                time.sleep(1)
+                shutdown.wait(1)   # Slow down reconnect loop
 
 
-def get_client(host, port):
+def get_client(host, port, binary=False):
     '''Get a TCP client adapter
 
     Returns a callable that, when called, produces a TCP client that will
@@ -59,5 +69,8 @@ def get_client(host, port):
 
     The callable will have two arguments: `qin` and `qout`, that must be
     the same queues used in the GUI instantiation.
+
+    If `binary` is True, binary frames are used instead of the text
+    protocol. This requires a server supporting them.
     '''
-    return functools.partial(socket_client, host, port)
+    return functools.partial(socket_client, host, port, binary)
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import queue
+import asyncio
+import functools
+
+from quickgui.framework.framing import StreamDecoder, FramingError, HELLO
+from quickgui.framework.framing import encode_buffers, encode_text
+from quickgui.framework.quick_base import shutdown
+
+RECV_SIZE = 65536
+
+
+class AsyncQueueClient():
+    '''
+    asyncio TCP client for queue-based communication.
+
+    Connects to the specified host and port, sends whatever data comes
+    from qout to the socket, and puts any incoming data from the socket
+    into qin. The event loop waits on the file descriptor of `qout`,
+    so no additional threads are needed.
+
+    qin and qout are seen from the perspective of the client, so qin is data
+    going to the client, and qout is data going to the task.
+
+    If the server connection is lost, this client will automatically try
+    to reconnect until the shutdown flag is set.
+
+    If `binary` is True, the client asks the server to switch
+    the connection to binary frames (see the framing module).
+    '''
+
+    def __init__(self, host, port, qin, qout, binary=False):
+        self.host = host
+        self.port = port
+        self.qin = qin
+        self.qout = qout
+        self.binary = binary
+        self._writer = None
+        self._stop = None
+
+    def _shutdown(self):
+        asyncio.get_running_loop().remove_reader(shutdown)
+        self._stop.set_result(None)
+        if self._writer is not None:
+            self._writer.close()
+
+    def _forward(self):
+        try:
+            msgs = self.qout.get_many(block=False)
+        except queue.Empty:
+            return
+        if self.binary:
+            self._writer.writelines(encode_buffers(msgs))
+        else:
+            self._writer.write(encode_text(msgs))
+
+    async def _session(self, reader):
+        loop = asyncio.get_running_loop()
+        decoder = StreamDecoder()
+        if self.binary:
+            self._writer.write(HELLO)
+
+        loop.add_reader(self.qout, self._forward)
+        try:
+            while not self._stop.done():
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    if self._stop.done():
+                        break
+                    raise OSError('client disconnected')
+                try:
+                    self.qin.put_many(decoder.feed(data), block=False)
+                except queue.Full:
+                    pass
+        finally:
+            loop.remove_reader(self.qout)
+
+    async def run(self):
+        '''Connect and serve the connection until the shutdown flag is set'''
+        loop = asyncio.get_running_loop()
+        self._stop = loop.create_future()
+        loop.add_reader(shutdown, self._shutdown)
+
+        while not self._stop.done():
+            try:
+                print('connecting to ', self.host, self.port)
+                reader, self._writer = await asyncio.open_connection(
+                                                    self.host, self.port)
+                await self._session(reader)
+            except (OSError, FramingError) as e:
+                print(e)
+                # Slow down reconnect loop
+                await asyncio.wait([self._stop], timeout=1)
+            finally:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._writer = None
+
+
+def socket_client(host, port, binary, qin, qout):
+    '''Run an AsyncQueueClient in its own event loop until shutdown'''
+    client = AsyncQueueClient(host, port, qin, qout, binary)
+    asyncio.run(client.run())
+
+
+def get_client(host, port, binary=False):
+    '''Get an asyncio TCP client adapter
+
+    Returns a callable that, when called, produces a TCP client that will
+    connect to `host`:`port`, and can be used to connect a GUI's or
+    another client's input/output queues to a TCP socket.
+
+    The callable will have two arguments: `qin` and `qout`, that must be
+    the same queues used in the GUI instantiation.
+
+    If `binary` is True, binary frames are used instead of the text
+    protocol. This requires a server supporting them.
+    '''
+    return functools.partial(socket_client, host, port, binary)
@@ -1,13 +1,15 @@
 # -*- coding: utf-8 -*-
 
 import io
-import time
 import queue
 import socket
 import select
 import functools
 
-from quickgui.framework.quick_base import time_to_die
+from quickgui.framework.messages import to_text
+from quickgui.framework.framing import StreamDecoder, FramingError
+from quickgui.framework.framing import HELLO, encode_buffers, send_buffers
+from quickgui.framework.quick_base import shutdown
 
 class DisconnectedException(Exception):
     '''Socket was disconnected'''
@@ -28,13 +30,17 @@ class QueueClient():
 
     If the server connection is lost, this client will automatically try
     to reconnect in an infinite loop instead of shutting down.
+
+    If `binary` is True, the client asks the server to switch
+    the connection to binary frames (see the framing module).
     '''
 
-    def __init__(self, host, port, qin, qout):
+    def __init__(self, host, port, qin, qout, binary=False):
         self.qin = qin
         self.qout = qout
         self.host = host
         self.port = port
+        self.binary = binary
         self.connected = False
 
     def run(self):
@@ -49,10 +55,10 @@ class QueueClient():
         read/write becomes too complicated when the underlying socket
         changes without warning.
         '''
-        while not time_to_die():
+        while not shutdown.is_set():
             self.connect()
             try:
-                r, _, _ = select.select([self.sock, self.qout], [], [])
+                r, _, _ = select.select([self.sock, self.qout, shutdown], [], [])
                 if self.qout in r:
                     self.write()
                 if self.sock in r:
@@ -61,26 +67,29 @@ class QueueClient():
                 self.disconnect()
 
     def read(self):
-        msg = None
         try:
-            msg = self.sockfile.readline()
-            if msg:
-                self.qin.put(msg, block=False)
+            msgs = self.decoder.recv(self.sock)
+            if msgs is not None:
+                self.qin.put_many(msgs, block=False)
             else:
                 print('recv giving up')
                 raise DisconnectedException
         except queue.Full:
             return
-        except OSError as e:
+        except (OSError, FramingError) as e:
             print('Exception: ', e)
             raise DisconnectedException
 
     def write(self):
         try:
-            msg = self.qout.get(block=False)
+            msgs = self.qout.get_many(block=False)
 
-            self.sockfile.write(msg + '\n')
-            self.sockfile.flush()
+            if self.binary and self.connected:
+                send_buffers(self.sock, encode_buffers(msgs))
+            else:
+                for msg in msgs:
+                    self.sockfile.write(to_text(msg))
+                self.sockfile.flush()
         except queue.Empty:
             return
         except OSError as e:
@@ -92,16 +101,19 @@ class QueueClient():
         if not self.connected:
             # Provide a fake sockfile for read/write in case we don't connect
             self.sockfile = io.StringIO('')
+            self.decoder = StreamDecoder()
             self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             try:
                 print('connecting to ', self.host, self.port)
                 self.sock.connect((self.host, self.port))
                 self.sockfile = self.sock.makefile('rw')
+                if self.binary:
+                    self.sock.sendall(HELLO)
                 self.connected = True
                 print('Connected!')
             except Exception as e:
                 print(e)
-                time.sleep(1)   # Slow down reconnect loop
+                shutdown.wait(1)   # Slow down reconnect loop
 
     def disconnect(self):
         try:
@@ -111,13 +123,13 @@ class QueueClient():
             pass
 
 
-def _start_client(host, port, qin, qout):
+def _start_client(host, port, binary, qin, qout):
 
-    client = QueueClient(host, port, qin, qout)
+    client = QueueClient(host, port, qin, qout, binary)
     client.run()
 
 
-def get_client(host, port):
+def get_client(host, port, binary=False):
     '''Get a TCP client adapter
 
     Returns a callable that, when called, produces a TCP client that will
@@ -126,5 +138,8 @@ def get_client(host, port):
 
     The callable will have two arguments: `qin` and `qout`, that must be
     the same queues used in the GUI instantiation.
+
+    If `binary` is True, binary frames are used instead of the text
+    protocol. This requires a server supporting them.
     '''
-    return functools.partial(_start_client, host, port)
+    return functools.partial(_start_client, host, port, binary)
@@ -4,10 +4,17 @@ import select
 import socket
 import functools
 
-from quickgui.framework.quick_base import time_to_die
+from quickgui.framework import stats
+from quickgui.framework.messages import LastValueCache
+from quickgui.framework.framing import StreamDecoder, HELLO, nbytes
+from quickgui.framework.framing import encode_buffers, encode_text, send_buffers
+from quickgui.framework.quick_base import shutdown
 
 
-def serve_forever(host, port, qin, qout):
+RECV_SIZE = 65536
+
+
+def serve_forever(host, port, recv_size, snapshot, snapshot_keys, qin, qout):
     '''
     Socket server for task queues.
 
@@ -15,49 +22,127 @@ def serve_forever(host, port, qin, qout):
     received from the task to all clients, and forwarding any data
     received from client to the task.
 
+    Clients can use either the text protocol or binary frames,
+    as negotiated on each connection (see the framing module).
+    Data is received in chunks of up to `recv_size` bytes, and each
+    connection assembles its own lines, so that only complete lines
+    are put into qin.
+
+    Messages for clients that are not ready to receive them are dropped.
+
+    If `snapshot` is True, the last message of each command in
+    `snapshot_keys` (all commands if None, up to the size of the
+    LastValueCache) is kept, and new clients receive all of them
+    before any other message. `snapshot_keys` should list state values
+    only, so that one-shot events are not replayed. The snapshot is sent
+    as soon as the client is ready to receive it, like any other message.
+
+    Per-client statistics are registered in the stats module
+    as 'socket_server:<port>'.
+
     qint and qout are seen from the task's perspective, so qin is data
     going to the task, and qout is data going to the clients.
 
-    Exits if the 'quit' message is seen passing from the task to the clients.
+    Exits as soon as the shutdown flag is set.
     '''
     serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
     serversocket.bind((host, port))
     serversocket.listen(5)
+    port = serversocket.getsockname()[1]   # In case port 0 was requested
     print("started server on port %d" % port)
 
     sockets = []
+    decoders = {}
+    clients = {}   # socket -> (statistics, decoder)
+    cache = LastValueCache(snapshot_keys) if snapshot else None
+    needs_snapshot = set()   # Sockets still waiting for their snapshot
+
+    def server_stats():
+        return {'clients': [dict(c, bytes_in=decoder.bytes_received)
+                            for c, decoder in list(clients.values())],
+                'cached': len(cache) if cache is not None else 0}
+
+    stats.register('socket_server:%d' % port, server_stats)
 
-    while not time_to_die():
-        r, _, _ = select.select([serversocket, qout] + sockets, [], [])
+    while not shutdown.is_set():
+        r, _, _ = select.select([serversocket, qout, shutdown] + sockets, [], [])
         _, w, _ = select.select([], sockets, [], 0)
 
         if serversocket in r:
             sock, address = serversocket.accept()
             sockets.append(sock)
+            decoders[sock] = StreamDecoder()
+            clients[sock] = ({'address': '%s:%d' % address[:2],
+                              'bytes_out': 0, 'dropped': 0}, decoders[sock])
             print('Accepted new connection from ', address)
+            if cache is not None:
+                needs_snapshot.add(sock)
+            # A new socket is ready to send, do not drop anything yet
+            w.append(sock)
 
+        # Forward everything that is ready in a single send,
+        # encoding it at most once for each wire format.
         try:
-            msg = qout.get(block=False)
+            msgs = qout.get_many(block=False)
         except queue.Empty:
-            msg = ''
+            msgs = []
+        encoded = {}
 
-        for sock in sockets:
+        for sock in sockets[:]:
+            decoder = decoders[sock]
             try:
-                if msg and (sock in w):
-                    sock.sendall(msg.encode('utf-8'))
+                if msgs and (sock not in w):
+                    clients[sock][0]['dropped'] += len(msgs)
+                elif sock in w and sock in needs_snapshot:
+                    # The cache is updated below, so the snapshot
+                    # does not include msgs yet
+                    needs_snapshot.discard(sock)
+                    items = cache.snapshot() + msgs
+                    if items:
+                        if decoder.binary:
+                            buffers = encode_buffers(items)
+                        else:
+                            buffers = [encode_text(items)]
+                        send_buffers(sock, buffers)
+                        clients[sock][0]['bytes_out'] += nbytes(buffers)
+                elif msgs:
+                    if decoder.binary not in encoded:
+                        if decoder.binary:
+                            buffers = encode_buffers(msgs)
+                        else:
+                            buffers = [encode_text(msgs)]
+                        encoded[decoder.binary] = (buffers, nbytes(buffers))
+                    buffers, size = encoded[decoder.binary]
+                    send_buffers(sock, buffers)
+                    clients[sock][0]['bytes_out'] += size
                 if sock in r:
-                    data = sock.recv(128)  # NewLineQueue will take care
-                    if data:               # of message boundaries.
-                        qin.put(data.decode('utf-8'))
+                    was_binary = decoder.binary
+                    data = decoder.recv(sock, recv_size)
+                    if data is not None:
+                        qin.put_many(data)
+                        if decoder.binary and not was_binary:
+                            sock.sendall(HELLO)
                     else:
                         raise Exception('Disconnected')
             except Exception as e:
                 print('Removing client socket: %s' % e)
                 sockets.remove(sock)
+                del decoders[sock]
+                del clients[sock]
+                needs_snapshot.discard(sock)
+                sock.close()
+
+        if cache is not None:
+            cache.update(msgs)
+
+    stats.unregister('socket_server:%d' % port)
+    for sock in sockets:
+        sock.close()
+    serversocket.close()
 
 
-def get_server(host, port):
+def get_server(host, port, recv_size=RECV_SIZE, snapshot=False, snapshot_keys=None):
     '''Get a TCP server adapter
 
     Returns a callable that, when called, produces a TCP server
@@ -66,5 +151,10 @@ def get_server(host, port):
 
     The callable will have two arguments: `qin` and `qout`, that must be
     the same queues used in the task's instantiation.
+    `recv_size` is the maximum number of bytes received from
+    a client with a single system call.
+    `snapshot` and `snapshot_keys` select the last values sent
+    to new clients (see serve_forever()).
     '''
-    return functools.partial(serve_forever, host, port)
+    return functools.partial(serve_forever, host, port, recv_size,
+                             snapshot, snapshot_keys)
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+import queue
+import asyncio
+import functools
+
+from quickgui.framework import stats
+from quickgui.framework.framing import StreamDecoder, FramingError, HELLO, nbytes
+from quickgui.framework.framing import encode_buffers, encode_text
+from quickgui.framework.quick_base import shutdown
+
+RECV_SIZE = 65536
+DEFAULT_HIGH_WATER = 16 * 1024 * 1024
+BACKLOG = 1024
+
+
+class AsyncQueueServer():
+    '''
+    asyncio socket server for task queues.
+
+    All clients are served by a single event loop in one thread.
+    The loop waits on the file descriptor of `qout`, so no thread is
+    needed to move data between queues and sockets. Data from the task
+    is encoded once for each wire format and appended to the write
+    buffer of each connection, so that a slow client never blocks the
+    others. Clients whose write buffer grows beyond `high_water` bytes
+    are disconnected.
+
+    Clients can use either the text protocol or binary frames,
+    as negotiated on each connection (see the framing module).
+
+    qin and qout are seen from the task's perspective, so qin is data
+    going to the task, and qout is data going to the clients.
+
+    Per-client statistics are available with stats(), and are registered
+    in the stats module as 'socket_server_async:<port>'.
+    '''
+
+    def __init__(self, host, port, qin, qout, high_water=DEFAULT_HIGH_WATER):
+        self.host = host
+        self.port = port
+        self.qin = qin
+        self.qout = qout
+        self.high_water = high_water
+        self.clients = {}    # StreamWriter -> StreamDecoder
+        self._client_stats = {}   # StreamWriter -> statistics
+        self._handlers = set()
+        self._stop = None
+
+    def _shutdown(self):
+        asyncio.get_running_loop().remove_reader(shutdown)
+        self._stop.set_result(None)
+
+    def stats(self):
+        '''Bytes received and sent, and bytes waiting to be sent, per client'''
+        clients = []
+        for writer, client in list(self._client_stats.items()):
+            pending = writer.transport.get_write_buffer_size()
+            clients.append(dict(client, pending=pending))
+        return {'clients': clients}
+
+    def _remove(self, writer, reason=None):
+        self._client_stats.pop(writer, None)
+        if self.clients.pop(writer, None) is not None:
+            if reason is not None:
+                print('Removing client: %s' % reason)
+            writer.transport.abort()
+
+    def _forward(self):
+        '''Send everything ready in qout to all clients'''
+        try:
+            msgs = self.qout.get_many(block=False)
+        except queue.Empty:
+            return
+
+        encoded = {}
+        for writer, decoder in list(self.clients.items()):
+            binary = decoder.binary
+            if binary not in encoded:
+                if binary:
+                    buffers = encode_buffers(msgs)
+                else:
+                    buffers = [encode_text(msgs)]
+                encoded[binary] = (buffers, nbytes(buffers))
+            buffers, size = encoded[binary]
+            writer.writelines(buffers)
+            self._client_stats[writer]['bytes_out'] += size
+            if writer.transport.get_write_buffer_size() > self.high_water:
+                self._remove(writer, 'too slow')
+
+    async def _handle(self, reader, writer):
+        decoder = StreamDecoder()
+        address = writer.get_extra_info('peername')
+        client = {'address': '%s:%d' % address[:2],
+                  'bytes_in': 0, 'bytes_out': 0}
+        self.clients[writer] = decoder
+        self._client_stats[writer] = client
+        self._handlers.add(asyncio.current_task())
+        print('Accepted new connection from ', address)
+        try:
+            while writer in self.clients:
+                data = await reader.read(RECV_SIZE)
+                if not data:
+                    raise OSError('Disconnected')
+                client['bytes_in'] += len(data)
+                was_binary = decoder.binary
+                self.qin.put_many(decoder.feed(data))
+                if decoder.binary and not was_binary:
+                    writer.write(HELLO)
+        except (OSError, FramingError) as e:
+            self._remove(writer, e)
+        finally:
+            self._handlers.discard(asyncio.current_task())
+
+    async def serve(self):
+        '''Serve clients until the shutdown flag is set'''
+        loop = asyncio.get_running_loop()
+        self._stop = loop.create_future()
+        loop.add_reader(shutdown, self._shutdown)
+        loop.add_reader(self.qout, self._forward)
+
+        server = await asyncio.start_server(self._handle, self.host, self.port,
+                                            backlog=BACKLOG)
+        self.port = server.sockets[0].getsockname()[1]   # In case port 0 was requested
+        print("started server on port %d" % self.port)
+        stats.register('socket_server_async:%d' % self.port, self.stats)
+        try:
+            await self._stop
+        finally:
+            stats.unregister('socket_server_async:%d' % self.port)
+            loop.remove_reader(self.qout)
+            server.close()
+            for writer in list(self.clients):
+                self._remove(writer)
+            await asyncio.gather(*self._handlers)
+            await server.wait_closed()
+
+
+def serve_forever(host, port, high_water, qin, qout):
+    '''Run an AsyncQueueServer in its own event loop until shutdown'''
+    server = AsyncQueueServer(host, port, qin, qout, high_water)
+    asyncio.run(server.serve())
+
+
+def get_server(host, port, high_water=DEFAULT_HIGH_WATER):
+    '''Get an asyncio TCP server adapter
+
+    Returns a callable that, when called, produces a TCP server
+    running on `host`:`port`, and can be used to connect the task
+    input/output queues to a TCP socket.
+
+    The callable will have two arguments: `qin` and `qout`, that must be
+    the same queues used in the task's instantiation.
+    Clients with more than `high_water` bytes of pending output
+    are disconnected.
+    '''
+    return functools.partial(serve_forever, host, port, high_water)
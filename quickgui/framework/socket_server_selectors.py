@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+import queue
+import socket
+import selectors
+import functools
+from collections import deque
+
+from quickgui.framework import stats
+from quickgui.framework.framing import StreamDecoder, FramingError, HELLO, IOV_MAX
+from quickgui.framework.framing import encode_buffers, encode_text
+from quickgui.framework.queues import DROP_NEWEST
+from quickgui.framework.quick_base import shutdown
+
+RECV_SIZE = 65536
+DEFAULT_HIGH_WATER = 16 * 1024 * 1024
+
+# Policy for clients over the high-water mark, besides DROP_NEWEST
+DISCONNECT = 'disconnect'
+
+
+class _Client():
+    '''
+    A client connection with its own write buffer.
+
+    The buffer is a list of bytes-like objects, shared with
+    all other clients using the same wire format.
+    '''
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = '%s:%d' % address[:2]
+        self.decoder = StreamDecoder()
+        self.buffers = deque()
+        self.pending = 0     # Bytes in buffers
+        self.dropped = 0     # Messages dropped because of high water
+        self.bytes_out = 0
+
+    def stats(self):
+        return {'address': self.address,
+                'bytes_in': self.decoder.bytes_received,
+                'bytes_out': self.bytes_out,
+                'pending': self.pending,
+                'dropped': self.dropped}
+
+    def append(self, buffers):
+        for buf in buffers:
+            view = memoryview(buf).cast('B')
+            if len(view) > 0:
+                self.buffers.append(view)
+                self.pending += len(view)
+
+    def flush(self):
+        '''Send as much as possible with a single system call'''
+        n = self.sock.sendmsg(list(self.buffers)[:IOV_MAX])
+        self.pending -= n
+        self.bytes_out += n
+        while n > 0:
+            first = self.buffers[0]
+            if n >= len(first):
+                n -= len(first)
+                self.buffers.popleft()
+            else:
+                self.buffers[0] = first[n:]
+                n = 0
+
+
+class SelectorQueueServer():
+    '''
+    Single-threaded socket server for task queues.
+
+    All clients are served from a single thread using non-blocking
+    sockets and a selector (epoll on Linux), so the number of threads
+    does not depend on the number of clients.
+
+    Data coming from the task is encoded only once for each wire format,
+    and the resulting buffers are shared between the write buffers of all
+    clients. Each writable socket is flushed with a single sendmsg()
+    call per wakeup.
+
+    Clients with more than `high_water` bytes waiting in their write
+    buffer are too slow to keep up: depending on `slow_policy`, they are
+    either disconnected (DISCONNECT) or they skip new data until their
+    buffer has been drained (DROP_NEWEST). In the latter case, the number
+    of skipped messages is kept in `dropped`.
+
+    Clients can use either the text protocol or binary frames,
+    as negotiated on each connection (see the framing module).
+
+    qin and qout are seen from the task's perspective, so qin is data
+    going to the task, and qout is data going to the clients.
+
+    Per-client statistics are available with stats(), and are registered
+    in the stats module as 'socket_server_selectors:<port>'.
+    '''
+
+    def __init__(self, host, port, qin, qout, high_water=DEFAULT_HIGH_WATER,
+                 slow_policy=DISCONNECT):
+        if slow_policy not in (DISCONNECT, DROP_NEWEST):
+            raise ValueError('Unknown slow client policy: %s' % slow_policy)
+        self.host = host
+        self.port = port
+        self.qin = qin
+        self.qout = qout
+        self.high_water = high_water
+        self.slow_policy = slow_policy
+        self.clients = {}    # socket -> _Client
+        self.dropped = 0
+
+    def _accept(self, serversocket):
+        sock, address = serversocket.accept()
+        sock.setblocking(False)
+        self.clients[sock] = _Client(sock, address)
+        self._selector.register(sock, selectors.EVENT_READ)
+        print('Accepted new connection from ', address)
+
+    def stats(self):
+        '''Bytes received and sent, pending and dropped data, per client'''
+        return {'clients': [client.stats()
+                            for client in list(self.clients.values())],
+                'dropped': self.dropped}
+
+    def _remove(self, client, reason):
+        print('Removing client socket: %s' % reason)
+        del self.clients[client.sock]
+        self._selector.unregister(client.sock)
+        client.sock.close()
+
+    def _update(self, client):
+        events = selectors.EVENT_READ
+        if client.buffers:
+            events |= selectors.EVENT_WRITE
+        self._selector.modify(client.sock, events)
+
+    def _forward(self):
+        '''Append everything ready in qout to the client buffers'''
+        try:
+            msgs = self.qout.get_many(block=False)
+        except queue.Empty:
+            return
+
+        encoded = {}
+        for client in list(self.clients.values()):
+            if client.pending > self.high_water:
+                if self.slow_policy == DISCONNECT:
+                    self._remove(client, 'too slow')
+                    continue
+                client.dropped += len(msgs)
+                self.dropped += len(msgs)
+                continue
+
+            binary = client.decoder.binary
+            if binary not in encoded:
+                if binary:
+                    encoded[True] = encode_buffers(msgs)
+                else:
+                    encoded[False] = [encode_text(msgs)]
+            was_empty = not client.buffers
+            client.append(encoded[binary])
+            if was_empty and client.buffers:
+                self._update(client)
+
+    def _read(self, client):
+        was_binary = client.decoder.binary
+        items = client.decoder.recv(client.sock, RECV_SIZE)
+        if items is None:
+            raise OSError('Disconnected')
+        self.qin.put_many(items)
+        if client.decoder.binary and not was_binary:
+            client.append([HELLO])
+            self._update(client)
+
+    def _write(self, client):
+        client.flush()
+        if not client.buffers:
+            self._update(client)
+
+    def serve_forever(self):
+        '''Serve clients until the shutdown flag is set'''
+        serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        serversocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        serversocket.bind((self.host, self.port))
+        serversocket.listen(socket.SOMAXCONN)
+        serversocket.setblocking(False)
+        self.port = serversocket.getsockname()[1]   # In case port 0 was requested
+        print("started server on port %d" % self.port)
+
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(serversocket, selectors.EVENT_READ)
+        self._selector.register(self.qout, selectors.EVENT_READ)
+        self._selector.register(shutdown, selectors.EVENT_READ)
+        stats.register('socket_server_selectors:%d' % self.port, self.stats)
+
+        try:
+            while not shutdown.is_set():
+                for key, events in self._selector.select():
+                    fileobj = key.fileobj
+                    if fileobj is serversocket:
+                        self._accept(serversocket)
+                    elif fileobj is self.qout:
+                        self._forward()
+                    elif fileobj in self.clients:
+                        client = self.clients[fileobj]
+                        try:
+                            if events & selectors.EVENT_WRITE:
+                                self._write(client)
+                            if events & selectors.EVENT_READ:
+                                self._read(client)
+                        except BlockingIOError:
+                            pass
+                        except (OSError, FramingError) as e:
+                            self._remove(client, e)
+        finally:
+            stats.unregister('socket_server_selectors:%d' % self.port)
+            for client in list(self.clients.values()):
+                client.sock.close()
+            self.clients.clear()
+            self._selector.close()
+            serversocket.close()
+
+
+def _serve(host, port, high_water, slow_policy, qin, qout):
+    server = SelectorQueueServer(host, port, qin, qout, high_water, slow_policy)
+    server.serve_forever()
+
+
+def get_server(host, port, high_water=DEFAULT_HIGH_WATER, slow_policy=DISCONNECT):
+    '''Get a single-threaded TCP server adapter
+
+    Returns a callable that, when called, produces a TCP server
+    running on `host`:`port`, and can be used to connect the task
+    input/output queues to a TCP socket.
+
+    The callable will have two arguments: `qin` and `qout`, that must be
+    the same queues used in the task's instantiation.
+    `high_water` and `slow_policy` select what happens to slow
+    clients (see SelectorQueueServer).
+    '''
+    return functools.partial(_serve, host, port, high_water, slow_policy)
@@ -1,11 +1,40 @@
 # -*- coding: utf-8 -*-
 import queue
+import select
 import threading
 import functools
 import socketserver
 from contextlib import contextmanager
 
-from quickgui.framework.quick_base import time_to_die
+from quickgui.framework import stats
+from quickgui.framework.messages import LastValueCache
+from quickgui.framework.queues import PollableQueue, DROP_NEWEST
+from quickgui.framework.framing import HELLO, read_frame, nbytes
+from quickgui.framework.framing import encode_buffers, encode_text, send_buffers
+from quickgui.framework.framing import coalesce
+from quickgui.framework.quick_base import shutdown
+from quickgui.framework.tracing import tracer, TracedMessage
+
+
+class _Encoded():
+    '''
+    A message encoded for the wire formats in use, shared by all clients.
+
+    `text` is the message encoded with the text protocol, and `buffers`
+    the list of buffers of its binary frame, or None if no client
+    was using that format when the message was encoded.
+
+    Traced messages are never shared this way: encoding adds the
+    socket_send hop, and the text protocol ends the trace, so they
+    are encoded by each client thread when they are sent.
+    '''
+
+    __slots__ = ('msg', 'text', 'buffers')
+
+    def __init__(self, msg, text, binary):
+        self.msg = msg
+        self.buffers = encode_buffers([msg]) if binary else None
+        self.text = encode_text([msg]) if text else None
 
 
 class QueueServer(socketserver.ThreadingTCPServer):
@@ -17,32 +46,66 @@ class QueueServer(socketserver.ThreadingTCPServer):
     from the task's output queue is replicated across all clients. If
     a client connection is too slow, some of the output data may be dropped.
 
+    Each message from the task is encoded only once for each wire format,
+    and the encoded bytes are shared by all clients. Each client thread
+    sends all the messages waiting in its output queue with a single
+    gathered write, so that the cost of a message grows very little
+    with the number of clients.
+
+    Each client has its own output queue, bounded by `maxsize` and using
+    the `overflow` policy (see PollableQueue). The total number of
+    messages dropped for disconnected clients is kept in `dropped`.
+    Per-client statistics, including the number of messages waiting
+    in the output queue, are available with stats().
+
+    If `snapshot` is True, the last message of each command in
+    `snapshot_keys` (all commands if None, up to the size of the
+    LastValueCache) is kept, and new clients receive all of them
+    before any other message, so that they do not have to wait for
+    the next update of slow-changing values. `snapshot_keys` should
+    list state values only, so that one-shot events are not replayed.
+
     qint and qout are seen from the task's perspective, so qin is data
     going to the task, and qout is data going to the clients.
 
     This server uses daemonic threads in order to be able to shutdown
     even while handler threads are performing blocking I/O like readline().
-    Shutdown is initiated automatically if the 'quit' message is seen
-    passing from the task to the clients.
+    Shutdown is initiated automatically as soon as the shutdown
+    flag is set.
     '''
 
     allow_reuse_address = True
     daemon_threads = True   # Allow shutdown without waiting for threads
 
-    def __init__(self, HOST, PORT, handler, qin, qout):
+    def __init__(self, HOST, PORT, handler, qin, qout,
+                 maxsize=0, overflow=DROP_NEWEST,
+                 snapshot=False, snapshot_keys=None):
         super().__init__((HOST, PORT), handler)
         self.qin = qin
         self.qout = qout
+        self.maxsize = maxsize
+        self.overflow = overflow
+        self.cache = LastValueCache(snapshot_keys) if snapshot else None
+        self.dropped = 0
         self.qout_clients = {}
+        self.handlers = {}            # client_id -> QueueHandler
         self.lock = threading.Lock()  # For the global queue dictionary
-        threading.Thread(target=self.fill_clients).start()
+        self.fill_thread = threading.Thread(target=self.fill_clients)
+        self.fill_thread.start()
 
     @contextmanager
     def qout_copy(self, client_id):
-        q = queue.Queue()
+        q = PollableQueue(self.maxsize, self.overflow)
 
-        # Lock the qout dict while updating it
+        # Lock the qout dict while updating it. The snapshot is taken
+        # under the same lock, so that no message is missed or repeated.
         with self.lock:
+            if self.cache is not None:
+                try:
+                    q.put_many([_Encoded(msg, True, False)
+                                for msg in self.cache.snapshot()], block=False)
+                except queue.Full:
+                    pass
             self.qout_clients[client_id] = q
 
         # But not here because this yield can be really long
@@ -55,30 +118,87 @@ class QueueServer(socketserver.ThreadingTCPServer):
             # Lock the qout dict while updating it
             with self.lock:
                 del self.qout_clients[client_id]
+                self.dropped += q.dropped
+
+    def stats(self):
+        '''Bytes received and sent, pending and dropped messages, per client'''
+        clients = []
+        with self.lock:
+            for client_id, q in self.qout_clients.items():
+                handler = self.handlers.get(client_id)
+                clients.append({'address': '%s:%d' % client_id[:2],
+                                'bytes_in': handler.bytes_in if handler else 0,
+                                'bytes_out': handler.bytes_out if handler else 0,
+                                'pending': q.qsize(),
+                                'dropped': q.dropped})
+        return {'clients': clients, 'dropped': self.dropped,
+                'cached': len(self.cache) if self.cache is not None else 0}
 
     def fill_clients(self):
         '''
         Get data from the qout queue and send it to all client threads.
 
-        Stop when the command 'quit' has seen passing through the queue.
+        Stop when the shutdown flag is set, telling all client
+        threads to exit.
         '''
-        while not time_to_die():
+        while not shutdown.is_set():
+
+            r, _, _ = select.select([self.qout, shutdown], [], [])
+            if self.qout not in r:
+                continue
 
-            # Execute the while loop every now and then
             try:
-                data = self.qout.get(timeout=1)
+                data = self.qout.get_many(block=False)
             except queue.Empty:
                 continue
 
             with self.lock:
-                for q in self.qout_clients.values():
+                formats = {h.binary for h in self.handlers.values()}
+            encoded = [msg if isinstance(msg, TracedMessage) else
+                       _Encoded(msg, False in formats, True in formats)
+                       for msg in data]
+
+            # Clients connecting from now on get these messages either
+            # in their snapshot, or in their queue, but not in both.
+            with self.lock:
+                if self.cache is not None:
+                    self.cache.update(data)
+                queues = list(self.qout_clients.values())
+                # Each client gets its own copy of traced messages
+                copies = [encoded] * len(queues)
+                if tracer.enabled:
+                    copies[1:] = [tracer.fork(encoded) for q in queues[1:]]
+                for q, items in zip(queues, copies):
                     try:
-                        q.put(data, block=False)
+                        q.put_many(items, block=False)
                     except queue.Full:
                         # Slow clients will drop messages and
                         # should not block the rest.
                         pass
-        self.shufdown()
+
+        with self.lock:
+            for q in self.qout_clients.values():
+                try:
+                    q.put(None, block=False)
+                except queue.Full:
+                    pass   # Daemonic threads will be killed anyway
+
+    def server_close(self):
+        '''Close the server, after fill_clients() has seen the shutdown flag'''
+        super().server_close()
+        self.fill_thread.join()
+
+    def serve_until_shutdown(self):
+        '''
+        Handle requests until the shutdown flag is set.
+
+        Unlike serve_forever(), does not poll the shutdown
+        flag at regular intervals.
+        '''
+        while not shutdown.is_set():
+            r, _, _ = select.select([self, shutdown], [], [])
+            if self in r:
+                self.handle_request()
 
 
 class QueueHandler(socketserver.StreamRequestHandler):
@@ -99,36 +219,120 @@ class QueueHandler(socketserver.StreamRequestHandler):
         Loops forever until:
         - the client disconnects, or
         - the server is shutdown
+
+        If the client sends HELLO, the rest of its data is read as
+        binary frames, and handle_out() switches to binary frames too.
         '''
+        self.binary = False
+        self.bytes_in = 0
+        self.bytes_out = 0
+        with self.server.lock:
+            self.server.handlers[self.client_address] = self
         threading.Thread(target=self.handle_out).start()
 
+        rfile = _CountingReader(self.rfile, self)
         try:
-            for msg in iter(self.rfile.readline, b''):
+            for msg in iter(rfile.readline, b''):
+                if msg == HELLO:
+                    self.binary = True
+                    break
                 self.server.qin.put(msg.decode('utf-8'))
+
+            if self.binary:
+                for msg in iter(functools.partial(read_frame, rfile), None):
+                    self.server.qin.put(msg)
         except Exception as e:
             print('Exception in input thread:', e)
+        finally:
+            with self.server.lock:
+                del self.server.handlers[self.client_address]
 
     def handle_out(self):
-        '''Handler for data going to the client's socket'''
+        '''Handler for data going to the client's socket
+
+        Sends all the messages waiting in the output queue with
+        a single gathered write. The HELLO reply to a binary client
+        is sent together with the first messages after the switch.
+        '''
+        binary = False
+        done = False
 
         # Use the client address as an unique id
         with self.server.qout_copy(self.client_address) as qout:
 
-            for msg in iter(qout.get, None):
-                self.wfile.write(msg.encode('utf-8'))
+            while not done:
+                items = qout.get_many()
+                if None in items:
+                    items = items[:items.index(None)]
+                    done = True
+
+                buffers = []
+                if self.binary and not binary:
+                    buffers.append(HELLO)
+                    binary = True
+                for item in items:
+                    if isinstance(item, TracedMessage):
+                        if binary:
+                            buffers.extend(encode_buffers([item]))
+                        else:
+                            buffers.append(encode_text([item]))
+                    elif binary:
+                        if item.buffers is None:   # Switched after encoding
+                            item.buffers = encode_buffers([item.msg])
+                        buffers.extend(item.buffers)
+                    else:
+                        if item.text is None:
+                            item.text = encode_text([item.msg])
+                        buffers.append(item.text)
+
+                if buffers:
+                    buffers = coalesce(buffers)
+                    send_buffers(self.request, buffers)
+                    self.bytes_out += nbytes(buffers)
 
         print('Output thread exiting')
 
 
-def _start_server(host, port, qin, qout):
+class _CountingReader():
+    '''File wrapper counting the bytes read into `handler.bytes_in`'''
+
+    def __init__(self, f, handler):
+        self.f = f
+        self.handler = handler
 
-    with QueueServer(host, port, QueueHandler, qin, qout) as server:
+    def readline(self):
+        data = self.f.readline()
+        self.handler.bytes_in += len(data)
+        return data
+
+    def read(self, n):
+        data = self.f.read(n)
+        self.handler.bytes_in += len(data)
+        return data
+
+    def readinto(self, buf):
+        n = self.f.readinto(buf)
+        self.handler.bytes_in += n
+        return n
+
+
+def _start_server(host, port, maxsize, overflow, snapshot, snapshot_keys,
+                  qin, qout):
+
+    with QueueServer(host, port, QueueHandler, qin, qout,
+                     maxsize, overflow, snapshot, snapshot_keys) as server:
+        port = server.server_address[1]   # In case port 0 was requested
         print("started server on port %d" % port)
-        server.serve_forever()
+        stats.register('socket_server_threaded:%d' % port, server.stats)
+        try:
+            server.serve_until_shutdown()
+        finally:
+            stats.unregister('socket_server_threaded:%d' % port)
         print('start_server exiting')
 
 
-def get_server(host, port):
+def get_server(host, port, maxsize=0, overflow=DROP_NEWEST,
+               snapshot=False, snapshot_keys=None):
     '''Get a TCP server adapter
 
     Returns a callable that, when called, produces a TCP server
@@ -137,5 +341,10 @@ def get_server(host, port):
 
     The callable will have two arguments: `qin` and `qout`, that must be
     the same queues used in the task's instantiation.
+
+    `maxsize` and `overflow` configure the per-client output queues.
+    `snapshot` and `snapshot_keys` select the last values sent
+    to new clients (see QueueServer).
     '''
-    return functools.partial(_start_server, host, port)
+    return functools.partial(_start_server, host, port, maxsize, overflow,
+                             snapshot, snapshot_keys)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+'''
+Runtime statistics.
+
+Tasks and GUIs keep their own statistics (see QuickBase.stats()),
+and so do queues (see PollableQueue.stats()). Servers and other
+components without a reference to a task register a statistics source
+in this module, so that everything running in a process can be
+collected at once with collect().
+
+All statistics are plain dictionaries of numbers, strings and lists,
+so that they can be sent as JSON in reply to the reserved STATS command.
+'''
+
+import threading
+
+# Latency histogram buckets: bucket i counts latencies
+# below 2**i microseconds, and above the previous bucket.
+N_BUCKETS = 32
+
+_sources = {}
+_lock = threading.Lock()
+
+
+class Histogram():
+    '''
+    Latency histogram with power-of-two buckets.
+
+    Recording a value costs a few integer operations,
+    so that it can be left enabled all the time.
+    '''
+
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        i = int(seconds * 1e6).bit_length()
+        self.counts[min(i, N_BUCKETS - 1)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, p):
+        '''Upper bound in seconds of the `p` percentile (0-100)'''
+        threshold = self.count * p / 100.0
+        n = 0
+        for i, count in enumerate(self.counts):
+            n += count
+            if n >= threshold and n > 0:
+                return min((2 ** i) * 1e-6, self.max)
+        return 0.0
+
+    def to_dict(self):
+        mean = self.total / self.count if self.count else 0.0
+        return {'count': self.count,
+                'mean': mean,
+                'max': self.max,
+                'p50': self.percentile(50),
+                'p99': self.percentile(99),
+                'buckets': [[(2 ** i) * 1e-6, count]
+                            for i, count in enumerate(self.counts) if count]}
+
+
+def queue_stats(q):
+    '''Statistics of a queue, or None if it does not have any'''
+    stats = getattr(q, 'stats', None)
+    return stats() if stats is not None else None
+
+
+def register(name, source):
+    '''
+    Register a statistics source called `name`.
+
+    `source` is a callable without arguments returning a dictionary.
+    It will be called from any thread.
+    '''
+    with _lock:
+        _sources[name] = source
+
+
+def unregister(name):
+    with _lock:
+        _sources.pop(name, None)
+
+
+def collect():
+    '''Statistics from all registered sources, keyed by name'''
+    with _lock:
+        sources = list(_sources.items())
+    return {name: source() for name, source in sources}
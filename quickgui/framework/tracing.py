@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+'''
+Sampled end-to-end latency tracing.
+
+Tracing is disabled by default. When enabled with enable(), one in
+every N Messages sent with QuickBase.send() gets a trace, that is a
+list of (hop, timestamp) pairs. A timestamp is added at each hop
+along the message path:
+
+- send: QuickBase.send() and send_cached()
+- queue_put, queue_get: PollableQueue and ProcessQueue
+- socket_send, socket_recv: binary frames (see the framing module)
+- dispatch, done: before and after the handler call
+
+Traces travel across sockets only with binary frames, where they
+are sent as a TYPE_TRACED frame wrapping the message frame. Text
+connections end the trace at socket_send. Array messages are not
+traced across sockets.
+
+A trace is complete when the message has been handled, or when it
+has been sent to a text client. Complete traces are kept in memory
+(the latest MAX_TRACES), together with a latency histogram for each
+pair of consecutive hops, and can be exported with export_chrome()
+to a JSON file that can be opened with chrome://tracing or Perfetto.
+
+Timestamps come from time.monotonic(), which is shared by all processes
+on the same host. Latencies between different hosts include the
+offset between their clocks.
+'''
+
+import json
+import time
+import itertools
+import threading
+from collections import deque
+
+from quickgui.framework import stats
+from quickgui.framework.messages import Message
+
+MAX_TRACES = 10000
+
+
+class TracedMessage(Message):
+    '''A Message carrying its trace'''
+
+    def __new__(cls, cmd, value=None, trace=None):
+        msg = super().__new__(cls, cmd, value)
+        msg.trace = trace
+        return msg
+
+    def __reduce__(self):
+        return (TracedMessage, (self.cmd, self.value, self.trace))
+
+
+class Trace():
+    '''Identifier and list of (hop, timestamp) pairs of a traced message'''
+
+    def __init__(self, id, hops=None):
+        self.id = id
+        self.hops = hops if hops is not None else []
+
+    def __reduce__(self):
+        return (Trace, (self.id, self.hops))
+
+    def to_dict(self):
+        return {'id': self.id, 'hops': self.hops}
+
+
+class Tracer():
+    '''
+    Collects traces and per-hop latency histograms.
+
+    Only one Tracer is used in each process, see the functions below.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.interval = 100
+        self.traces = deque(maxlen=MAX_TRACES)   # Tuples (cmd, trace)
+        self.histograms = {}
+        self._counter = itertools.count()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def sample(self, msg):
+        '''Return a traced copy of `msg` if selected for sampling'''
+        if next(self._counter) % self.interval != 0:
+            return msg
+        trace = Trace('%x-%d' % (id(self) & 0xffffff, next(self._ids)))
+        trace.hops.append(('send', time.monotonic()))
+        return TracedMessage(msg.cmd, msg.value, trace)
+
+    def hop(self, items, name):
+        '''Add a hop to all traced messages in `items`'''
+        now = time.monotonic()
+        for item in items:
+            if isinstance(item, TracedMessage):
+                item.trace.hops.append((name, now))
+
+    def fork(self, items):
+        '''Copy traced messages, so that each copy gets its own hops'''
+        return [TracedMessage(item.cmd, item.value,
+                              Trace(item.trace.id, list(item.trace.hops)))
+                if isinstance(item, TracedMessage) else item
+                for item in items]
+
+    def finish(self, msg):
+        '''Store a complete trace and update the hop histograms'''
+        hops = list(msg.trace.hops)
+        with self._lock:
+            self.traces.append((msg.cmd, Trace(msg.trace.id, hops)))
+            for (prev, t0), (name, t1) in zip(hops, hops[1:]):
+                key = '%s>%s' % (prev, name)
+                if key not in self.histograms:
+                    self.histograms[key] = stats.Histogram()
+                self.histograms[key].record(t1 - t0)
+
+    def stats(self):
+        with self._lock:
+            return {'traces': len(self.traces),
+                    'hops': {key: h.to_dict()
+                             for key, h in self.histograms.items()}}
+
+    def chrome_events(self):
+        '''Traces in Chrome trace event format'''
+        with self._lock:
+            traces = list(self.traces)
+
+        events = []
+        for tid, (cmd, trace) in enumerate(traces):
+            for (prev, t0), (name, t1) in zip(trace.hops, trace.hops[1:]):
+                events.append({'name': '%s>%s' % (prev, name),
+                               'cat': cmd,
+                               'ph': 'X',
+                               'ts': t0 * 1e6,
+                               'dur': (t1 - t0) * 1e6,
+                               'pid': 0,
+                               'tid': tid,
+                               'args': {'trace': trace.id, 'cmd': cmd}})
+        return events
+
+    def clear(self):
+        with self._lock:
+            self.traces.clear()
+            self.histograms.clear()
+
+
+tracer = Tracer()
+
+
+def enable(sample_rate=0.01):
+    '''
+    Enable tracing for a fraction `sample_rate` of sent Messages.
+
+    Tracing statistics are registered as 'tracing' in the stats module.
+    '''
+    tracer.interval = max(int(round(1.0 / sample_rate)), 1)
+    tracer.enabled = True
+    stats.register('tracing', tracer.stats)
+
+
+def disable():
+    tracer.enabled = False
+    stats.unregister('tracing')
+
+
+def export_chrome(path):
+    '''Write all complete traces to `path` in Chrome trace JSON format'''
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': tracer.chrome_events(),
+                   'displayTimeUnit': 'ms'}, f)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from quickgui.benchmarks.loadgen import parse_mix, make_command, run_load
+
+
+class LoadgenTest(unittest.TestCase):
+
+    def test_mix(self):
+        assert parse_mix('MOVE=9, SIMUL') == [('MOVE', 9.0), ('SIMUL', 1.0)]
+        with self.assertRaises(ValueError):
+            parse_mix('MOVE=1,,SIMUL=1')
+        assert make_command('SIMUL') == 'SIMUL 1\n'
+        assert make_command('MOVE').startswith('MOVE ')
+        assert make_command('STATS') == 'STATS\n'
+
+    def test_run(self):
+        result = run_load('socket_server_threaded', 3, duration=0.5, rate=10,
+                          probe_rate=50)
+        summary = result['summary']
+        assert summary['connected'] == 3
+        assert summary['dropped'] == 0
+        assert summary['lag_p50'] is not None
+        assert summary['commands_handled'] == summary['commands_sent']
+        assert len(result['per_client']) == 3
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from quickgui.benchmarks.common import make_line, line_index, summarize
+from quickgui.benchmarks.run import compare
+
+
+def result(name, throughput, p50, delivered=1.0):
+    return {'name': name, 'throughput': throughput, 'p50': p50,
+            'p99': p50, 'delivered': delivered}
+
+
+class BenchmarksTest(unittest.TestCase):
+
+    def test_lines(self):
+        line = make_line(42, 100)
+        assert len(line) == 100
+        assert line.endswith('\n')
+        assert line_index(line) == 42
+        assert line_index('OTHER 42\n') is None
+
+    def test_summarize(self):
+        send_times = [0.0, 1.0]
+        recv_times = [(0, 0.5), (1, 2.0), (1, 1.5)]
+        r = summarize('test', {}, send_times, recv_times, expected=4)
+        assert r['messages'] == 3
+        assert r['delivered'] == 0.75
+        assert r['throughput'] == 1.5
+        assert r['p50'] == 0.5
+
+    def test_compare(self):
+        baseline = [result('a', 1000, 0.010), result('b', 1000, 0.010)]
+        results = [result('a', 900, 0.011),
+                   result('b', 500, 0.020, delivered=0.5),
+                   result('new', 1, 1.0)]
+        regressions = compare(results, baseline, tolerance=0.2)
+        assert [name for name, _ in regressions] == ['b', 'b', 'b']
+
+
+if __name__ == '__main__':
+    unittest.main()
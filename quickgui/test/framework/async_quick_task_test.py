@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import time
+import asyncio
+import unittest
+import threading
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.messages import command
+from quickgui.framework.quick_base import set_time_to_die, handler, handler_str
+from quickgui.framework.quick_task import periodic
+from quickgui.framework.async_quick_task import AsyncQuickTask
+
+
+class Devices(AsyncQuickTask):
+
+    def __init__(self, qin, qout):
+        super().__init__(qin, qout)
+        self.moves = []
+        self.ticks = 0
+
+    @handler_str('MOVE', key=lambda arg: arg.split()[0])
+    async def move(self, arg):
+        device, delay = arg.split()
+        await asyncio.sleep(float(delay))
+        self.moves.append((device, float(delay)))
+        self.send('MOVED', device)
+
+    @handler('PING')
+    def ping(self):
+        self.send('PONG')
+
+    @periodic(0.02)
+    async def poll(self):
+        await asyncio.sleep(0)
+        self.ticks += 1
+
+
+class AsyncQuickTaskTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_time_to_die(False)
+
+    def test_handlers(self):
+        qin = NewLineQueue()
+        qout = NewLineQueue()
+        task = Devices(qin, qout)
+        t = threading.Thread(target=task.run)
+        t.start()
+
+        # 20 devices in parallel, two moves each, in order per device
+        for i in range(20):
+            qin.put('MOVE dev%d 0.2\n' % i)
+            qin.put('MOVE dev%d 0.01\n' % i)
+        qin.put('PING\n')
+
+        start = time.monotonic()
+        replies = []
+        while len(replies) < 41 and time.monotonic() - start < 5:
+            replies += [command(m) for m in qout.get_many(timeout=1)
+                        if command(m) in ('moved', 'pong')]
+        elapsed = time.monotonic() - start
+        set_time_to_die(True)
+        t.join()
+
+        assert replies[0] == 'pong'
+        assert len(replies) == 41
+        assert elapsed < 1
+        for i in range(20):
+            mine = [delay for device, delay in task.moves
+                    if device == 'dev%d' % i]
+            assert mine == [0.2, 0.01]
+        assert task.ticks >= 10
+        stats = task.stats()
+        assert stats['dispatch']['move']['count'] == 40
+        assert stats['coroutines']['in_flight'] == 0
+
+    def test_shutdown_cancels(self):
+        qin = NewLineQueue()
+        task = Devices(qin, NewLineQueue())
+        t = threading.Thread(target=task.run)
+        t.start()
+        qin.put('MOVE dev 60\n')
+        time.sleep(0.1)
+        set_time_to_die(True)
+        t.join(5)
+        assert not t.is_alive()
+        assert task.moves == []
+
+
+if __name__ == '__main__':
+    unittest.main()
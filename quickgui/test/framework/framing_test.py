@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import io
+import socket
+import struct
+import unittest
+import threading
+from quickgui.framework.messages import Message, np
+from quickgui.framework.framing import HELLO, StreamDecoder, FramingError
+from quickgui.framework.framing import encode_frames, read_frame
+from quickgui.framework.framing import encode_buffers, send_buffers, coalesce
+
+
+class FramingTest(unittest.TestCase):
+
+    items = [Message('POS', 0.1 + 0.2),
+             Message('MOVING', 1),
+             Message('SIMULATED', True),
+             Message('NAME', 'a b\nc'),
+             Message('STOP'),
+             'MOVE 3\n']
+
+    def test_round_trip(self):
+
+        data = encode_frames(self.items)
+        f = io.BytesIO(data)
+        decoded = list(iter(lambda: read_frame(f), None))
+
+        assert decoded == self.items
+        assert decoded[0].value == 0.1 + 0.2
+
+    def test_negotiation(self):
+
+        data = 'POS 1\n'.encode('utf-8') + HELLO + encode_frames(self.items)
+
+        # Byte by byte, to exercise partial frames and HELLOs
+        decoder = StreamDecoder()
+        decoded = []
+        for i in range(len(data)):
+            decoded += decoder.feed(data[i:i + 1])
+
+        assert decoder.binary
+        assert decoded == ['POS 1\n'] + self.items
+
+    def test_complete_lines(self):
+
+        # Partial lines from two connections must not be mixed
+        decoder1 = StreamDecoder()
+        decoder2 = StreamDecoder()
+        assert decoder1.feed(b'MOVE 1\nMO') == ['MOVE 1\n']
+        assert decoder2.feed(b'ST') == []
+        assert decoder1.feed(b'VE 2\n') == ['MOVE 2\n']
+        assert decoder2.feed('OP \u00e8\n'.encode('utf-8')[:-2]) == []
+        assert decoder2.feed('OP \u00e8\n'.encode('utf-8')[-2:]) == ['STOP \u00e8\n']
+
+    def test_coalesce(self):
+
+        big = bytearray(10)
+        assert coalesce([b'a', b'b', big, b'c'], small=5) == [b'ab', big, b'c']
+        assert coalesce([big], small=5) == [big]
+        assert coalesce([]) == []
+
+    def test_unexpected_nul(self):
+
+        decoder = StreamDecoder()
+        with self.assertRaises(FramingError):
+            decoder.feed(b'POS\x001\n')
+
+    @unittest.skipIf(np is None, 'NumPy not available')
+    def test_arrays(self):
+
+        arr = np.arange(100000, dtype=np.float32).reshape(100, 1000)
+        items = [Message('POS', 1.0), Message('FRAME', arr[:, ::2]), 'MOVE 3\n']
+
+        a, b = socket.socketpair()
+        with a, b:
+            a.sendall(HELLO)
+            sender = threading.Thread(target=send_buffers,
+                                      args=(a, encode_buffers(items)))
+            sender.start()
+
+            decoder = StreamDecoder()
+            decoded = []
+            while len(decoded) < len(items):
+                decoded += decoder.recv(b, 1000)
+            sender.join()
+
+        assert decoded[0] == items[0]
+        assert decoded[2] == items[2]
+        np.testing.assert_array_equal(decoded[1].value, arr[:, ::2])
+
+        f = io.BytesIO(b''.join(encode_buffers(items)))
+        assert read_frame(f) == items[0]
+        np.testing.assert_array_equal(read_frame(f).value, arr[:, ::2])
+
+    @unittest.skipIf(np is None, 'NumPy not available')
+    def test_wrong_array_size(self):
+
+        header, data = encode_buffers([Message('IMG', np.zeros((1, 2)))])
+        header = header[:-16] + struct.pack('!QQ', 2 ** 20, 2 ** 20)
+        frame = header + bytes(data)
+
+        with self.assertRaises(FramingError):
+            StreamDecoder().feed(HELLO + frame)
+        with self.assertRaises(FramingError):
+            StreamDecoder().feed(HELLO + header)   # Incomplete frame
+        with self.assertRaises(FramingError):
+            read_frame(io.BytesIO(frame))
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+'''
+Helpers shared by the framework tests.
+'''
+
+import time
+from quickgui.framework import stats
+
+
+def wait_for(condition, timeout=5):
+    '''Wait until condition() is true, returning its last value'''
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def get_all(q, n, timeout=5):
+    '''Get at least `n` items from queue `q`, or whatever arrived in time'''
+    items = []
+    deadline = time.monotonic() + timeout
+    while len(items) < n and time.monotonic() < deadline:
+        try:
+            items += q.get_many(timeout=0.1)
+        except Exception:
+            pass
+    return items
+
+
+def server_port(prefix, timeout=5):
+    '''
+    Port of a server started on port 0.
+
+    Servers register their statistics as '<prefix>:<port>' using
+    the port they are actually bound to, so wait for that entry
+    to appear and read the port back from its name.
+    '''
+    def find():
+        for name in stats.collect():
+            if name.startswith(prefix + ':'):
+                return int(name[len(prefix) + 1:])
+    port = wait_for(find, timeout)
+    assert port is not None, 'server %s did not start' % prefix
+    return port
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import json
+import queue
+import unittest
+import threading
+from quickgui.framework import stats
+from quickgui.framework.launcher_exchange import Exchange, subscriptions, MAX_ROUTES
+from quickgui.framework.launcher_exchange import start
+from quickgui.framework.queues import BLOCK, RAISE
+from quickgui.framework.quick_base import QuickBase, handler, set_time_to_die
+from quickgui.framework.quick_base import handled_commands
+from quickgui.framework.quick_task import QuickTask
+from quickgui.test.framework.helpers import wait_for, get_all
+
+
+class PosGui(QuickBase):
+
+    @handler('POS')
+    def pos(self, value):
+        pass
+
+
+class ExchangeTest(unittest.TestCase):
+
+    def test_subscriptions(self):
+
+        def task(qin, qout):
+            pass
+
+        assert sorted(subscriptions(PosGui)) == ['pos', 'stats']
+        assert subscriptions(task) is None
+        task.subscriptions = ['MOVE']
+        assert subscriptions(task) == ['MOVE']
+
+    def test_routing(self):
+
+        exchange = Exchange()
+        task_in, task_out = exchange.get('task', ['MOVE', 'STOP'])
+        gui_in, gui_out = exchange.get('gui', ['POS', 'MOV*'])
+        server_in, server_out = exchange.get('task_server')
+
+        assert exchange.route('gui', 'move') == [task_in, server_in]
+        assert exchange.route('task', 'pos') == [gui_in, server_in]
+        assert exchange.route('task', 'moving') == [gui_in, server_in]
+        assert exchange.route('task', 'simulated') == [server_in]
+        assert exchange.route('task_server', 'move') == [task_in, gui_in]
+
+    def test_route_cache_bounded(self):
+
+        exchange = Exchange()
+        task_in, task_out = exchange.get('task', ['MOVE'])
+        for i in range(MAX_ROUTES + 10):
+            assert exchange.route('task_server', 'cmd%d' % i) == []
+        assert exchange.route('task_server', 'move') == [task_in]
+        assert len(exchange._routes) == MAX_ROUTES
+
+    def _run(self, exchange):
+        thread = threading.Thread(target=exchange.run)
+        thread.start()
+        # Cleanups run in reverse order
+        self.addCleanup(set_time_to_die, False)
+        self.addCleanup(thread.join)
+        self.addCleanup(set_time_to_die, True)
+        assert wait_for(lambda: 'exchange' in stats.collect())
+
+    def test_overflow_raise(self):
+
+        exchange = Exchange(maxsize=2, overflow=RAISE)
+        task_in, task_out = exchange.get('task')
+        gui_in, gui_out = exchange.get('gui')
+        self._run(exchange)
+
+        gui_out.put_many(['POS %d\n' % i for i in range(2)])
+        assert wait_for(lambda: task_in.qsize() == 2)
+        gui_out.put_many(['POS %d\n' % i for i in range(2, 4)])
+        assert wait_for(lambda: stats.collect()['exchange']['dropped']
+                        == {'task': 2})
+        assert task_in.get_many() == ['POS 0\n', 'POS 1\n']
+
+    def test_overflow_block(self):
+
+        exchange = Exchange(maxsize=2, overflow=BLOCK)
+        task_in, task_out = exchange.get('task')
+        gui_in, gui_out = exchange.get('gui')
+        self._run(exchange)
+
+        # More lines than fit in both queues: the exchange waits for
+        # the task instead of discarding them
+        lines = ['POS %d\n' % i for i in range(10)]
+        sender = threading.Thread(target=lambda: [gui_out.put(line)
+                                                  for line in lines])
+        sender.start()
+        assert wait_for(lambda: task_in.qsize() == 2)
+        assert get_all(task_in, len(lines)) == lines
+        sender.join()
+        assert stats.collect()['exchange']['dropped'] == {}
+
+    def test_stats_single_reply(self):
+
+        done = threading.Event()
+        replies = []
+
+        def task(qin, qout):
+            QuickTask(qin, qout).run()
+
+        def gui(qin, qout):
+            receiver = PosGui(qin, qout)
+            while not done.is_set():
+                try:
+                    for msg in qin.get_many(timeout=0.1):
+                        receiver.dispatch(msg)
+                except queue.Empty:
+                    pass
+
+        gui.subscriptions = handled_commands(PosGui)
+
+        def server(qin, qout):
+            qin.put('STATS\n')
+            replies.extend(get_all(qout, 2, timeout=0.5))
+            done.set()
+
+        self.addCleanup(set_time_to_die, False)
+        start(task=task, gui=gui, task_servers=server)
+
+        assert len(replies) == 1
+        assert json.loads(replies[0].value)['name'] == 'QuickTask'
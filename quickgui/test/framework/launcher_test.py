@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+
+import time
+import socket
+import unittest
+import multiprocessing
+from quickgui.benchmarks.common import free_port
+from quickgui.framework.launcher import start, PROCESS
+from quickgui.framework.queues import PollableQueue
+from quickgui.framework.quick_base import set_time_to_die, handler_str
+from quickgui.framework.quick_task import QuickTask
+from quickgui.framework.socket_server import get_server
+
+
+class EchoTask(QuickTask):
+
+    @handler_str('PING')
+    def ping(self, arg):
+        self.send('PONG ' + arg)
+
+
+def echo_task(qin, qout):
+    EchoTask(qin, qout).run()
+
+
+def _connect(port, timeout=5):
+    '''Connect to a server that may still be starting'''
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection(('localhost', port))
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+class LauncherTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_time_to_die(False)
+
+    def test_process_mode(self):
+
+        port = free_port()
+        replies = []
+
+        def gui(qin, qout):
+            qout.put('PING 1\n')
+            replies.append(qin.get(timeout=5))
+
+            # PONG 1 may also reach this client, if the server accepts it
+            # before forwarding that reply
+            with _connect(port) as sock, sock.makefile('rb') as f:
+                sock.settimeout(5)
+                sock.sendall(b'PING 2\n')
+                for line in f:
+                    if line == b'PONG 2\n':
+                        replies.append(line.decode())
+                        break
+
+        start(task=echo_task, gui=gui,
+              task_servers=get_server('localhost', port), mode=PROCESS)
+
+        assert replies == ['PONG 1\n', 'PONG 2\n']
+        assert multiprocessing.active_children() == []
+
+    def test_process_mode_queue_class(self):
+
+        with self.assertRaisesRegex(Exception, 'queue_class'):
+            start(task=echo_task, queue_class=PollableQueue, mode=PROCESS)
+        assert multiprocessing.active_children() == []
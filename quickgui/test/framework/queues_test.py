@@ -1,8 +1,12 @@
 # -*- coding: utf-8 -*-
 
 import queue
+import select
 import unittest
-from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.messages import Message
+from quickgui.framework.queues import NewLineQueue, PollableQueue, ConflatingQueue
+from quickgui.framework.queues import ProcessQueue
+from quickgui.framework.queues import BLOCK, DROP_NEWEST, DROP_OLDEST, RAISE
 
 class UnitCheckTest(unittest.TestCase):
 
@@ -51,3 +55,137 @@ class UnitCheckTest(unittest.TestCase):
         a.put('\npaperino\n')
         assert a.get(block=False) == 'pluto\n'
         assert a.get(block=False) == 'paperino\n'
+
+    def test_put_many(self):
+
+        a = NewLineQueue()
+        a.put_many(['pippo\n', 'plu', 'to\npaperino'])
+
+        assert a.get_many(block=False) == ['pippo\n', 'pluto\n']
+
+        with self.assertRaises(queue.Empty):
+            _ = a.get_many(block=False)
+
+        a.put('\n')
+        assert a.get(block=False) == 'paperino\n'
+
+    def test_get_many_max_items(self):
+
+        a = PollableQueue()
+        a.put_many(range(5))
+
+        assert a.get_many(max_items=2, block=False) == [0, 1]
+        assert a.get(block=False) == 2
+        assert a.get_many(block=False) == [3, 4]
+
+        r, _, _ = select.select([a], [], [], 0)
+        assert r == []
+
+    def test_coalesced_wakeup(self):
+
+        a = PollableQueue()
+        r, _, _ = select.select([a], [], [], 0)
+        assert r == []
+
+        # Many more items than a socket buffer can hold
+        for i in range(100000):
+            a.put(i)
+
+        r, _, _ = select.select([a], [], [], 0)
+        assert r == [a]
+
+        assert len(a.get_many(block=False)) == 100000
+
+        r, _, _ = select.select([a], [], [], 0)
+        assert r == []
+
+    def test_overflow_policies(self):
+
+        a = PollableQueue(maxsize=2, overflow=DROP_NEWEST)
+        a.put_many([1, 2, 3])
+        assert a.get_many(block=False) == [1, 2]
+        assert a.dropped == 1
+
+        a = PollableQueue(maxsize=2, overflow=DROP_OLDEST)
+        a.put_many([1, 2, 3])
+        assert a.get_many(block=False) == [2, 3]
+        assert a.dropped == 1
+
+        a = PollableQueue(maxsize=2, overflow=RAISE)
+        a.put_many([1, 2])
+        with self.assertRaises(queue.Full):
+            a.put(3)
+
+        a = PollableQueue(maxsize=2, overflow=BLOCK)
+        a.put_many([1, 2])
+        with self.assertRaises(queue.Full):
+            a.put(3, timeout=0.01)
+        assert a.dropped == 0
+
+        with self.assertRaises(ValueError):
+            _ = PollableQueue(overflow='pippo')
+
+    def test_conflating(self):
+
+        a = ConflatingQueue(keys=['POS', 'MOVING'])
+        a.put('POS 1\nMOVE 3\nMOVING 1\n')
+        a.put('pos 2\nMOVE 4\n')
+
+        assert a.get_many(block=False) == \
+            ['pos 2\n', 'MOVE 3\n', 'MOVING 1\n', 'MOVE 4\n']
+        assert a.conflated == 1
+
+        r, _, _ = select.select([a], [], [], 0)
+        assert r == []
+
+    def test_conflating_full(self):
+
+        a = ConflatingQueue(maxsize=1, overflow=RAISE, keys=['POS'])
+        a.put('POS 1\n')
+        a.put('POS 2\n')   # Does not raise
+        with self.assertRaises(queue.Full):
+            a.put('MOVING 1\n')
+
+        assert a.get(block=False) == 'POS 2\n'
+
+    def test_conflating_join(self):
+
+        a = ConflatingQueue(keys=['POS'])
+        a.put('POS 1\nPOS 2\nMOVE 3\n')
+        assert a.unfinished_tasks == 2
+
+        for item in a.get_many(block=False):
+            a.task_done()
+        a.join()    # Does not block
+
+    def test_conflating_default(self):
+
+        a = ConflatingQueue()
+        a.put('MOVE 1\nMOVE 2\n')
+
+        assert a.get_many(block=False) == ['MOVE 1\n', 'MOVE 2\n']
+        assert a.conflated == 0
+
+    def test_messages(self):
+
+        a = NewLineQueue()
+        msg = Message('POS', 1.0)
+        a.put_many(['pippo\nplu', msg, 'to\n'])
+
+        assert a.get_many(block=False) == ['pippo\n', msg, 'pluto\n']
+
+    def test_process_queue(self):
+
+        a = ProcessQueue()
+        msg = Message('POS', 1.0)
+        a.put_many(['pippo\nplu', msg, 'to\n'])
+
+        r, _, _ = select.select([a], [], [], 1)
+        assert r == [a]
+        items = a.get_many(timeout=1)
+        while len(items) < 3:
+            items += a.get_many(timeout=1)
+        assert items == ['pippo\n', msg, 'pluto\n']
+
+        with self.assertRaises(ValueError):
+            ProcessQueue(overflow=DROP_OLDEST)
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import queue
+import select
+import unittest
+import multiprocessing
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.messages import Message, to_text, np
+from quickgui.framework.quick_base import QuickBase, Shutdown, DispatchError
+from quickgui.framework.quick_base import shutdown, set_time_to_die
+from quickgui.framework.quick_base import handler, handler_float
+
+
+class QuickBaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.qout = NewLineQueue()
+        self.base = QuickBase(NewLineQueue(), self.qout)
+
+    def test_send_cached(self):
+
+        self.base.send_cached('POS 1')
+        self.base.send_cached('POS 1')
+        self.base.send_cached('MOVING 0')
+        self.base.send_cached('POS 2')
+
+        assert self.qout.get_many(block=False) == \
+            ['POS 1\n', 'MOVING 0\n', 'POS 2\n']
+
+        self.base.clear_send_cache()
+        self.base.send_cached('POS 2')
+        assert self.qout.get(block=False) == 'POS 2\n'
+
+    def test_keepalive(self):
+
+        self.base.send_cached('POS 1', keepalive=0.01)
+        self.base.send_cached('POS 1', keepalive=0.01)
+        assert self.qout.get_many(block=False) == ['POS 1\n']
+
+        time.sleep(0.02)
+        self.base.send_cached('POS 1', keepalive=0.01)
+        assert self.qout.get(block=False) == 'POS 1\n'
+
+        with self.assertRaises(queue.Empty):
+            _ = self.qout.get(block=False)
+
+    def test_send_cached_value(self):
+
+        self.base.send_cached('POS', 0.01, value=1.0)
+        self.base.send_cached('POS', value=1.0)
+        assert self.qout.get_many(block=False) == [Message('POS', 1.0)]
+
+        time.sleep(0.02)
+        self.base.send_cached('POS', 0.01, value=1.0)
+        assert self.qout.get(block=False) == Message('POS', 1.0)
+
+    @unittest.skipIf(np is None, 'NumPy not available')
+    def test_send_cached_array(self):
+
+        a = np.zeros(3)
+        self.base.send_cached('IMG', value=a)
+        self.base.send_cached('IMG', value=a)
+        a[:] = 5
+        self.base.send_cached('IMG', value=a)
+        self.base.send_cached('IMG', value=a.astype(int))
+
+        items = self.qout.get_many(block=False)
+        assert len(items) == 3
+        assert items[2].value.dtype.kind == 'i'
+
+    def test_shutdown_is_pollable(self):
+
+        flag = Shutdown()
+        r, _, _ = select.select([flag], [], [], 0)
+        assert r == []
+
+        flag.set()
+        r, _, _ = select.select([flag], [], [], 0)
+        assert r == [flag]
+        assert flag.is_set()
+
+        flag.clear()
+        r, _, _ = select.select([flag], [], [], 0)
+        assert r == []
+
+    @unittest.skipUnless(hasattr(os, 'register_at_fork'), 'needs fork')
+    def test_shutdown_after_fork(self):
+
+        p = multiprocessing.get_context('fork').Process(target=set_time_to_die,
+                                                        args=(True,))
+        p.start()
+        p.join()
+        r, _, _ = select.select([shutdown], [], [], 0)
+        assert r == []
+        assert not shutdown.is_set()
+
+    def test_message_fast_path(self):
+
+        class Receiver(QuickBase):
+            @handler_float('POS')
+            def pos(self, value):
+                self.pos_value = value
+
+            @handler('STATUS')
+            def status(self, value):
+                self.status_value = value
+
+        receiver = Receiver(self.qout, NewLineQueue())
+
+        self.base.send('POS', 0.1 + 0.2)
+        self.base.send('STATUS', 1)
+        for msg in self.qout.get_many(block=False):
+            receiver.dispatch(msg)
+
+        assert receiver.pos_value == 0.1 + 0.2
+        assert receiver.status_value == '1'
+
+        assert to_text(Message('POS', 0.1 + 0.2)) == 'POS 0.30000000000000004\n'
+        assert to_text(Message('STOP')) == 'STOP\n'
+
+    def test_stats(self):
+
+        class Receiver(QuickBase):
+            @handler_float('POS')
+            def pos(self, value):
+                pass
+
+        qin = NewLineQueue()
+        receiver = Receiver(qin, self.qout)
+
+        for msg in ['POS 1', 'POS x', 'MOVE 2']:
+            try:
+                receiver.dispatch(msg)
+            except DispatchError:
+                pass
+        receiver.send('POS', 1.0)
+
+        stats = receiver.stats()
+        assert stats['dispatch']['pos']['count'] == 2
+        assert stats['dispatch']['pos']['errors'] == 1
+        assert stats['dispatch']['pos']['latency']['count'] == 1
+        assert stats['dispatch_errors'] == 1
+        assert stats['sent'] == {'pos': 1}
+        assert stats['qout']['high_water'] == 1
+
+        # Requests are answered, replies are ignored
+        receiver.dispatch('STATS')
+        _, reply = self.qout.get_many(block=False)
+        assert reply.cmd == 'STATS'
+        assert json.loads(reply.value)['name'] == 'Receiver'
+        receiver.dispatch(reply.to_text())
+        assert self.qout.empty()
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+
+from PyQt5.QtCore import QCoreApplication
+
+from quickgui.framework.messages import Message
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.quick_base import handler, set_time_to_die
+from quickgui.framework.quick_qt_gui import QuickQtGui
+
+
+class PosGui(QuickQtGui):
+
+    def __init__(self, qin, qout):
+        super().__init__(qin, qout, max_rate=10)
+        self.positions = []
+
+    @handler('POS')
+    def pos(self, value):
+        self.positions.append(value)
+
+
+class QuickQtGuiTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = QCoreApplication.instance() or QCoreApplication([])
+
+    def tearDown(self):
+        set_time_to_die(True)
+        self.gui._qlistener.wait()
+        set_time_to_die(False)
+
+    def test_collapsed_batches(self):
+
+        qin = NewLineQueue()
+        self.gui = PosGui(qin, NewLineQueue())
+
+        t0 = time.monotonic()
+        for i in range(1000):
+            qin.put(Message('POS', i))
+            if i % 100 == 0:
+                self.app.processEvents()
+
+        while time.monotonic() - t0 < 1 and '999' not in self.gui.positions:
+            self.app.processEvents()
+            time.sleep(0.01)
+
+        # At most 10 batches per second, each with the latest position
+        assert self.gui.positions[-1] == '999'
+        stats = self.gui.batch_stats()
+        assert stats['batches'] == len(self.gui.positions) <= 11
+        assert stats['collapsed'] == 1000 - len(self.gui.positions)
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import time
+import unittest
+import threading
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.quick_base import set_time_to_die, DispatchError
+from quickgui.framework.quick_base import handler, handler_str
+from quickgui.framework.quick_task import QuickTask, periodic, CATCH_UP
+from quickgui.test.framework.helpers import wait_for
+
+
+class MultiRateTask(QuickTask):
+
+    def __init__(self, qin, qout):
+        super().__init__(qin, qout)
+        self.period = 0.05
+        self.fast = 0
+        self.slow = 0
+
+    @periodic(0.01)
+    def tick_fast(self):
+        self.fast += 1
+
+    @periodic
+    def tick_slow(self):
+        self.slow += 1
+
+
+class HardwareTask(QuickTask):
+
+    def __init__(self, qin, qout):
+        super().__init__(qin, qout)
+        self.release = threading.Event()
+        self.moves = []
+        self.status = 0
+
+    @handler_str('MOVE', concurrent=True, key=lambda arg: arg.split()[0])
+    def move(self, arg):
+        axis, pos = arg.split()
+        if axis == 'slow':
+            self.release.wait(5)
+        self.moves.append((axis, int(pos)))
+
+    @handler('STATUS')
+    def get_status(self):
+        self.status += 1
+
+
+class QuickTaskTest(unittest.TestCase):
+
+    def tearDown(self):
+        set_time_to_die(False)
+
+    def test_multi_rate(self):
+
+        task = MultiRateTask(NewLineQueue(), NewLineQueue())
+        t = threading.Thread(target=task.run)
+        t.start()
+        time.sleep(0.3)
+        set_time_to_die(True)
+        t.join()
+
+        assert 20 <= task.fast <= 31
+        assert 4 <= task.slow <= 6
+
+        stats = task.periodic_stats()
+        assert stats['tick_fast']['ticks'] == task.fast
+        assert stats['tick_slow']['period'] == 0.05
+
+    def test_catch_up(self):
+
+        class SlowTask(QuickTask):
+            calls = 0
+
+            @periodic(0.01, policy=CATCH_UP)
+            def tick(self):
+                self.calls += 1
+                if self.calls == 1:
+                    time.sleep(0.1)
+
+        task = SlowTask(NewLineQueue(), NewLineQueue())
+        t = threading.Thread(target=task.run)
+        t.start()
+        time.sleep(0.2)
+        set_time_to_die(True)
+        t.join()
+
+        assert task.calls >= 18
+        assert task.periodic_stats()['tick']['missed'] == 0
+
+    def test_concurrent(self):
+
+        task = HardwareTask(NewLineQueue(), NewLineQueue())
+        task.dispatch('MOVE slow 1')
+        task.dispatch('MOVE slow 2')
+
+        # Other keys and other handlers do not wait for the slow axis
+        task.dispatch('MOVE fast 1')
+        task.dispatch('MOVE fast 2')
+        task.dispatch('STATUS')
+        assert task.status == 1
+
+        assert wait_for(lambda: len(task.moves) == 2)
+        assert task.moves == [('fast', 1), ('fast', 2)]
+
+        task.release.set()
+        assert wait_for(lambda: task.stats()['concurrent']['in_flight'] == 0)
+        assert task.moves[2:] == [('slow', 1), ('slow', 2)]
+        assert task.stats()['dispatch']['move']['count'] == 4
+
+    def test_concurrent_limit(self):
+
+        task = HardwareTask(NewLineQueue(), NewLineQueue())
+        task.max_in_flight = 2
+        task.dispatch('MOVE slow 1')
+        task.dispatch('MOVE slow 2')
+        with self.assertRaises(DispatchError):
+            task.dispatch('MOVE fast 1')
+
+        task.release.set()
+        assert wait_for(lambda: task.stats()['concurrent']['in_flight'] == 0)
+        assert task.moves == [('slow', 1), ('slow', 2)]
+        stats = task.stats()
+        assert stats['concurrent']['rejected'] == 1
+        assert stats['dispatch']['move']['count'] == 3
+        assert stats['dispatch']['move']['errors'] == 1
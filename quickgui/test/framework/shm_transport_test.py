@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import select
+import threading
+import unittest
+from unittest import mock
+from quickgui.framework import stats
+from quickgui.framework.framing import FramingError
+from quickgui.framework.messages import Message
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.quick_base import set_time_to_die
+from quickgui.framework.shm_transport import RingBuffer, _bridge
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        name = 'quickgui_test_%d' % os.getpid()
+        self.producer = RingBuffer(name, size=100, create=True)
+        self.consumer = RingBuffer(name)
+
+    def tearDown(self):
+        self.consumer.close()
+        self.producer.close()
+
+    def test_put_get(self):
+
+        r, _, _ = select.select([self.consumer], [], [], 0)
+        assert r == []
+
+        items = [Message('POS', 1.5), 'MOVE 3\n']
+        assert self.producer.put_many(items) == 2
+
+        r, _, _ = select.select([self.consumer], [], [], 0)
+        assert r == [self.consumer]
+        assert self.consumer.get_many() == items
+
+        r, _, _ = select.select([self.consumer], [], [], 0)
+        assert r == []
+
+    def test_full_and_wraparound(self):
+
+        items = [Message('POS', float(i)) for i in range(30)]
+        received = []
+        while items:
+            n = self.producer.put_many(items)
+            assert 0 < n < 30
+            del items[:n]
+            received += self.consumer.get_many()
+
+        assert received == [Message('POS', float(i)) for i in range(30)]
+
+    def test_space_wakeup(self):
+
+        space = self.producer.space_fileno()
+        items = [Message('POS', float(i)) for i in range(30)]
+        n = self.producer.put_many(items)
+        assert n < 30
+        assert self.producer.put_many(items[n:]) == 0
+
+        r, _, _ = select.select([space], [], [], 0)
+        assert r == []
+        self.consumer.get_many()
+        r, _, _ = select.select([space], [], [], 0)
+        assert r == [space]
+
+        assert self.producer.put_many(items[n:]) > 0
+        r, _, _ = select.select([space], [], [], 0)
+        assert r == []
+
+    def test_private_fifo(self):
+
+        directory = self.producer._dir
+        assert self.consumer._dir == directory
+        assert os.stat(directory).st_mode & 0o777 == 0o700
+        for fifo in ('wakeup', 'space'):
+            path = os.path.join(directory, fifo)
+            assert os.stat(path).st_mode & 0o777 == 0o600
+
+        ring = RingBuffer('quickgui_private_%d' % os.getpid(), size=100,
+                          create=True)
+        assert ring._dir != directory
+        ring.close()
+        assert not os.path.exists(ring._dir)
+
+    def test_weak_ordering(self):
+
+        with mock.patch('platform.machine', return_value='aarch64'):
+            with self.assertRaises(RuntimeError):
+                RingBuffer(self.producer.name)
+
+    def test_too_large(self):
+
+        with self.assertRaises(FramingError):
+            self.producer.put_many(['x' * 200 + '\n'])
+        assert self.consumer.get_many() == []
+
+
+class BridgeTest(unittest.TestCase):
+
+    def setUp(self):
+        name = 'quickgui_bridge_%d' % os.getpid()
+        self.ring_out = RingBuffer(name, size=100, create=True)
+        self.consumer = RingBuffer(name)
+        self.ring_in = RingBuffer(name + '_in', size=100, create=True)
+        self.qout = NewLineQueue()
+        self.thread = threading.Thread(target=_bridge,
+                                       args=(NewLineQueue(), self.qout,
+                                             self.ring_in, self.ring_out,
+                                             'shm_test'))
+        self.thread.start()
+
+    def tearDown(self):
+        set_time_to_die(True)
+        self.thread.join()
+        set_time_to_die(False)
+        self.consumer.close()
+        self.ring_out.close()
+        self.ring_in.close()
+
+    def test_drop_too_large(self):
+
+        self.qout.put('x' * 200 + '\n')
+        self.qout.put('POS 1\n')
+
+        select.select([self.consumer], [], [], 5)
+        assert self.consumer.get_many() == ['POS 1\n']
+        assert stats.collect()['shm_test']['dropped'] == 1
+        assert self.thread.is_alive()
+
+    def test_full_ring(self):
+
+        lines = ['POS %d\n' % i for i in range(50)]
+        self.qout.put_many(lines)
+
+        received = []
+        deadline = time.monotonic() + 5
+        while len(received) < len(lines) and time.monotonic() < deadline:
+            select.select([self.consumer], [], [], 0.1)
+            received += self.consumer.get_many()
+        assert received == lines
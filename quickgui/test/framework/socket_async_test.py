@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+from quickgui.framework.messages import Message
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.quick_base import set_time_to_die
+from quickgui.framework.socket_server_async import get_server
+from quickgui.framework.socket_client_async import get_client
+from quickgui.test.framework.helpers import get_all, server_port
+
+
+class AsyncSocketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.task_qin = NewLineQueue()
+        self.task_qout = NewLineQueue()
+        self.threads = []
+        self._start(get_server('127.0.0.1', 0), self.task_qin, self.task_qout)
+        self.port = server_port('socket_server_async')
+
+    def tearDown(self):
+        set_time_to_die(True)
+        for t in self.threads:
+            t.join()
+        set_time_to_die(False)
+
+    def _start(self, target, qin, qout):
+        t = threading.Thread(target=target, args=(qin, qout))
+        t.start()
+        self.threads.append(t)
+
+    def _check_client(self, binary):
+        qin = NewLineQueue()
+        qout = NewLineQueue()
+        self._start(get_client('127.0.0.1', self.port, binary), qin, qout)
+
+        qout.put(Message('MOVE', 1.5))
+        qout.put('STOP\n')
+        expected = [Message('MOVE', 1.5) if binary else 'MOVE 1.5\n', 'STOP\n']
+        assert get_all(self.task_qin, 2) == expected
+
+        self.task_qout.put(Message('POS', 2))
+        expected = [Message('POS', 2) if binary else 'POS 2\n']
+        assert get_all(qin, 1) == expected
+
+    def test_text(self):
+        self._check_client(binary=False)
+
+    def test_binary(self):
+        self._check_client(binary=True)
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import threading
+import unittest
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.quick_base import set_time_to_die
+from quickgui.framework.socket_client_threaded import get_client
+from quickgui.test.framework.helpers import get_all
+
+
+class SocketClientThreadedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.create_server(('localhost', 0))
+        self.qin = NewLineQueue()
+        self.qout = NewLineQueue()
+        port = self.listener.getsockname()[1]
+        self.thread = threading.Thread(target=get_client('localhost', port),
+                                       args=(self.qin, self.qout))
+        self.thread.start()
+        self.conn, _ = self.listener.accept()
+
+    def tearDown(self):
+        set_time_to_die(True)
+        self.thread.join()
+        set_time_to_die(False)
+        self.conn.close()
+        self.listener.close()
+
+    def test_burst(self):
+        '''Lines arriving together are all delivered, without more data'''
+
+        lines = ['POS %d\n' % i for i in range(100)]
+        self.conn.sendall(''.join(lines).encode())
+        assert get_all(self.qin, len(lines)) == lines
+
+    def test_partial_line(self):
+
+        self.conn.sendall(b'POS 1\nPO')
+        assert get_all(self.qin, 1) == ['POS 1\n']
+        self.conn.sendall(b'S 2\n')
+        assert get_all(self.qin, 1) == ['POS 2\n']
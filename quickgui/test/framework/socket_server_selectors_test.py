@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import time
+import socket
+import threading
+import unittest
+from quickgui.framework.framing import HELLO, StreamDecoder
+from quickgui.framework.messages import Message
+from quickgui.framework.queues import NewLineQueue, DROP_NEWEST
+from quickgui.framework.quick_base import set_time_to_die
+from quickgui.framework.socket_server_selectors import SelectorQueueServer
+from quickgui.test.framework.helpers import wait_for, server_port
+
+
+class SelectorServerTest(unittest.TestCase):
+
+    def _start(self, **kwargs):
+        self.qin = NewLineQueue()
+        self.qout = NewLineQueue()
+        self.server = SelectorQueueServer('localhost', 0, self.qin, self.qout,
+                                          **kwargs)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.port = server_port('socket_server_selectors')
+
+    def tearDown(self):
+        set_time_to_die(True)
+        self.thread.join()
+        set_time_to_die(False)
+
+    def _connect(self, n):
+        socks = [socket.create_connection(('localhost', self.port))
+                 for i in range(n)]
+        assert wait_for(lambda: len(self.server.clients) == n)
+        return socks
+
+    def test_fan_out(self):
+        self._start()
+        text, binary = self._connect(2)
+        binary.sendall(HELLO)
+        text.sendall(b'MOVE 1\nST')
+        text.sendall(b'OP\n')
+        assert binary.recv(len(HELLO)) == HELLO
+        assert self.qin.get(timeout=1) == 'MOVE 1\n'
+        assert self.qin.get(timeout=1) == 'STOP\n'
+
+        self.qout.put(Message('POS', 1.5))
+        assert text.recv(100) == b'POS 1.5\n'
+
+        decoder = StreamDecoder()
+        decoder.binary = True
+        assert decoder.recv(binary) == [Message('POS', 1.5)]
+
+    def test_slow_client(self):
+        self._start(high_water=1000, slow_policy=DROP_NEWEST)
+        slow, = self._connect(1)
+
+        # Never read from the client, until its buffers are full
+        line = 'POS %s\n' % ('x' * 100000)
+        for i in range(1000):
+            self.qout.put(line)
+            if self.server.dropped > 0:
+                break
+            time.sleep(0.001)
+        assert wait_for(lambda: self.server.dropped > 0)
+        assert len(self.server.clients) == 1
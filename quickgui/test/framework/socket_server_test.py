@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+import time
+import socket
+import threading
+import unittest
+from quickgui.framework import stats
+from quickgui.framework.messages import Message, LastValueCache
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.quick_base import set_time_to_die
+from quickgui.framework.socket_server import get_server
+from quickgui.test.framework.helpers import wait_for, server_port
+
+
+
+
+class SocketServerTest(unittest.TestCase):
+
+    def _start(self, **kwargs):
+        self.qin = NewLineQueue()
+        self.qout = NewLineQueue()
+        self.thread = threading.Thread(target=get_server('localhost', 0,
+                                                         **kwargs),
+                                       args=(self.qin, self.qout))
+        self.thread.start()
+        self.port = server_port('socket_server')
+
+    def tearDown(self):
+        set_time_to_die(True)
+        self.thread.join()
+        set_time_to_die(False)
+
+    def _server_stats(self):
+        return stats.collect().get('socket_server:%d' % self.port)
+
+    def _receive(self, sock, n):
+        data = b''
+        while len(data) < n:
+            data += sock.recv(65536)
+        return data
+
+    def test_snapshot(self):
+        self._start(snapshot=True, snapshot_keys=['pos', 'status'])
+        self.qout.put_many(['POS 1\n', 'STATUS idle\n', 'EVENT done\n',
+                            Message('POS', 2.5)])
+        assert wait_for(lambda: self._server_stats()['cached'] == 2)
+
+        client = socket.create_connection(('localhost', self.port))
+        assert wait_for(lambda: len(self._server_stats()['clients']) == 1)
+        self.qout.put('STATUS moving\n')
+
+        expected = b'POS 2.5\nSTATUS idle\nSTATUS moving\n'
+        assert self._receive(client, len(expected)) == expected
+        client.close()
+
+    def test_no_snapshot(self):
+        self._start()
+        self.qout.put('POS 1\n')
+        time.sleep(0.1)
+
+        client = socket.create_connection(('localhost', self.port))
+        assert wait_for(lambda: len(self._server_stats()['clients']) == 1)
+        self.qout.put('POS 2\n')
+        assert self._receive(client, 6) == b'POS 2\n'
+        client.close()
+
+
+class LastValueCacheTest(unittest.TestCase):
+
+    def test_cache(self):
+        cache = LastValueCache()
+        cache.update(['A 1\n', Message('B', 2), '\n', 'a 3\n'])
+        assert cache.snapshot() == ['a 3\n', Message('B', 2)]
+        assert len(cache) == 2
+
+    def test_maxsize(self):
+        cache = LastValueCache(maxsize=2)
+        cache.update(['A 1\n', 'B 1\n', 'A 2\n', 'C 1\n'])
+        assert cache.snapshot() == ['B 1\n', 'C 1\n']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+import time
+import socket
+import threading
+import unittest
+from quickgui.framework import stats, tracing
+from quickgui.framework.framing import HELLO, StreamDecoder, encode_frames
+from quickgui.framework.messages import Message
+from quickgui.framework.queues import NewLineQueue
+from quickgui.framework.quick_base import set_time_to_die
+from quickgui.framework.socket_server_threaded import get_server
+from quickgui.framework.tracing import tracer
+from quickgui.test.framework.helpers import wait_for, server_port
+
+
+class ThreadedServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.qin = NewLineQueue()
+        self.qout = NewLineQueue()
+        self.thread = threading.Thread(target=get_server('localhost', 0,
+                                                         snapshot=True),
+                                       args=(self.qin, self.qout))
+        self.thread.start()
+        self.port = server_port('socket_server_threaded')
+
+    def tearDown(self):
+        set_time_to_die(True)
+        self.thread.join()
+        set_time_to_die(False)
+
+    def _clients(self):
+        return stats.collect().get('socket_server_threaded:%d' % self.port,
+                                   {'clients': []})['clients']
+
+    def test_fan_out(self):
+        text = socket.create_connection(('localhost', self.port))
+        binary = socket.create_connection(('localhost', self.port))
+        binary.sendall(HELLO + encode_frames([Message('MOVE', 2)]))
+        assert self.qin.get(timeout=1) == Message('MOVE', 2)
+        assert wait_for(lambda: len(self._clients()) == 2)
+
+        n = 1000
+        self.qout.put(Message('POS', 1.5))
+        self.qout.put_many(['N %d\n' % i for i in range(n)])
+
+        data = b''
+        expected = b'POS 1.5\n' + b''.join(b'N %d\n' % i for i in range(n))
+        while len(data) < len(expected):
+            data += text.recv(65536)
+        assert data == expected
+
+        assert binary.recv(len(HELLO)) == HELLO
+        decoder = StreamDecoder()
+        decoder.binary = True
+        items = []
+        while len(items) < n + 1:
+            items += decoder.recv(binary)
+        assert items == [Message('POS', 1.5)] + ['N %d\n' % i for i in range(n)]
+
+        assert wait_for(lambda: sorted(c['bytes_out'] for c in self._clients())
+                        == sorted([len(expected), len(HELLO) +
+                                    len(encode_frames(items))]))
+        text.close()
+        binary.close()
+
+    def test_snapshot(self):
+        self.qout.put_many(['POS 1\n', 'STATUS idle\n', Message('POS', 2.5)])
+        assert wait_for(lambda: self.qout.qsize() == 0)
+        time.sleep(0.1)
+
+        client = socket.create_connection(('localhost', self.port))
+        assert wait_for(lambda: len(self._clients()) == 1)
+        self.qout.put('STATUS moving\n')
+
+        data = b''
+        expected = b'POS 2.5\nSTATUS idle\nSTATUS moving\n'
+        while len(data) < len(expected):
+            data += client.recv(65536)
+        assert data == expected
+        client.close()
+
+    def _recv_traced(self, n_clients):
+        clients = [socket.create_connection(('localhost', self.port))
+                   for i in range(n_clients)]
+        assert wait_for(lambda: len(self._clients()) == n_clients)
+
+        tracing.enable(sample_rate=1)
+        try:
+            self.qout.put(tracer.sample(Message('POS', 1.0)))
+            for client in clients:
+                data = b''
+                while len(data) < len(b'POS 1.0\n'):
+                    data += client.recv(65536)
+                assert data == b'POS 1.0\n'
+                client.close()
+            return list(tracer.traces)
+        finally:
+            tracing.disable()
+            tracer.clear()
+
+    def test_traced(self):
+        '''The trace includes the wait in the client queue'''
+
+        (cmd, trace), = self._recv_traced(1)
+        assert [hop for hop, t in trace.hops] == \
+            ['send', 'queue_put', 'queue_get', 'queue_put', 'queue_get',
+             'socket_send']
+
+    def test_traced_fan_out(self):
+        '''Each client has its own trace'''
+
+        traces = self._recv_traced(3)
+        assert len(traces) == 3
+        assert len({id(trace.hops) for cmd, trace in traces}) == 3
+        for cmd, trace in traces:
+            assert [hop for hop, t in trace.hops] == \
+                ['send', 'queue_put', 'queue_get', 'queue_put', 'queue_get',
+                 'socket_send']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import pickle
+import tempfile
+import unittest
+from quickgui.framework import tracing
+from quickgui.framework.framing import StreamDecoder, HELLO, encode_frames
+from quickgui.framework.queues import NewLineQueue, MultiQueue
+from quickgui.framework.quick_base import QuickBase, handler_float
+from quickgui.framework.tracing import tracer, TracedMessage
+
+
+class Receiver(QuickBase):
+
+    @handler_float('POS')
+    def pos(self, value):
+        self.pos_value = value
+
+
+class TracingTest(unittest.TestCase):
+
+    def setUp(self):
+        tracing.enable(sample_rate=1)
+
+    def tearDown(self):
+        tracing.disable()
+        tracer.clear()
+
+    def test_hops(self):
+
+        qout = MultiQueue(2, NewLineQueue)
+        sender = QuickBase(NewLineQueue(), qout)
+        receiver = Receiver(qout[0], NewLineQueue())
+
+        sender.send('POS', 1.5)
+        msg, = qout[0].get_many(block=False)
+        assert isinstance(msg, TracedMessage)
+
+        # Through a binary socket connection
+        decoder = StreamDecoder()
+        msg, = decoder.feed(HELLO + encode_frames([msg]))
+        receiver.dispatch(msg)
+        assert receiver.pos_value == 1.5
+
+        (cmd, trace), = tracer.traces
+        assert cmd == 'POS'
+        assert [hop for hop, t in trace.hops] == \
+            ['send', 'queue_put', 'queue_get', 'socket_send', 'socket_recv',
+             'dispatch', 'done']
+        assert 'socket_send>socket_recv' in tracer.stats()['hops']
+
+        # The copy in the other queue has its own trace
+        other, = qout[1].get_many(block=False)
+        assert len(other.trace.hops) == 3
+        assert pickle.loads(pickle.dumps(other)).trace.hops == other.trace.hops
+
+        path = os.path.join(tempfile.mkdtemp(), 'trace.json')
+        tracing.export_chrome(path)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        assert len(events) == len(trace.hops) - 1
+
+    def test_sampling(self):
+
+        tracing.enable(sample_rate=0.1)
+        qout = NewLineQueue()
+        sender = QuickBase(NewLineQueue(), qout)
+        for i in range(100):
+            sender.send('POS', i)
+
+        traced = [msg for msg in qout.get_many(block=False)
+                  if isinstance(msg, TracedMessage)]
+        assert len(traced) == 10